@@ -1,10 +1,27 @@
 from flask import Flask, request, jsonify, make_response, Response
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from lib.globals import *
 from lib.database import *
+from lib.wire import *
+from lib.compression import *
+from lib.session import *
+from lib.planner import *
+from lib.decomposer import *
+from lib.collector import *
+from lib.partition import *
+from lib.copartition import *
+from lib.catalog import *
+from lib.manifest import *
+from lib.progress import *
+from lib.indexing import *
+from lib.topology import *
+from lib.generation import *
+from lib.cache import *
 import os
 import subprocess
 import requests
+import queue
+import sqlparse
 import configparser
 import json
 
@@ -12,144 +29,440 @@ app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
 aggregator = None
 db = None
+compression = None
+sessions = None
+network = None
+collector = None
+sink = None
+fanout = None
+partitioning = None
+catalog = None
+manifest = None
+manifesting = None
+loading = None
+indexing = None
+workload = {}
+index_plan = []
+topology = None
+tree_fanout = None
+progress = InitProgress()
+generation = InitProgress()
+generated = threading.Event()
+init_timeout = None
+generating = None
+worker_tables = []
+cache = None
+partition_key = None
+transfer_lock = threading.Lock()
+
+def record_transfer(query_id: str, endpoint: str, stats: dict) -> None:
+    """Helper function to keep per-query compression stats for *_network_latency.json."""
+    stats["endpoint"] = endpoint
+    with transfer_lock:
+        aggregator.transfer_stats[query_id].append(stats)
+
+def pop_transfers(query_id: str) -> list[dict]:
+    with transfer_lock:
+        return aggregator.transfer_stats.pop(query_id, [])
+
+def insertion_files(message: InitializationMessage) -> dict[str, str]:
+    """Helper function to map each table a worker loads to its file."""
+    return {path.split('/')[-1].replace('.tbl', '').split('_')[-1]: path for path in message.insertion_tables}
+
+def send_init_message(worker: str, message: InitializationMessage) -> tuple[dict, dict, dict]:
+    """Helper function to send one worker its (compressed) initialization message and wait for its load."""
+    endpoint = aggregator.workers[int(worker) - 1] + "/receive_init"
+    tables = insertion_files(message)
+    held = list(tables) + list(message.generated_tables)
+    payload = {
+        "worker_type": message.worker_type.value,
+        "files": tables,
+        "checksums": {table: manifest.checksum(path) for table, path in tables.items()},
+        # DEFAULT architecture only, so every worker generates one of number_of_workers chunks
+        "generate": {"scale_factor": generation_settings()["scale_factor"], "chunks": len(aggregator.worker_ids), "tables": message.generated_tables} if message.generated_tables else None,
+        "indexes": [spec._asdict() for spec in index_plan if spec.table in held],
+        "workload": runnable_queries(workload, held),
+        "leader_address": message.leader_address,
+        "follower_addresses": message.follower_addresses,
+        "leader_addresses": message.leader_addresses
+    }
+    body, headers, stats = compression.encode(json.dumps(payload).encode("utf-8"), JSON_CONTENT_TYPE)
+    stats["endpoint"] = endpoint
+
+    progress.update(worker, "loading", tables=len(held))
+    try:
+        response = sessions.post(endpoint, data=body, headers=headers, timeout=init_timeout)
+    except requests.exceptions.RequestException as e:
+        progress.update(worker, "failed", error=str(e))
+        return stats, None, None
+    if response.status_code != 200:
+        progress.update(worker, "failed", error=f"{response.status_code}: {response.text[:200]}")
+        return stats, None, None
+
+    loaded, indexes = response.json().get("loaded", {}), response.json().get("indexes", {})
+    for table in message.generated_tables:
+        if table in loaded:
+            catalog.record_rows(table, worker, loaded[table]["rows"])
+    progress.update(worker, "ready", loaded=len(loaded), rows=sum(table["rows"] for table in loaded.values()), indexes=len(indexes.get("indexes", {})))
+    return stats, loaded, indexes
+
+def send_init_messages(messages: dict[str, InitializationMessage]) -> dict:
+    """Helper function to send every worker its initialization message at once (init takes as long as the slowest worker)."""
+    futures = {worker: fanout.submit(send_init_message, worker, messages[worker]) for worker in messages}
+    transfers, loads, indexes, failed = [], {}, {}, []
+    for worker, future in futures.items():
+        stats, loaded, built = future.result()
+        transfers.append(stats)
+        if loaded is None:
+            failed.append(worker)
+        else:
+            loads[worker], indexes[worker] = loaded, built
+
+    # Save init transfer stats next to the per-query network latency files
+    sink.write("query-results/init_network_latency.json", {"transfers": transfers, "compression": summarize_transfers(transfers)})
+    sink.write("query-results/init_load.json", loads)
+    sink.write("query-results/init_indexes.json", {"plan": [spec._asdict() for spec in index_plan], "workers": indexes})
+    if failed:
+        raise RuntimeError(f"Workers {failed} failed to initialize")
+    return summarize_indexes(indexes)
+
+def summarize_indexes(indexes: dict[str, dict]) -> dict:
+    """Helper function to sum up index build cost and the per-query speedup across workers."""
+    speedups = collections.defaultdict(list)
+    for report in indexes.values():
+        for query, timing in report.get("queries", {}).items():
+            if timing["speedup"] is not None:
+                speedups[query].append(timing["speedup"])
+    return {
+        "planned": len(index_plan),
+        "build_seconds": {worker: report.get("build_seconds") for worker, report in indexes.items()},
+        "speedup": {query: round(sum(values) / len(values), 3) for query, values in sorted(speedups.items())}
+    }
+
+def register_workload(queries: dict[str, str]) -> None:
+    """Helper function to plan the workload indexes workers build after loading."""
+    global workload, index_plan
+    workload = queries if indexing.getboolean("enabled") else {}
+    primary_keys = TPCH_PRIMARY_KEYS if loading.getboolean("primary_keys") else None
+    kinds = [kind.strip() for kind in indexing["kinds"].split(",") if kind.strip()]
+    index_plan = plan_indexes(workload, aggregator.table_schemas, kinds, primary_keys, int(indexing["min_queries"]))
+    print(f"Planned {len(index_plan)} workload indexes for {len(workload)} queries")
+
+def report_partitions(messages: dict[str, InitializationMessage], measure: bool = True) -> dict:
+    """Helper function to count the rows each worker loads and report the partition imbalance."""
+    if measure:
+        catalog.measure({id: insertion_files(messages[id]) for id in messages})
+    report = catalog.report()
+    for table, entry in report["tables"].items():
+        print(f"{table}: {entry['method']} {entry['rows']} (imbalance {entry['imbalance']})")
+    print(f"Rows per worker: {report['worker_rows']} (imbalance {report['imbalance']})")
+    sink.write("query-results/init_partitions.json", report)
+    return report
 
-def smart_split(
-    messages: list[InitializationMessage], 
-    left_table: str, right_table: str, left_key_pos: int, right_key_pos: int,
-    nodes: list[str], node_ids: list[str], message_iterator: list[str]
-) -> None:
-    global aggregator
-
-    left_file_path = f"{aggregator.mount_point}/{left_table}.tbl"
-    left_buckets = dict()
-    with open(left_file_path, 'r') as file:
-        lines = file.readlines()
-        for line in lines:
-            left_key = int(line.split('|')[left_key_pos])
-            left_buckets[left_key] = line
-
-    total_lines = len(left_buckets)
-
-    # Calculate the number of lines each node should process
-    lines_per_node = total_lines // len(nodes)
-
-    # Generate part and lineitem files
-    node_file_paths_left = {id: f'{aggregator.mount_point}/worker_{id}_{left_table}.tbl' for id in node_ids}
-    for id in node_file_paths_left:
-        open(node_file_paths_left[id], 'w').close()
-    node_file_paths_right = {id: f'{aggregator.mount_point}/worker_{id}_{right_table}.tbl' for id in node_ids}
-    for id in node_file_paths_right:
-        open(node_file_paths_right[id], 'w').close()
-    
-    # Temporary buffers to batch the writes for each node
-    left_buffers = collections.defaultdict(list)
-    right_buffers = collections.defaultdict(list)
-    seen = set()
-
-    # Split the lineitems and parts
-    right_file_path = f"{aggregator.mount_point}/{right_table}.tbl"
-    with open(right_file_path, 'r') as file:
-        for line in file:
-            right_key = int(line.split('|')[right_key_pos])
-            node_id = (right_key // lines_per_node) % len(node_ids)
-            # Add lines to buffers
-            right_buffers[node_ids[node_id]].append(line)
-            if right_key not in seen:
-                left_buffers[node_ids[node_id]].append(left_buckets[right_key])
-                seen.add(right_key)
-
-    # Write all the batched data to the corresponding node files at once
-    for node_id in node_ids:
-        with open(node_file_paths_left[node_id], 'a') as f:
-            f.writelines(left_buffers[node_id])  # Write all lines at once
-        with open(node_file_paths_right[node_id], 'a') as f:
-            f.writelines(right_buffers[node_id])  # Write all lines at once
-
-    # Add partition-ed table file to be inserted
-    for id in message_iterator:
-        messages[id].insertion_tables.append(node_file_paths_left[id])
-        messages[id].insertion_tables.append(node_file_paths_right[id])
-
-    print(f"Data has been split into {len(nodes)} files: {node_file_paths_left}, {node_file_paths_right}")
-
-def setup_leader_followers(messages: list[InitializationMessage]) -> None:
+"""
+Co-partitions the tables a sample query joins (see lib/copartition.py)
+------------------------------------------------------------------------------------------
+Steps run in plan order: hashed tables go to key % nodes, or with scheme=range to equi-depth
+key ranges sampled from the root table, and following tables go to every node that received a
+parent row with the same key, using the (value, node mask) pairs the parent exported while it
+was being routed.
+------------------------------------------------------------------------------------------
+"""
+def copartition_split(messages: list[InitializationMessage], plan: CoPartitionPlan, nodes: list[str], node_ids: list[str], message_iterator: list[str]) -> None:
     global aggregator
 
-    for i in range(1, len(aggregator.worker_ids) - 1, 3):
-        # Begin tracking leader
-        aggregator.leader_ids.append(aggregator.worker_ids[i])
-        aggregator.leaders.append(aggregator.workers[i])
-        messages[aggregator.worker_ids[i]].worker_type = WorkerType.LEADER
-        messages[aggregator.worker_ids[i]].follower_addresses.extend([aggregator.workers[i - 1], aggregator.workers[i + 1]])
-
-        # Begin tracking followers
-        aggregator.follower_ids.extend([aggregator.worker_ids[i - 1], aggregator.worker_ids[i + 1]])
-        aggregator.followers.extend([aggregator.workers[i - 1], aggregator.workers[i + 1]]) 
+    parallelism = int(partitioning["parallelism"])
+    executor = ProcessPoolExecutor(max_workers=parallelism) if parallelism > 1 else None
+    exports = {}
+    node_file_paths = {}
+    try:
+        # Co-located (hashed) tables share one route on the root's key domain
+        scheme = partitioning.get("scheme", "hash")
+        boundaries = None
+        if scheme == "range" and plan.routed:
+            root = plan.routed[0]
+            columns = [column for column, _ in aggregator.table_schemas[root.table]]
+            sample = sample_keys(f"{aggregator.mount_point}/{root.table}.tbl", columns.index(root.column), int(partitioning["sample_size"]))
+            boundaries = equi_depth_boundaries(sample, len(node_ids))
+        hashed = ("range", boundaries) if boundaries is not None else ("modulo", len(node_ids))
+
+        # Nodes whose partitions end up unioned only need one copy of a followed row
+        if aggregator.mode == AggregatorMode.LOCAL:
+            groups = [list(range(len(node_ids)))]
+        elif aggregator.arch == AggregatorArchitecture.FOLLOWER:
+            groups = [[node_ids.index(id) for id in topology.leaf_children(leader)] for leader in loading_leaders()]
+        else:
+            groups = [[pos] for pos in range(len(node_ids))]
 
-        # Assign address to the two followers
-        messages[aggregator.worker_ids[i - 1]].leader_address = aggregator.workers[i]
-        messages[aggregator.worker_ids[i - 1]].worker_type = WorkerType.FOLLOWER
-        messages[aggregator.worker_ids[i + 1]].leader_address = aggregator.workers[i]
-        messages[aggregator.worker_ids[i + 1]].worker_type = WorkerType.FOLLOWER
+        for step in plan.routed:
+            columns = [column for column, _ in aggregator.table_schemas[step.table]]
+            if step.method == "hash":
+                route = hashed
+                catalog.record(step.table, "range" if boundaries is not None else "hash", step.column, boundaries.tolist() if boundaries is not None else None)
+            else:
+                catalog.record(step.table, "follow", f"{step.column} = {step.parent}.{step.parent_column}")
+                values, masks = exports[(step.parent, step.parent_column)]
+                route = ("follow", values, dedupe_masks(masks, groups), len(node_ids))
+
+            node_file_paths[step.table] = {id: f'{aggregator.mount_point}/worker_{id}_{step.table}.tbl' for id in node_ids}
+            exported = plan.exports(step.table)
+            routed = route_file(f"{aggregator.mount_point}/{step.table}.tbl", columns.index(step.column), route,
+                                [node_file_paths[step.table][id] for id in node_ids], executor, int(partitioning["chunk_size"]),
+                                [columns.index(column) for column in exported])
+            for column in exported:
+                exports[(step.table, column)] = routed[columns.index(column)]
+            print(f"Data has been split into {len(nodes)} files ({catalog.entries[step.table].method} on {step.column}): {node_file_paths[step.table]}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # Add partition-ed table files to be inserted
+    for table in node_file_paths:
+        for id in message_iterator:
+            messages[id].insertion_tables.append(node_file_paths[table][id])
+
+# Arranges the workers into a tree_fanout-ary aggregation tree (False with fewer than two workers)
+def setup_leader_followers(messages: list[InitializationMessage]) -> bool:
+    global aggregator, topology
+
+    topology = build_aggregation_tree(aggregator.worker_ids, tree_fanout)
+    if topology is None:
+        return False
+    address = dict(zip(aggregator.worker_ids, aggregator.workers))
+
+    # Begin tracking the leaders that report to the aggregator and the followers holding partitions
+    aggregator.leader_ids, aggregator.leaders = list(topology.roots), [address[id] for id in topology.roots]
+    aggregator.follower_ids, aggregator.followers = topology.followers, [address[id] for id in topology.followers]
+
+    for id in topology.leaders:
+        messages[id].worker_type = WorkerType.LEADER
+        messages[id].follower_addresses.extend(address[child] for child in topology.leaf_children(id))
+        messages[id].leader_addresses.extend(address[child] for child in topology.leader_children(id))
+    for id in topology.followers:
+        messages[id].worker_type = WorkerType.FOLLOWER
+
+    # Assign every node the address of the leader it reports to (roots report to the aggregator)
+    for id, parent in topology.parents.items():
+        if parent is not None:
+            messages[id].leader_address = address[parent]
+    print(f"Aggregation tree: {topology}")
+    return True
+
+def loading_leaders() -> list[str]:
+    """Helper function to list the leaders that load follower partitions (and so need the replicated tables)."""
+    return [id for id in topology.leaders if topology.leaf_children(id)]
 
 # Sets up the tables to be partitioned evenly for default and leader-follower
 def setup_partitions(messages: list[InitializationMessage], nodes: list[str], node_ids: list[str], message_iterator: list[str], distributed_iterator: list[str]) -> None:
     global aggregator, db
 
-    # Begin splitting on all valid partitioned tables
-    for table in aggregator.partition:
-        # To save time on initialization, we will split the table files into smaller files
-        file_path = f"{aggregator.mount_point}/{table}.tbl"
-        
-        # Read number of lines in the file
-        with open(file_path, 'r') as file:
-            total_lines = sum(1 for _ in file)
-
-        # Calculate the number of lines each node should process
-        lines_per_node = total_lines // len(nodes)
-        # Handle cases where the lines are not evenly divisible
-        remainder = total_lines % len(nodes)
-
-        # Define files for each node
-        node_file_paths = {id: f'{aggregator.mount_point}/worker_{id}_{table}.tbl' for id in node_ids}
-        for id in node_file_paths:
-            open(node_file_paths[id], 'w').close()
-        
-        # Begin splitting process
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-            
-            start_line = 0
-            for pos in range(len(nodes)):
-                end_line = start_line + lines_per_node + (remainder if pos == len(nodes) - 1 else 0)
-                node_file = node_file_paths[node_ids[pos]]
-
-                # Write the assigned lines to the node's file
-                with open(node_file, 'w') as node_file:
-                    for line_num in range(start_line, end_line):
-                        node_file.write(lines[line_num])
-                
-                start_line = end_line
-        
+    # Workers generate their own dbgen chunk of these tables instead of reading a split of the shared file
+    # (leaders load their followers' files, so only without followers)
+    generated = [table for table in aggregator.partition if table in worker_tables] if aggregator.arch == AggregatorArchitecture.DEFAULT else []
+    split = [table for table in aggregator.partition if table not in generated]
+    ensure_generated(split + (aggregator.non_partition if aggregator.mode == AggregatorMode.DISTRIBUTED else []))
+
+    # Define files for each node
+    node_file_paths = {table: {id: f'{aggregator.mount_point}/worker_{id}_{table}.tbl' for id in node_ids} for table in split}
+    jobs = {f"{aggregator.mount_point}/{table}.tbl": [node_file_paths[table][id] for id in node_ids] for table in split}
+
+    # Split on newline-aligned byte ranges of the memory-mapped files (no decoding, kernel-side copies),
+    # spreading tables and chunks of large tables across processes when parallelism allows
+    parallelism = int(partitioning["parallelism"])
+    if parallelism > 1 and jobs:
+        with ProcessPoolExecutor(max_workers=parallelism) as executor:
+            split_files(jobs, executor, int(partitioning["chunk_size"]))
+    else:
+        for file_path, destinations in jobs.items():
+            split_file(file_path, destinations)
+
+    for table in generated:
+        catalog.record(table, "generated", f"dbgen -C {len(node_ids)}")
+        for step, id in enumerate(node_ids, start=1):
+            messages[id].generated_tables[table] = step
+        print(f"Workers {node_ids} generate their own chunk of {table}")
+
+    # Begin adding all valid partitioned tables
+    for table in split:
+        catalog.record(table, "split")
         # Add partition-ed table file to be inserted
         for id in message_iterator:
-            messages[id].insertion_tables.append(node_file_paths[id])
+            messages[id].insertion_tables.append(node_file_paths[table][id])
 
-        print(f"Data has been split into {len(nodes)} files: {node_file_paths}")
+        print(f"Data has been split into {len(nodes)} files: {node_file_paths[table]}")
 
     # Add non-partitioned tables
     if aggregator.mode == AggregatorMode.DISTRIBUTED:      
+        for table in aggregator.non_partition:
+            catalog.record(table, "replicated")
         for id in distributed_iterator:
             for table in aggregator.non_partition:
                 messages[id].insertion_tables.append(f'{aggregator.mount_point}/{table}.tbl')
     
     # Since queries will be processed locally, we will insert non-partitioned tables
     if aggregator.mode == AggregatorMode.LOCAL:
-        file = open(f'{aggregator.mount_point}/load.sql', 'w')
-        for table in aggregator.non_partition:
-            file.write(f"\copy {table} FROM '{aggregator.mount_point}/{table}.tbl' DELIMITER '|' CSV;\n")
-        file.close()
-        subprocess.run([f"cd {aggregator.mount_point} && psql -U {db.user} -d {db.name} -f load.sql"], check=True, shell=True)
+        load_local_tables()
+
+def load_local_tables() -> None:
+    """Helper function to load the non-partitioned tables into the aggregator (LOCAL mode), skipping unchanged ones."""
+    ensure_generated(aggregator.non_partition)
+    files = {table: f'{aggregator.mount_point}/{table}.tbl' for table in aggregator.non_partition}
+    loaded = db.load_files(files, {table: manifest.checksum(path) for table, path in files.items()}, exclusive=True, **loading_options(loading))
+    if loaded:
+        cache.invalidate()
+    print(f"Loaded {list(loaded)} on the aggregator, {len(files) - len(loaded)} tables unchanged")
+    if indexing.getboolean("enabled"):
+        db.prepare_workload(list(loaded), list(files), [spec._asdict() for spec in index_plan], parallelism=int(indexing["parallelism"]), measure=False)
+
+def partition_settings(endpoint: str, **settings) -> dict:
+    """Helper function to describe a partitioning for the manifest (anything that changes the worker files)."""
+    return {
+        "endpoint": endpoint,
+        "arch": aggregator.arch.value,
+        "mode": aggregator.mode.value,
+        "workers": aggregator.worker_ids,
+        "fanout": tree_fanout if aggregator.arch == AggregatorArchitecture.FOLLOWER else None,
+        "scheme": partitioning.get("scheme", "hash"),
+        "sample_size": partitioning.get("sample_size"),
+        "data": manifest.data_version,
+        **settings
+    }
+
+def save_layout(settings: dict, messages: dict[str, InitializationMessage], report: dict) -> None:
+    """Helper function to record the worker files and init messages of a partitioning in the manifest."""
+    if not manifesting.getboolean("enabled"):
+        return
+    layout = {
+        "arch": aggregator.arch.value,
+        "partition": aggregator.partition,
+        "non_partition": aggregator.non_partition,
+        "leader_ids": aggregator.leader_ids,
+        "leaders": aggregator.leaders,
+        "follower_ids": aggregator.follower_ids,
+        "followers": aggregator.followers,
+        "messages": {id: {
+            "worker_type": message.worker_type.value,
+            "insertion_tables": message.insertion_tables,
+            "leader_address": message.leader_address,
+            "follower_addresses": message.follower_addresses,
+            "leader_addresses": message.leader_addresses,
+            "generated_tables": message.generated_tables
+        } for id, message in messages.items()},
+        "topology": topology.report() if topology is not None else None,
+        "catalog": report
+    }
+    manifest.record_partition(settings, [path for message in messages.values() for path in message.insertion_tables], layout)
+    manifest.save()
+
+def restore_layout(settings: dict) -> dict[str, InitializationMessage]:
+    """Helper function to rebuild the init messages of a partitioning the manifest holds intact files for (None otherwise)."""
+    global topology
+    if not manifesting.getboolean("enabled"):
+        return None
+    layout = manifest.find_partition(settings, manifesting.get("verify", "checksum"))
+    if layout is None:
+        return None
+
+    aggregator.arch = AggregatorArchitecture(layout["arch"])
+    aggregator.partition = layout["partition"]
+    aggregator.non_partition = layout["non_partition"]
+    aggregator.leader_ids, aggregator.leaders = layout["leader_ids"], layout["leaders"]
+    aggregator.follower_ids, aggregator.followers = layout["follower_ids"], layout["followers"]
+    topology = AggregationTree.from_report(layout["topology"]) if layout.get("topology") else None
+    catalog.restore(layout["catalog"])
+    if aggregator.mode == AggregatorMode.LOCAL:
+        load_local_tables()
+
+    print(f"Reusing partitioned files from {manifest.path}")
+    return {id: InitializationMessage(WorkerType(message["worker_type"]), message["insertion_tables"], message["leader_address"], message["follower_addresses"], message.get("leader_addresses"), message.get("generated_tables"))
+            for id, message in layout["messages"].items()}
+
+"""
+Partitions the data and initializes every worker, off the request thread
+------------------------------------------------------------------------------------------
+@settings: the partition settings the manifest keys reusable worker files by
+@partition: builds the init messages when the manifest has nothing to reuse
+Waits for data generation first. Workers load concurrently, each bounded by the [INIT]
+timeout; progress and the final partition report are served by /init_status.
+------------------------------------------------------------------------------------------
+"""
+def initialize(settings: dict, partition) -> None:
+    global partition_key
+    try:
+        # Workers are about to (re)load, so nothing cached still describes their data
+        cache.invalidate()
+        # The tables may still be generating when the first init request arrives
+        progress.set_phase("generating")
+        generated.wait()
+        if generation.state != "ready":
+            raise RuntimeError(f"Data generation failed: {generation.error}")
+
+        # Reuse the worker files of an identical earlier partitioning when they are still intact
+        progress.set_phase("partitioning")
+        messages = restore_layout(settings)
+        restored = messages is not None
+        if not restored:
+            messages = partition()
+
+        print(f"Messages: {messages}")
+        progress.set_phase("measuring")
+        report = report_partitions(messages, measure=not restored)
+        if not restored:
+            save_layout(settings, messages, report)
+
+        # Send out initialization commands to all workers
+        progress.set_phase("loading")
+        indexes = send_init_messages(messages)
+
+        # Rows of the tables workers generate themselves are only known once they have loaded them
+        if any(message.generated_tables for message in messages.values()):
+            report = report_partitions(messages, measure=False)
+            save_layout(settings, messages, report)
+
+        partition_key = Manifest.partition_key(settings)
+        cache.invalidate()
+        aggregator.initialized = True
+        progress.finish({**report, "indexes": indexes})
+    except Exception as e:
+        print(f"Initialization failed: {e}")
+        progress.fail(str(e))
+
+def start_initialization(settings: dict, partition) -> None:
+    """Helper function to run initialize on a background thread."""
+    if progress.begin(aggregator.worker_ids):
+        threading.Thread(target=initialize, args=(settings, partition), daemon=True).start()
+
+def smart_partition(sample_query: str, number_query: int) -> dict[str, InitializationMessage]:
+    """Helper function to co-partition the tables of the sample query and build the init messages."""
+    # Work out which tables to co-partition on their join keys from the sample query
+    ensure_generated(list(aggregator.table_schemas))
+    sizes = {table: os.path.getsize(f"{aggregator.mount_point}/{table}.tbl") for table in aggregator.table_schemas}
+    plan = plan_copartition(sample_query, aggregator.table_schemas, sizes)
+    print(f"Query {number_query} partitioning: {plan}")
+    if plan.steps:
+        routed = [step.table for step in plan.routed]
+        aggregator.partition = [table for table in DEFAULT_ALL_TABLES if table not in routed and table not in plan.replicated]
+        aggregator.non_partition = plan.replicated
+
+    # Setup messages to be broadcasted to all worker nodes
+    messages = {id: InitializationMessage(WorkerType.WORKER) for id in aggregator.worker_ids}
+
+    # Follower represents Leader-Follower specialization
+    # Workers form a tree_fanout-ary aggregation tree, followers hold the partitions
+    if aggregator.arch == AggregatorArchitecture.FOLLOWER:
+        if setup_leader_followers(messages):
+            # Setups partitions for leaders and followers
+            copartition_split(messages, plan, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids)
+            setup_partitions(messages, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids, loading_leaders())
+        else:
+            aggregator.arch = AggregatorArchitecture.DEFAULT
+
+    # Default is traditional multiple worker nodes with no specialization
+    if aggregator.arch == AggregatorArchitecture.DEFAULT:
+        copartition_split(messages, plan, aggregator.workers, aggregator.worker_ids, messages)
+        setup_partitions(messages, aggregator.workers, aggregator.worker_ids, messages, messages)
+
+    return messages
 
 """
 Receives initialization configurations (program determined)
@@ -158,6 +471,7 @@ Receives initialization configurations (program determined)
 @mode: LOCAL|DISTRIBUTED
 @sample_query: SELECT ....
 @number_query: 14
+@workload (optional, queries workers build indexes for, defaults to the sample query): {"12.sql": "select ..."}
 ------------------------------------------------------------------------------------------
 """
 @app.route('/receive_smart_init', methods=['POST'])
@@ -167,6 +481,8 @@ def receive_smart_init() -> Response:
     # Already initialized, skip this process and let manager know
     if aggregator.initialized:
         return make_response("Initialized Already", 201)
+    if progress.running:
+        return make_response(jsonify(progress.snapshot()), 202)
     
     # Initialize the aggregator with setup conditions
     aggregator.arch = AggregatorArchitecture(request.json.get('arch'))
@@ -175,122 +491,32 @@ def receive_smart_init() -> Response:
     number_query = request.json.get('number_query')
     aggregator.partition = DEFAULT_SMART_PARTITION
     aggregator.non_partition = DEFAULT_SMART_NON_PARTITION
+    register_workload(request.json.get('workload') or {"sample": sample_query})
 
-    # Parse the tables from the sample SQL query
-    tables = extract_tables(sqlparse.parse(sample_query)[0])
-    # Separate tables into main query and subquery (inner 'FROM')
-    main_query_tables = [t for t in tables if not t['subquery']]
-    subquery_tables = [t for t in tables if t['subquery']]
-    main_tables = [t["table"] for t in main_query_tables]
-    sub_tables = [t["table"] for t in subquery_tables]
+    # Partition and load in the background; the manager polls /init_status
+    settings = partition_settings("smart", sample_query=normalize_sql(sample_query))
+    start_initialization(settings, lambda: smart_partition(sample_query, number_query))
+    return make_response(jsonify(progress.snapshot()), 202)
 
+def uniform_partition() -> dict[str, InitializationMessage]:
+    """Helper function to split the requested tables evenly and build the init messages."""
     # Setup messages to be broadcasted to all worker nodes
     messages = {id: InitializationMessage(WorkerType.WORKER) for id in aggregator.worker_ids}
 
-    # Only 1 table in usage (split on all tables)
-    if len(main_query_tables) == 1 and len(subquery_tables) == 0:
-        aggregator.partition = DEFAULT_ALL_TABLES
-        aggregator.non_partition = []
-
-        # Follower represents Leader-Follower specialization
-        # Early Configuration, clusters will be setup with 1 Leader and 2 Followers 
-        # Only power of 3 node counts are supported
-        if aggregator.arch == AggregatorArchitecture.FOLLOWER:
-            if len(aggregator.workers) % 3 == 0:
-                # Get all the ids that will correlate to the leaders
-                setup_leader_followers(messages)
-
-                # Setups partitions for leaders and followers
-                setup_partitions(messages, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids, aggregator.leader_ids)
-            else:
-                aggregator.arch = AggregatorArchitecture.DEFAULT
-
-        # Default is traditional multiple worker nodes with no specialization
-        if aggregator.arch == AggregatorArchitecture.DEFAULT:
-            setup_partitions(messages, aggregator.workers, aggregator.worker_ids, messages, messages)
-    
-    # Only 2 tables in usage (split on all tables but manually split on the WHERE key clause)
-    if len(main_query_tables) == 2 and len(subquery_tables) == 0:
-        aggregator.non_partition = []
-
-        # Handle query 14 (build new lineitem and part tables)
-        if number_query == 14:
-            aggregator.partition = [table for table in DEFAULT_ALL_TABLES if table not in main_tables]
-
-            if aggregator.arch == AggregatorArchitecture.FOLLOWER:
-                if len(aggregator.workers) % 3 == 0:
-                    # Get all the ids that will correlate to the leaders
-                    setup_leader_followers(messages)
-
-                    # Setups partitions for leaders and followers
-                    smart_split(messages, "part", "lineitem", 0, 1, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids)
-                    setup_partitions(messages, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids, aggregator.leader_ids)
-                else:
-                    aggregator.arch = AggregatorArchitecture.DEFAULT
-
-            if aggregator.arch == AggregatorArchitecture.DEFAULT:
-                smart_split(messages, "part", "lineitem", 0, 1, aggregator.workers, aggregator.worker_ids, messages)
-                setup_partitions(messages, aggregator.workers, aggregator.worker_ids, messages, messages)
-
-        # Handle query 12 (build new lineitem and orders tables)
-        if number_query == 12:
-            aggregator.partition = [table for table in DEFAULT_ALL_TABLES if table not in main_tables]
-
-            if aggregator.arch == AggregatorArchitecture.FOLLOWER:
-                if len(aggregator.workers) % 3 == 0:
-                    # Get all the ids that will correlate to the leaders
-                    setup_leader_followers(messages)
-
-                    # Setups partitions for leaders and followers
-                    smart_split(messages, "orders", "lineitem", 0, 0, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids)
-                    setup_partitions(messages, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids, aggregator.leader_ids)
-                else:
-                    aggregator.arch = AggregatorArchitecture.DEFAULT
-
-            if aggregator.arch == AggregatorArchitecture.DEFAULT:
-                smart_split(messages, "orders", "lineitem", 0, 0, aggregator.workers, aggregator.worker_ids, messages)
-                setup_partitions(messages, aggregator.workers, aggregator.worker_ids, messages, messages)
-    
-    # Only 2 tables in usage but multiple tables in subqueries (split on all tables but manually split on the WHERE key clause)
-    if len(main_query_tables) == 2 and len(subquery_tables) > 0:
-        aggregator.non_partition = sub_tables
-        if number_query == 16:
-            aggregator.partition = [table for table in DEFAULT_ALL_TABLES if table not in main_tables and table not in sub_tables]
-
-            if aggregator.arch == AggregatorArchitecture.FOLLOWER:
-                if len(aggregator.workers) % 3 == 0:
-                    # Get all the ids that will correlate to the leaders
-                    setup_leader_followers(messages)
-
-                    # Setups partitions for leaders and followers
-                    smart_split(messages, "part", "partsupp", 0, 0, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids)
-                    setup_partitions(messages, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids, aggregator.leader_ids)
-                else:
-                    aggregator.arch = AggregatorArchitecture.DEFAULT
-
-            if aggregator.arch == AggregatorArchitecture.DEFAULT:
-                smart_split(messages, "part", "partsupp", 0, 0, aggregator.workers, aggregator.worker_ids, messages)
-                setup_partitions(messages, aggregator.workers, aggregator.worker_ids, messages, messages)
-    
-    print(f"Messages: {messages}")
+    # Follower represents Leader-Follower specialization
+    # Workers form a tree_fanout-ary aggregation tree, followers hold the partitions
+    if aggregator.arch == AggregatorArchitecture.FOLLOWER:
+        if setup_leader_followers(messages):
+            # Setups partitions for leaders and followers
+            setup_partitions(messages, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids, loading_leaders())
+        else:
+            aggregator.arch = AggregatorArchitecture.DEFAULT
 
-    # Send out initialization commands to all workers
-    for worker in messages:
-        endpoint = aggregator.workers[int(worker) - 1] + "/receive_init"
-        tables = {path.split('/')[-1].replace('.tbl', '').split('_')[-1]: path for path in messages[worker].insertion_tables}
-        payload = {
-            "worker_type": messages[worker].worker_type.value,
-            "files": tables,
-            "leader_address": messages[worker].leader_address,
-            "follower_addresses": messages[worker].follower_addresses
-        }
-        response = requests.post(endpoint, json=payload)
+    # Default is traditional multiple worker nodes with no specialization
+    if aggregator.arch == AggregatorArchitecture.DEFAULT:
+        setup_partitions(messages, aggregator.workers, aggregator.worker_ids, messages, messages)
 
-        if response.status_code != 200:
-            print("Issue sending request to worker")
-    
-    aggregator.initialized = True
-    return make_response("Success", 200)
+    return messages
 
 """
 Receives initialization configurations
@@ -299,6 +525,7 @@ Receives initialization configurations
 @non_partition (tables to not be split): ["customer", "nation", "orders", "part", "partsupp", "region", "supplier"]
 @arch: DEFAULT|FOLLOWER
 @mode: LOCAL|DISTRIBUTED
+@workload (optional, queries workers build indexes for): {"12.sql": "select ..."}
 ------------------------------------------------------------------------------------------
 """
 @app.route('/receive_init', methods=['POST'])
@@ -308,53 +535,63 @@ def receive_init() -> Response:
     # Already initialized, skip this process and let manager know
     if aggregator.initialized:
         return make_response("Initialized Already", 201)
+    if progress.running:
+        return make_response(jsonify(progress.snapshot()), 202)
 
     # Initialize the aggregator with setup conditions
     aggregator.partition = request.json.get('partition')
     aggregator.non_partition = request.json.get('non_partition')
     aggregator.arch = AggregatorArchitecture(request.json.get('arch'))
     aggregator.mode = AggregatorMode(request.json.get('mode'))
+    register_workload(request.json.get('workload') or {})
 
-    # Setup messages to be broadcasted to all worker nodes
-    messages = {id: InitializationMessage(WorkerType.WORKER) for id in aggregator.worker_ids}
+    # Partition and load in the background; the manager polls /init_status
+    settings = partition_settings("uniform", partition=aggregator.partition, non_partition=aggregator.non_partition)
+    start_initialization(settings, uniform_partition)
+    return make_response(jsonify(progress.snapshot()), 202)
 
-    # Follower represents Leader-Follower specialization
-    # Early Configuration, clusters will be setup with 1 Leader and 2 Followers 
-    # Only power of 3 node counts are supported
-    if aggregator.arch == AggregatorArchitecture.FOLLOWER:
-        if len(aggregator.workers) % 3 == 0:
-            # Get all the ids that will correlate to the leaders
-            setup_leader_followers(messages)
 
-            # Setups partitions for leaders and followers
-            setup_partitions(messages, aggregator.followers, aggregator.follower_ids, aggregator.follower_ids, aggregator.leader_ids)
-        else:
-            aggregator.arch = AggregatorArchitecture.DEFAULT
+# initializing/ready/failed, the current phase, per-worker load progress and (once ready) the partition report
+@app.route('/init_status', methods=['GET'])
+def init_status() -> Response:
+    return jsonify(progress.snapshot())
 
-    # Default is traditional multiple worker nodes with no specialization
-    if aggregator.arch == AggregatorArchitecture.DEFAULT:
-        setup_partitions(messages, aggregator.workers, aggregator.worker_ids, messages, messages)
+# Hit/miss/eviction counters and size of the query result cache
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats() -> Response:
+    return jsonify(cache.stats())
 
-    print(f"Messages: {messages}")
+# generating/ready/failed, the compile and per-dbgen-run progress of the TPC-H data
+@app.route('/generation_status', methods=['GET'])
+def generation_status() -> Response:
+    return jsonify(generation.snapshot())
 
-    # Send out initialization commands to all workers
-    for worker in messages:
-        endpoint = aggregator.workers[int(worker) - 1] + "/receive_init"
-        tables = {path.split('/')[-1].replace('.tbl', '').split('_')[-1]: path for path in messages[worker].insertion_tables}
-        payload = {
-            "worker_type": messages[worker].worker_type.value,
-            "files": tables,
-            "leader_address": messages[worker].leader_address,
-            "follower_addresses": messages[worker].follower_addresses
-        }
-        response = requests.post(endpoint, json=payload)
-
-        if response.status_code != 200:
-            print("Issue sending request to worker")
-    
-    aggregator.initialized = True
-    return make_response("Success", 200)
+# Placement, range boundaries and per-worker row counts recorded during initialization
+@app.route('/partition_catalog', methods=['GET'])
+def partition_catalog() -> Response:
+    return jsonify(catalog.report())
 
+"""
+Whether leaders can reduce a LOCAL mode query on their own subtree
+------------------------------------------------------------------------------------------
+The query must decompose into partial results (AGGREGATE or ROWS) and read only the shipped
+tables, each once and outside subqueries. Joins need every table hash/range co-partitioned,
+split and follow tables only line up once all their rows meet on the aggregator.
+------------------------------------------------------------------------------------------
+"""
+def leader_reducible(query: str, tables: list[str], plan: DecomposedQuery) -> bool:
+    if not network.getboolean("leader_reduction") or plan.strategy == MergeStrategy.CONCAT:
+        return False
+    read = extract_tables(sqlparse.parse(query)[0])
+    names = [t['table'].lower() for t in read]
+    if not names or any(t['subquery'] for t in read) or len(set(names)) != len(names) or not set(names) <= set(tables):
+        return False
+    methods = {catalog.entries[name].method if name in catalog.entries else None for name in names}
+    return methods <= ({"hash", "range", "split", "generated"} if len(names) == 1 else {"hash", "range"})
+
+def result_key(query: str, tables: list[str]) -> str:
+    """Helper function to key a query's result by its normalized SQL, the tables shipped for it, the partitioning and the data version."""
+    return json.dumps([normalize_sql(query), sorted(tables or []), partition_key, manifest.data_version])
 
 @app.route('/send_task', methods=['POST'])
 def send_task():
@@ -365,92 +602,220 @@ def send_task():
     query_id = request.json.get('query_id')
     results = {}
 
+    # Repeated queries over unchanged data are answered from the result cache
+    key = result_key(query, tables)
+    epoch = cache.epoch
+    if cache.enabled and aggregator.initialized:
+        start_time = time.time()
+        cached = cache.get(key)
+        if cached is not None:
+            sink.write(f"query-results/{query_id}_network_latency.json", {"network_latency": 0.0, "cache": "hit", "lookup_time": time.time() - start_time, "cache_stats": cache.stats()})
+            sink.write(f"query-results/{query_id}_aggregator.json", cached)
+            return jsonify(cached)
+
+    plan = decompose_query(query, catalog.partitioned_tables()) if aggregator.mode == AggregatorMode.DISTRIBUTED else None
+    futures = []
+    complete = True
+
+    # DISTRIBUTED mode: a query over replicated tables only is answered whole by one worker holding them
+    single_worker = None
+    if aggregator.mode == AggregatorMode.DISTRIBUTED and catalog.entries and not referenced_tables(query, catalog.partitioned_tables()):
+        single_worker = loading_leaders()[0] if aggregator.arch == AggregatorArchitecture.FOLLOWER else aggregator.worker_ids[0]
+        plan = DecomposedQuery(query, reason="Reads no partitioned table")
+
+    # LOCAL FOLLOWER mode: leaders stage their followers' rows and send up partial results instead
+    reduced = False
+    if aggregator.mode == AggregatorMode.LOCAL and aggregator.arch == AggregatorArchitecture.FOLLOWER:
+        local_plan = decompose_query(query)
+        reduced = leader_reducible(query, tables, local_plan)
+        if reduced:
+            plan = local_plan
+
+    # DISTRIBUTED mode: register the workers whose results complete this query before fanning out
+    if aggregator.mode == AggregatorMode.DISTRIBUTED or reduced:
+        reporters = aggregator.leader_ids if aggregator.arch == AggregatorArchitecture.FOLLOWER else aggregator.worker_ids
+        if single_worker is not None:
+            reporters = [single_worker]
+        pending = collector.register(query_id, reporters, plan.merge)
+
+    # LOCAL mode: work out the columns and filters each shipped table needs, and stage only those
+    if aggregator.mode == AggregatorMode.LOCAL:
+        pushdown = plan_pushdown(query, tables, aggregator.table_schemas)
+        for table in (tables if not reduced else []):
+            columns = dict(aggregator.table_schemas[table])
+            db.create_staging_table(staging_schema(query_id), table, [(column, columns[column]) for column in pushdown[table]["columns"]])
+
     def send_request(url, endpoint, payload):
         """Helper function to send a POST request."""
-        response = requests.post(f"{url}/{endpoint}", json=payload)
+        response = sessions.post(f"{url}/{endpoint}", json=payload)
         if response.status_code != 200:
             print(f"Issue sending request to {url}")
         return response
 
+    def submit_request(url, endpoint, payload):
+        """Helper function to fan a request out; failed DISTRIBUTED requests stop the collector waiting on them."""
+        future = fanout.submit(send_request, url, endpoint, payload)
+        if aggregator.mode == AggregatorMode.DISTRIBUTED or reduced:
+            worker_id = payload["worker_id"]
+            def on_done(future):
+                try:
+                    response = future.result()
+                    if response.status_code != 200:
+                        collector.fail(query_id, worker_id, response.text)
+                except Exception as e:
+                    collector.fail(query_id, worker_id, str(e))
+            future.add_done_callback(on_done)
+        futures.append(future)
+
     start_time = time.time()
 
+    if single_worker is not None:
+        payload = {
+            "query": query,
+            "agg_url": "http://aggregator:5001/receive_result",
+            "accept_encoding": available_encodings(),
+            "query_id": query_id,
+            "worker_id": single_worker
+        }
+        submit_request(aggregator.workers[aggregator.worker_ids.index(single_worker)], "process_query", payload)
+
     # Handles default architecture
-    if aggregator.arch == AggregatorArchitecture.DEFAULT:
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for worker_url in aggregator.workers:
-                if aggregator.mode == AggregatorMode.LOCAL:
-                    payload = {
-                        "tables": tables,
-                        "agg_url": "http://aggregator:5001/receive_data"
-                    }
-                    futures.append(executor.submit(send_request, worker_url, "process_data", payload))
-
-                elif aggregator.mode == AggregatorMode.DISTRIBUTED:
-                    payload = {
-                        "query": query,
-                        "agg_url": "http://aggregator:5001/receive_result",
-                        "query_id": query_id,
-                        "worker_id": aggregator.worker_ids[aggregator.workers.index(worker_url)]
-                    }
-                    futures.append(executor.submit(send_request, worker_url, "process_query", payload))
-
-            # Wait for all futures to complete
-            for future in as_completed(futures):
-                try:
-                    future.result()  # Raises exception if the request failed
-                except Exception as e:
-                    print(f"Error: {e}")
+    elif aggregator.arch == AggregatorArchitecture.DEFAULT:
+        for worker_url in aggregator.workers:
+            if aggregator.mode == AggregatorMode.LOCAL:
+                payload = {
+                    "tables": tables,
+                    "agg_url": "http://aggregator:5001/receive_data",
+                    "accept": SUPPORTED_CONTENT_TYPES,
+                    "accept_encoding": available_encodings(),
+                    "query_id": query_id,
+                    "stream_url": "http://aggregator:5001/receive_stream" if network.getboolean("streaming") else None,
+                    "pushdown": pushdown
+                }
+                submit_request(worker_url, "process_data", payload)
+
+            elif aggregator.mode == AggregatorMode.DISTRIBUTED:
+                payload = {
+                    "query": plan.worker_query,
+                    "agg_url": "http://aggregator:5001/receive_result",
+                    "accept_encoding": available_encodings(),
+                    "query_id": query_id,
+                    "worker_id": aggregator.worker_ids[aggregator.workers.index(worker_url)]
+                }
+                submit_request(worker_url, "process_query", payload)
 
     # Handles leader-follower architecture
-    if aggregator.arch == AggregatorArchitecture.FOLLOWER:
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for leader_url in aggregator.leaders:
-                if aggregator.mode == AggregatorMode.LOCAL:
-                    payload = {
-                        "tables": tables,
-                        "agg_url": "http://aggregator:5001/receive_data"
-                    }
-                    futures.append(executor.submit(send_request, leader_url, "leader_data", payload))
-
-                elif aggregator.mode == AggregatorMode.DISTRIBUTED:
-                    payload = {
-                        "query": query,
-                        "agg_url": "http://aggregator:5001/receive_result",
-                        "query_id": query_id,
-                        "worker_id": aggregator.worker_ids[aggregator.workers.index(leader_url)]
-                    }
-                    futures.append(executor.submit(send_request, leader_url, "leader_results", payload))
-
-            # Wait for all futures to complete
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    print(f"Error: {e}")
+    elif aggregator.arch == AggregatorArchitecture.FOLLOWER:
+        for leader_url in aggregator.leaders:
+            if reduced:
+                payload = {
+                    "tables": tables,
+                    "reduce": True,
+                    "query": plan.worker_query,
+                    "merge_query": query,
+                    "agg_url": "http://aggregator:5001/receive_result",
+                    "accept": SUPPORTED_CONTENT_TYPES,
+                    "accept_encoding": available_encodings(),
+                    "query_id": query_id,
+                    "worker_id": aggregator.worker_ids[aggregator.workers.index(leader_url)],
+                    "pushdown": pushdown
+                }
+                submit_request(leader_url, "leader_data", payload)
+
+            elif aggregator.mode == AggregatorMode.LOCAL:
+                payload = {
+                    "tables": tables,
+                    "agg_url": "http://aggregator:5001/receive_data",
+                    "accept": SUPPORTED_CONTENT_TYPES,
+                    "accept_encoding": available_encodings(),
+                    "query_id": query_id,
+                    "stream_url": "http://aggregator:5001/receive_stream" if network.getboolean("streaming") else None,
+                    "pushdown": pushdown
+                }
+                submit_request(leader_url, "leader_data", payload)
+
+            elif aggregator.mode == AggregatorMode.DISTRIBUTED:
+                payload = {
+                    "query": plan.worker_query,
+                    "merge_query": query,
+                    "agg_url": "http://aggregator:5001/receive_result",
+                    "accept_encoding": available_encodings(),
+                    "query_id": query_id,
+                    "worker_id": aggregator.worker_ids[aggregator.workers.index(leader_url)]
+                }
+                submit_request(leader_url, "leader_results", payload)
+
+    # LOCAL mode: every worker has shipped its data once its request returns
+    if aggregator.mode == AggregatorMode.LOCAL and not reduced:
+        for future in as_completed(futures):
+            try:
+                # Raises exception if the request failed
+                if future.result().status_code != 200:
+                    complete = False
+            except Exception as e:
+                complete = False
+                print(f"Error: {e}")
+
+    # DISTRIBUTED mode: return as soon as the last worker reports (or the timeout hits)
+    if aggregator.mode == AggregatorMode.DISTRIBUTED or reduced:
+        if not pending.wait(collector.timeout):
+            print(f"Timed out waiting on workers {pending.missing} for query {query_id}")
+        collector.discard(query_id)
 
     end_time = time.time()
     results["network_latency"] = end_time - start_time
+    transfers = pop_transfers(query_id)
+    results["compression"] = summarize_transfers(transfers)
+    results["transfers"] = transfers
+    results["cache"] = "miss" if cache.enabled else "disabled"
 
     # Save network latency
-    with open(f"query-results/{query_id}_network_latency.json", "w") as f:
-        f.write(json.dumps(results))
+    sink.write(f"query-results/{query_id}_network_latency.json", results)
+
+    # DISTRIBUTED mode (and reduced LOCAL queries): Merge the partial results into the final answer
+    if aggregator.mode == AggregatorMode.DISTRIBUTED or reduced:
+        start_time = time.time()
+        try:
+            result = pending.result()
+        except Exception as e:
+            print(f"Error merging results ({e}), falling back to concatenation")
+            complete = False
+            pending.merge = ResultSet.concat
+            result = pending.result()
+        end_time = time.time()
+        result.query_time = end_time - start_time
+        results = result.to_json()
+        results["merge_strategy"] = plan.strategy.name
+        results["worker_query_times"] = {worker_id: partial.query_time for worker_id, partial in pending.results.items()}
+        results["missing_workers"] = pending.missing
+        complete = complete and not pending.missing
+
+        # Save results
+        sink.write(f"query-results/{query_id}_aggregator.json", results)
 
     # LOCAL mode: Run the query on the aggregator
-    if aggregator.mode == AggregatorMode.LOCAL:
+    if aggregator.mode == AggregatorMode.LOCAL and not reduced:
         start_time = time.time()
-        results = db.execute_query(query)
+        try:
+            result = db.execute_query(query, [staging_schema(query_id), "public"])
+        except Exception as e:
+            # Answered empty as before, but never cached
+            print(f"Error running query {query_id} on the aggregator: {e}")
+            complete = False
+            result = ResultSet()
         end_time = time.time()
-        results.append({"query_time": end_time - start_time})
+        result.query_time = end_time - start_time
+        results = result.to_json()
 
         # Save results
-        with open(f"query-results/{query_id}_aggregator.json", "w") as f:
-            f.write(json.dumps(results))
+        sink.write(f"query-results/{query_id}_aggregator.json", results)
 
-        # Clean up tables
-        for table in tables:
-            db.delete_rows(table)
+        # Clean up staging tables
+        db.drop_staging_schema(staging_schema(query_id))
+
+    # Only complete answers are cached (a worker that did not report would stay missing on every hit)
+    if complete and aggregator.initialized:
+        cache.put(key, results, epoch)
 
     return jsonify(results)
 
@@ -458,29 +823,157 @@ def send_task():
 def receive_result():
     global aggregator, db
 
-    data = request.json
-    results = data["results"]
+    body, stats = decode_body(request.get_data(), request.headers)
+    data = json.loads(body)
+    results = ResultSet.from_json(data["results"])
     query_id = data["query_id"]
     worker_id = data["worker_id"]
-    
-    # write results to json file with query_id
-    with open(f"query-results/{query_id}_worker_{worker_id}.json", "w") as f:
-        f.write(json.dumps(results))
-    
+    record_transfer(query_id, f"receive_result/worker_{worker_id}", stats)
+
+    # Wakes send_task once the last expected worker has reported
+    if not collector.deliver(query_id, worker_id, results):
+        print(f"Dropping result from worker {worker_id} for unknown query {query_id}")
+
+    # write results to json file with query_id (off the request path)
+    sink.write(f"query-results/{query_id}_worker_{worker_id}.json", results)
+
     return make_response("Success", 200)
 
+def decode_data_batch(body: bytes, content_type: str) -> tuple[str, ResultSet]:
+    """Helper function to decode a data batch in whichever content type the worker chose."""
+    if content_type == COLUMNAR_CONTENT_TYPE:
+        return decode_batch(body)
+    data = json.loads(body)
+    return data.get('name'), ResultSet.from_json(data.get('rows'))
+
 @app.route('/receive_data', methods=['POST'])
 def receive_data():
     global aggregator, db
 
-    table = request.json.get('name')
-    rows = request.json.get('rows')
-    # Insert data into database
-    db.insert_rows(Table(table, rows))
+    # Workers pick the columnar encoding when it was offered, JSON otherwise
+    body, stats = decode_body(request.get_data(), request.headers)
+    table, rows = decode_data_batch(body, request.content_type)
+    record_transfer(request.headers.get(QUERY_ID_HEADER), f"receive_data/{table}", stats)
+
+    # Insert data into the staging schema of the query it was shipped for
+    db.copy_rows(Table(table, rows), staging_schema(request.headers.get(QUERY_ID_HEADER)))
     return make_response("Success", 200)
 
-def init_aggregator() -> Database:
+"""
+Receives a whole partition as one chunked upload of framed batches
+------------------------------------------------------------------------------------------
+Frames are read off the socket while a bounded queue feeds concurrent COPY ingestion; a
+full queue stops the reader, which pushes TCP backpressure back to the worker.
+------------------------------------------------------------------------------------------
+"""
+@app.route('/receive_stream', methods=['POST'])
+def receive_stream():
     global aggregator, db
+
+    query_id = request.headers.get(QUERY_ID_HEADER)
+    content_type = request.content_type
+    frames = queue.Queue(maxsize=int(network["stream_queue_size"]))
+    errors = []
+
+    def ingest():
+        while True:
+            frame = frames.get()
+            if frame is None:
+                return
+            try:
+                encoding, compress_time, payload = frame
+                headers = {"Content-Encoding": encoding, COMPRESS_TIME_HEADER: compress_time}
+                body, stats = decode_body(payload, headers)
+                table, rows = decode_data_batch(body, content_type)
+                record_transfer(query_id, f"receive_stream/{table}", stats)
+                db.copy_rows(Table(table, rows), staging_schema(query_id))
+            except Exception as e:
+                errors.append(e)
+
+    ingesters = [threading.Thread(target=ingest) for _ in range(int(network["stream_ingest_threads"]))]
+    for ingester in ingesters:
+        ingester.start()
+
+    # Chunked bodies have no Content-Length, so read the de-chunked input directly rather than
+    # through request.stream, which would cap the whole upload at MAX_CONTENT_LENGTH
+    stream = request.environ["wsgi.input"] if request.environ.get("wsgi.input_terminated") else request.stream
+    try:
+        for frame in read_frames(stream):
+            frames.put(frame)
+    finally:
+        for _ in ingesters:
+            frames.put(None)
+        for ingester in ingesters:
+            ingester.join()
+
+    if errors:
+        return make_response(f"Error ingesting stream: {errors[0]}", 500)
+    return make_response("Success", 200)
+
+def generation_settings() -> dict:
+    """Helper function to describe the dbgen run for the manifest (anything that changes the generated rows)."""
+    settings = {"scale_factor": float(generating["scale_factor"]), "dbgen": "3.0.0", "seed": "builtin"}
+    if worker_tables:
+        settings["worker_tables"] = worker_tables
+    return settings
+
+"""
+Generates the TPC-H tables on the shared volume, off the startup path
+------------------------------------------------------------------------------------------
+Uses the [GENERATION] section: scale_factor, and parallelism with 0 for every core. Tables in
+worker_tables are left to the workers (see ensure_generated).
+Skips dbgen when the manifest holds intact files from the same settings (dbgen has no seed
+option; its built-in seeds make runs with the same settings identical) and make when dbgen
+is up to date. Progress is served by /generation_status; initialization waits on generated.
+------------------------------------------------------------------------------------------
+"""
+def generate_data(mount_point: str) -> None:
+    settings = generation_settings()
+    parallelism = generation_parallelism(int(generating["parallelism"]))
+    tables = [table for table in DEFAULT_ALL_TABLES if table not in worker_tables]
+    jobs = [job_name(job) for job in generation_jobs(parallelism, tables)]
+    generation.begin(jobs)
+    try:
+        generated_files = [f"{mount_point}/{table}.tbl" for table in tables]
+        if manifesting.getboolean("enabled") and manifest.generation_matches(settings, manifesting.get("verify", "checksum")):
+            print(f"Reusing generated data from {manifest.path} (version {manifest.data_version})")
+            generation.finish({**settings, "reused": True})
+            return
+
+        generation.set_phase("compiling")
+        compiled = build_dbgen(DBGEN_DIRECTORY)
+
+        generation.set_phase("generating")
+        report = generate_tables(DBGEN_DIRECTORY, mount_point, settings["scale_factor"], parallelism, generation, tables)
+        print(f"Generated scale factor {settings['scale_factor']} in {report['seconds']}s with {report['chunks']} dbgen chunks")
+
+        generation.set_phase("recording")
+        manifest.record_generation(settings, generated_files)
+        if manifesting.getboolean("enabled"):
+            manifest.save()
+        generation.finish({**report, "reused": False, "compiled": compiled})
+    except Exception as e:
+        print(f"Data generation failed: {e}")
+        generation.fail(str(e))
+    finally:
+        generated.set()
+
+def ensure_generated(tables: list[str]) -> None:
+    """Helper function to generate worker_tables on the shared volume after all, when a partitioning reads them there."""
+    files = manifest.generation.get("files", {})
+    missing = [table for table in tables if f"{aggregator.mount_point}/{table}.tbl" not in files]
+    if not missing:
+        return
+    print(f"Generating {missing} on the shared volume")
+    build_dbgen(DBGEN_DIRECTORY)
+    report = generate_tables(DBGEN_DIRECTORY, aggregator.mount_point, generation_settings()["scale_factor"], generation_parallelism(int(generating["parallelism"])), tables=missing)
+    manifest.add_generated(list(report["files"].values()))
+    cache.invalidate()
+    if manifesting.getboolean("enabled"):
+        manifest.save()
+
+def init_aggregator() -> Database:
+    global aggregator, db, compression, sessions, network, collector, sink, fanout, partitioning, catalog, manifest, manifesting, loading, indexing, init_timeout, tree_fanout, generating, worker_tables, cache
     
     # Get initial configurations
     host = os.getenv('DB_HOST', 'localhost')
@@ -495,27 +988,41 @@ def init_aggregator() -> Database:
     config = configparser.ConfigParser()
     config.read('config.ini')
     number_of_workers = int(config['AGGREGATOR']['number_of_workers'])
+    tree_fanout = int(config['AGGREGATOR']['tree_fanout'])
     worker_port = int(config['AGGREGATOR']['port'])
     mount_point = config["SHARED"]["mount_point"]
+    min_connections = int(config["DATABASE"]["min_connections"])
+    max_connections = int(config["DATABASE"]["max_connections"])
+    health_check_interval = float(config["DATABASE"]["health_check_interval"])
+    network = config["NETWORK"]
+    partitioning = config["PARTITION"]
+    compression = CompressionPolicy(network["compression"], int(network["compression_min_size"]))
+    sessions = PeerSessions(int(network["session_pool_size"]))
+    collector = ResultCollector(float(config["RESULTS"]["timeout"]))
+    sink = ResultSink(config["RESULTS"].getboolean("persist"))
+    fanout = ThreadPoolExecutor(max_workers=max(number_of_workers, 1) * 2)
+    catalog = PartitionCatalog()
+    manifesting = config["MANIFEST"]
+    loading = config["LOADING"]
+    indexing = config["INDEXING"]
+    init_timeout = float(config["INIT"]["timeout"])
+    cache = ResultCache(int(config["CACHE"]["capacity"]), int(config["CACHE"]["max_bytes"])) if config["CACHE"].getboolean("enabled") else ResultCache(0, 0)
     workers, worker_ids = [], []
     for w in range(1, number_of_workers + 1):
         workers.append(DEFAULT_WORKER_NAME + f"{w}:{worker_port}")
         worker_ids.append(str(w))
 
-    # Compile dbgen using subprocess
-    subprocess.run(["cd TPC-H/dbgen && make"], check=True, shell=True)
-    
-    # Create .tbl files "./dbgen -s 1"
-    subprocess.run(["cd TPC-H/dbgen && ./dbgen -s 1"], check=True, shell=True)
-
-    # After generation, move all the .tbl files to shared mount point
-    subprocess.run([f"mv TPC-H/dbgen/*.tbl {mount_point}"], check=True, shell=True)
+    # Generate the tables in the background while the aggregator starts serving
+    generating = config["GENERATION"]
+    worker_tables = [table for table in generating.get("worker_tables", "").split(",") if table and table not in FIXED_TABLES]
+    manifest = Manifest.load(f"{mount_point}/{MANIFEST_FILE}") if manifesting.getboolean("enabled") else Manifest(f"{mount_point}/{MANIFEST_FILE}")
+    threading.Thread(target=generate_data, args=(mount_point,), daemon=True).start()
 
     # Initialize aggregator with basic init information
-    aggregator = Aggregator(mount_point, workers, worker_ids)
+    aggregator = Aggregator(mount_point, workers, worker_ids, table_schemas=load_schema(schema))
 
     # Setup Database
-    db = Database(host, port, name, user, password, schema)
+    db = Database(host, port, name, user, password, schema, min_connections, max_connections, health_check_interval)
     
 def main():
     init_aggregator()
@@ -0,0 +1,334 @@
+from concurrent.futures import ThreadPoolExecutor
+from lib.database import *
+from lib.wire import *
+from lib.partition import *
+import tracemalloc
+import collections
+import tempfile
+import filecmp
+import argparse
+import json
+import random
+import os
+
+parser = argparse.ArgumentParser(description="Micro-benchmarks for Geo-QA node internals (run inside the aggregator container)")
+subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+pool_parser = subparsers.add_parser("pool", help="Postgres handshakes per query with and without connection pooling")
+pool_parser.add_argument('-q', '--queries', type=int, default=1000, help='Number of queries to issue')
+pool_parser.add_argument('-t', '--threads', type=int, default=8, help='Number of concurrent client threads')
+pool_parser.add_argument('--min-connections', type=int, default=1, help='Pool minimum size')
+pool_parser.add_argument('--max-connections', type=int, default=10, help='Pool maximum size')
+
+ingest_parser = subparsers.add_parser("ingest", help="Rows/s of mogrify INSERT vs. COPY FROM STDIN ingestion")
+ingest_parser.add_argument('-r', '--rows', type=int, default=300000, help='Number of synthetic lineitem rows')
+ingest_parser.add_argument('-b', '--batch-size', type=int, default=30000, help='Rows per /receive_data batch')
+
+wire_parser = subparsers.add_parser("wire", help="Bytes on the wire and decode time of JSON vs. columnar batches")
+wire_parser.add_argument('-r', '--rows', type=int, default=1000000, help='Number of synthetic lineitem rows')
+wire_parser.add_argument('-b', '--batch-size', type=int, default=30000, help='Rows per /receive_data batch')
+
+split_parser = subparsers.add_parser("split", help="Time and Python memory of the readlines vs. mmap table splitters")
+split_parser.add_argument('-s', '--scales', type=float, nargs='+', default=[0.1, 1.0], help='TPC-H scale factors to generate lineitem at')
+split_parser.add_argument('-n', '--nodes', type=int, default=3, help='Number of partitions to split into')
+split_parser.add_argument('-d', '--dbgen', type=str, default='TPC-H/dbgen', help='Directory of the compiled dbgen')
+
+route_parser = subparsers.add_parser("route", help="Time and Python memory of the dict-of-lines vs. offset-index key routers")
+route_parser.add_argument('-s', '--scales', type=float, nargs='+', default=[0.1, 1.0], help='TPC-H scale factors to generate orders/lineitem at')
+route_parser.add_argument('-n', '--nodes', type=int, default=3, help='Number of partitions to route into')
+route_parser.add_argument('-d', '--dbgen', type=str, default='TPC-H/dbgen', help='Directory of the compiled dbgen')
+route_parser.add_argument('-c', '--chunk-size', type=int, default=64 * 1024 * 1024, help='Bytes per routed chunk')
+
+load_parser = subparsers.add_parser("load", help="Seconds and rows/s of sequential psql \\copy vs. parallel COPY loading")
+load_parser.add_argument('-s', '--scale', type=float, default=1.0, help='TPC-H scale factor to generate')
+load_parser.add_argument('-p', '--parallelism', type=int, nargs='+', default=[1, 4, 8], help='Concurrent COPY connections to try')
+load_parser.add_argument('-d', '--dbgen', type=str, default='TPC-H/dbgen', help='Directory of the compiled dbgen')
+load_parser.add_argument('-c', '--chunk-size', type=int, default=64 * 1024 * 1024, help='Bytes per COPY chunk')
+
+def connect_kwargs() -> dict:
+    return {
+        "host": os.getenv('DB_HOST', 'localhost'),
+        "port": os.getenv('DB_PORT', 5432),
+        "dbname": os.getenv('DB_NAME', 'postgres'),
+        "user": os.getenv('DB_USER', 'postgres'),
+        "password": os.getenv('DB_PASSWORD', 'postgres')
+    }
+
+def connect_database() -> Database:
+    return Database(
+        os.getenv('DB_HOST', 'localhost'),
+        os.getenv('DB_PORT', 5432),
+        os.getenv('DB_NAME', 'postgres'),
+        os.getenv('DB_USER', 'postgres'),
+        os.getenv('DB_PASSWORD', 'postgres'),
+        os.getenv('DB_SCHEMA', 'schema.sql')
+    )
+
+# Builds lineitem-shaped typed batches like the ones worker.fetch_all yields
+def synthetic_lineitem(count: int, seed: int = 0) -> ResultSet:
+    rng = random.Random(seed)
+    epoch = datetime.date(1992, 1, 1)
+    columns = [name.lower() for name in LINEITEM_SCHEMA]
+    types = ["int", "int", "int", "int", "decimal", "decimal", "decimal", "decimal",
+             "text", "text", "date", "date", "date", "text", "text", "text"]
+    rows = []
+    for i in range(count):
+        rows.append((
+            i // 4 + 1,
+            rng.randint(1, 200000),
+            rng.randint(1, 10000),
+            i % 4 + 1,
+            Decimal(rng.randint(1, 50)),
+            Decimal(rng.randint(90000, 10500000)) / 100,
+            Decimal(rng.randint(0, 10)) / 100,
+            Decimal(rng.randint(0, 8)) / 100,
+            rng.choice("ANR"),
+            rng.choice("OF"),
+            epoch + datetime.timedelta(days=rng.randint(0, 2500)),
+            epoch + datetime.timedelta(days=rng.randint(0, 2500)),
+            epoch + datetime.timedelta(days=rng.randint(0, 2500)),
+            rng.choice(["DELIVER IN PERSON", "COLLECT COD", "NONE", "TAKE BACK RETURN"]),
+            rng.choice(["REG AIR", "AIR", "RAIL", "SHIP", "TRUCK", "MAIL", "FOB"]),
+            "furiously regular deposits sleep\tslyly"
+        ))
+    values = list(zip(*rows))
+    return ResultSet(columns, types, [pack_column(kind, column) for kind, column in zip(types, values)])
+
+
+# Compares a fresh psycopg2.connect per query against pooled connections
+def benchmark_pool(args) -> None:
+    kwargs = connect_kwargs()
+    query = "SELECT 1"
+
+    def unpooled(_):
+        conn = psycopg2.connect(**kwargs)
+        cursor = conn.cursor()
+        cursor.execute(query)
+        cursor.fetchall()
+        cursor.close()
+        conn.close()
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(unpooled, range(args.queries)))
+    unpooled_time = time.time() - start_time
+
+    pool = ConnectionPool(args.min_connections, args.max_connections, **kwargs)
+
+    def pooled(_):
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query)
+            cursor.fetchall()
+            cursor.close()
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(pooled, range(args.queries)))
+    pooled_time = time.time() - start_time
+    pool.closeall()
+
+    print(f"{'path':<10}{'queries':>10}{'handshakes':>12}{'handshakes/query':>18}{'queries/s':>12}")
+    print(f"{'unpooled':<10}{args.queries:>10}{args.queries:>12}{1.0:>18.4f}{args.queries / unpooled_time:>12.1f}")
+    print(f"{'pooled':<10}{args.queries:>10}{pool.connections_opened:>12}"
+          f"{pool.connections_opened / args.queries:>18.4f}{args.queries / pooled_time:>12.1f}")
+
+# Compares ingesting /receive_data batches with insert_rows and copy_rows
+def benchmark_ingest(args) -> None:
+    db = connect_database()
+    rows = synthetic_lineitem(args.rows)
+    batches = [rows.slice(i, i + args.batch_size) for i in range(0, len(rows), args.batch_size)]
+
+    print(f"{'path':<10}{'rows':>10}{'seconds':>10}{'rows/s':>12}")
+    for label, ingest in (("insert", db.insert_rows), ("copy", db.copy_rows)):
+        db.delete_rows("lineitem")
+        start_time = time.time()
+        for batch in batches:
+            ingest(Table("lineitem", batch))
+        elapsed = time.time() - start_time
+        print(f"{label:<10}{len(rows):>10}{elapsed:>10.2f}{len(rows) / elapsed:>12.1f}")
+
+    db.delete_rows("lineitem")
+    db.pool.closeall()
+
+# Compares the /receive_data encodings per million lineitem rows
+def benchmark_wire(args) -> None:
+    rows = synthetic_lineitem(args.rows)
+    batches = [rows.slice(i, i + args.batch_size) for i in range(0, len(rows), args.batch_size)]
+    scale = 1000000 / len(rows)
+
+    def legacy_encode(batch):
+        records = [{column: str(value) for column, value in record.items()} for record in batch.to_records()]
+        return json.dumps({"name": "lineitem", "rows": records}).encode("utf-8")
+
+    encodings = (
+        ("json-rows", legacy_encode, lambda payload: json.loads(payload)["rows"]),
+        ("json-cols", lambda batch: json.dumps({"name": "lineitem", "rows": batch.to_json()}).encode("utf-8"),
+                      lambda payload: ResultSet.from_json(json.loads(payload)["rows"])),
+        ("columnar", lambda batch: encode_batch("lineitem", batch), decode_batch)
+    )
+
+    print(f"{'encoding':<12}{'MB/1M rows':>12}{'encode s/1M':>13}{'decode s/1M':>13}")
+    for label, encode, decode in encodings:
+        start_time = time.time()
+        payloads = [encode(batch) for batch in batches]
+        encode_time = time.time() - start_time
+
+        start_time = time.time()
+        for payload in payloads:
+            decode(payload)
+        decode_time = time.time() - start_time
+
+        size = sum(len(payload) for payload in payloads)
+        print(f"{label:<12}{size * scale / 1e6:>12.1f}{encode_time * scale:>13.2f}{decode_time * scale:>13.2f}")
+
+# The splitter setup_partitions used before the mmap splitter (kept for comparison)
+def readlines_split(path: str, destinations: list[str]) -> None:
+    with open(path, 'r') as file:
+        total_lines = sum(1 for _ in file)
+    lines_per_node = total_lines // len(destinations)
+    remainder = total_lines % len(destinations)
+
+    with open(path, 'r') as file:
+        lines = file.readlines()
+        start_line = 0
+        for pos, destination in enumerate(destinations):
+            end_line = start_line + lines_per_node + (remainder if pos == len(destinations) - 1 else 0)
+            with open(destination, 'w') as node_file:
+                for line_num in range(start_line, end_line):
+                    node_file.write(lines[line_num])
+            start_line = end_line
+
+# Splits freshly generated lineitem files with both splitters at each scale factor
+def benchmark_split(args) -> None:
+    dbgen = os.path.abspath(args.dbgen)
+    print(f"{'scale':>6}{'MB':>9}{'splitter':>11}{'seconds':>10}{'MB/s':>9}{'peak py MB':>12}{'identical':>11}")
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory(dir=os.getenv('BENCHMARK_TMP')) as directory:
+            subprocess.run([f"cd {dbgen} && DSS_PATH={directory} ./dbgen -s {scale} -T L -f"], check=True, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            path = f"{directory}/lineitem.tbl"
+            size = os.path.getsize(path) / 1e6
+
+            outputs = {}
+            for label, split in (("readlines", readlines_split), ("mmap", split_file)):
+                destinations = [f"{directory}/{label}_{node}.tbl" for node in range(args.nodes)]
+                tracemalloc.start()
+                start_time = time.time()
+                split(path, destinations)
+                elapsed = time.time() - start_time
+                peak = tracemalloc.get_traced_memory()[1] / 1e6
+                tracemalloc.stop()
+                outputs[label] = destinations
+
+                identical = "" if label == "readlines" else \
+                    str(all(filecmp.cmp(a, b, shallow=False) for a, b in zip(outputs["readlines"], destinations)))
+                print(f"{scale:>6}{size:>9.1f}{label:>11}{elapsed:>10.2f}{size / elapsed:>9.1f}{peak:>12.1f}{identical:>11}")
+
+# The key-joined splitter smart_split used before route_file (kept for comparison): the whole
+# left table in a dict of lines and every right line buffered per node before writing
+def dict_route(left_path: str, right_path: str, left_destinations: list[str], right_destinations: list[str]) -> None:
+    left_buckets = dict()
+    with open(left_path, 'r') as file:
+        for line in file.readlines():
+            left_buckets[int(line.split('|')[0])] = line
+
+    nodes = len(left_destinations)
+    left_buffers = collections.defaultdict(list)
+    right_buffers = collections.defaultdict(list)
+    seen = set()
+    with open(right_path, 'r') as file:
+        for line in file:
+            key = int(line.split('|')[0])
+            right_buffers[key % nodes].append(line)
+            if key not in seen:
+                left_buffers[key % nodes].append(left_buckets[key])
+                seen.add(key)
+
+    for node in range(nodes):
+        with open(left_destinations[node], 'w') as f:
+            f.writelines(left_buffers[node])
+        with open(right_destinations[node], 'w') as f:
+            f.writelines(right_buffers[node])
+
+def index_route(left_path: str, right_path: str, left_destinations: list[str], right_destinations: list[str], chunk_size: int) -> None:
+    route = ("modulo", len(left_destinations))
+    route_file(left_path, 0, route, left_destinations, None, chunk_size)
+    route_file(right_path, 0, route, right_destinations, None, chunk_size)
+
+# Co-partitions freshly generated orders/lineitem on the order key with both routers
+def benchmark_route(args) -> None:
+    dbgen = os.path.abspath(args.dbgen)
+    print(f"{'scale':>6}{'MB':>9}{'router':>8}{'seconds':>10}{'MB/s':>9}{'peak py MB':>12}{'identical':>11}")
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory(dir=os.getenv('BENCHMARK_TMP')) as directory:
+            subprocess.run([f"cd {dbgen} && DSS_PATH={directory} ./dbgen -s {scale} -T o -f"], check=True, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            left_path, right_path = f"{directory}/orders.tbl", f"{directory}/lineitem.tbl"
+            size = (os.path.getsize(left_path) + os.path.getsize(right_path)) / 1e6
+
+            outputs = {}
+            for label in ("dict", "index"):
+                destinations = [f"{directory}/{label}_{table}_{node}.tbl" for table in ("orders", "lineitem") for node in range(args.nodes)]
+                tracemalloc.start()
+                start_time = time.time()
+                if label == "dict":
+                    dict_route(left_path, right_path, destinations[:args.nodes], destinations[args.nodes:])
+                else:
+                    index_route(left_path, right_path, destinations[:args.nodes], destinations[args.nodes:], args.chunk_size)
+                elapsed = time.time() - start_time
+                peak = tracemalloc.get_traced_memory()[1] / 1e6
+                tracemalloc.stop()
+                outputs[label] = destinations
+
+                identical = "" if label == "dict" else \
+                    str(all(filecmp.cmp(a, b, shallow=False) for a, b in zip(outputs["dict"], destinations)))
+                print(f"{scale:>6}{size:>9.1f}{label:>8}{elapsed:>10.2f}{size / elapsed:>9.1f}{peak:>12.1f}{identical:>11}")
+
+# Loads every generated table with psql (the old worker path) and with load_tables at each parallelism
+def benchmark_load(args) -> None:
+    db = connect_database()
+    dbgen = os.path.abspath(args.dbgen)
+    with tempfile.TemporaryDirectory(dir=os.getenv('BENCHMARK_TMP')) as directory:
+        subprocess.run([f"cd {dbgen} && DSS_PATH={directory} ./dbgen -s {args.scale} -f"], check=True, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        files = {table: f"{directory}/{table}.tbl" for table in TPCH_PRIMARY_KEYS}
+        rows = sum(count_file_lines(path) for path in files.values())
+
+        print(f"{'loader':<24}{'rows':>10}{'seconds':>10}{'rows/s':>12}")
+        for table in files:
+            db.delete_rows(table)
+        start_time = time.time()
+        commands = [argument for table, path in files.items() for argument in ('-c', f"\\copy {table} FROM '{path}' DELIMITER '|' CSV")]
+        subprocess.run(['psql', '-U', db.user, '-d', db.name] + commands, check=True, stdout=subprocess.DEVNULL)
+        elapsed = time.time() - start_time
+        print(f"{'psql':<24}{rows:>10}{elapsed:>10.2f}{rows / elapsed:>12.1f}")
+
+        for parallelism in args.parallelism:
+            for unlogged in (False, True):
+                # Switch persistence up front so the timed run neither inherits the last round's nor pays for the rewrite
+                for table in files:
+                    db.delete_rows(table)
+                    db.set_unlogged(table, unlogged)
+                start_time = time.time()
+                db.load_tables(files, parallelism, args.chunk_size, unlogged)
+                elapsed = time.time() - start_time
+                label = f"copy x{parallelism}" + (" unlogged" if unlogged else "")
+                print(f"{label:<24}{rows:>10}{elapsed:>10.2f}{rows / elapsed:>12.1f}")
+
+    for table in files:
+        db.delete_rows(table)
+    db.pool.closeall()
+
+BENCHMARKS = {
+    "pool": benchmark_pool,
+    "ingest": benchmark_ingest,
+    "wire": benchmark_wire,
+    "split": benchmark_split,
+    "route": benchmark_route,
+    "load": benchmark_load
+}
+
+def main() -> None:
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import collections
+import threading
+import json
+
+"""
+LRU cache of final query results on the aggregator
+------------------------------------------------------------------------------------------
+capacity: most results kept
+max_bytes: most JSON bytes kept across all results (a larger result is never cached)
+Keys combine the normalized SQL, the partitioning and the data version; anything that
+reloads data calls invalidate, which also bumps epoch so results computed across the
+reload are not stored.
+------------------------------------------------------------------------------------------
+"""
+class ResultCache:
+    def __init__(self, capacity: int, max_bytes: int) -> None:
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return (f"ResultCache(entries={len(self.entries)}, "
+                f"bytes={self.bytes}, "
+                f"hits={self.hits}, "
+                f"misses={self.misses})")
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0 and self.max_bytes > 0
+
+    def get(self, key: str) -> dict:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+    # Stores a result unless the data was reloaded since epoch (when the query started)
+    def put(self, key: str, result: dict, epoch: int) -> bool:
+        size = len(json.dumps(result))
+        with self.lock:
+            if not self.enabled or epoch != self.epoch or size > self.max_bytes:
+                return False
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (result, size)
+            self.bytes += size
+            while len(self.entries) > self.capacity or self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+            return True
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.epoch += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
@@ -0,0 +1,90 @@
+from .partition import *
+import threading
+import collections
+
+# How a table was placed: method is hash|range|follow|split|generated|replicated, boundaries only for range
+CatalogEntry = collections.namedtuple("CatalogEntry", ["table", "method", "column", "boundaries", "rows"])
+
+"""
+Partition catalog kept on the aggregator
+------------------------------------------------------------------------------------------
+Records how every table was placed during initialization (method, key column, range
+boundaries) and, once the worker files are final, how many rows each worker loads. The
+imbalance of a table is its largest partition over the mean partition, so 1.0 is perfect
+and the slowest worker runs imbalance times longer than an even split would.
+------------------------------------------------------------------------------------------
+"""
+class PartitionCatalog:
+    def __init__(self) -> None:
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"PartitionCatalog(tables={list(self.entries)})"
+
+    def record(self, table: str, method: str, column: str = None, boundaries: list[int] = None) -> None:
+        with self.lock:
+            self.entries[table] = CatalogEntry(table, method, column, boundaries, {})
+
+    # Rebuilds the catalog from an earlier report (worker files reused from the manifest)
+    def restore(self, report: dict) -> None:
+        with self.lock:
+            self.entries = {
+                table: CatalogEntry(table, entry["method"], entry["column"], entry["boundaries"], dict(entry["rows"]))
+                for table, entry in report["tables"].items()
+            }
+
+    # Rows a worker reported loading (tables the workers generate themselves have no file to count)
+    def record_rows(self, table: str, worker_id: str, rows: int) -> None:
+        with self.lock:
+            self.entries[table].rows[worker_id] = rows
+
+    # Counts the rows of every file each worker will load ({worker_id: {table: path}})
+    def measure(self, files: dict[str, dict[str, str]]) -> None:
+        counts = {}
+        for worker_id, tables in files.items():
+            for table, path in tables.items():
+                if path not in counts:
+                    counts[path] = count_file_lines(path)
+                with self.lock:
+                    if table not in self.entries:
+                        self.entries[table] = CatalogEntry(table, "replicated", None, None, {})
+                    self.entries[table].rows[worker_id] = counts[path]
+
+    # Tables split across the workers (every method but replicated)
+    def partitioned_tables(self) -> list[str]:
+        with self.lock:
+            return [table for table, entry in self.entries.items() if entry.method != "replicated"]
+
+    def imbalance(self, table: str) -> float:
+        rows = list(self.entries[table].rows.values())
+        if not rows or sum(rows) == 0:
+            return 1.0
+        return max(rows) / (sum(rows) / len(rows))
+
+    # Rows each worker loads across all tables
+    def worker_rows(self) -> dict[str, int]:
+        totals = collections.Counter()
+        for entry in self.entries.values():
+            totals.update(entry.rows)
+        return dict(totals)
+
+    def report(self) -> dict:
+        with self.lock:
+            tables = {
+                table: {
+                    "method": entry.method,
+                    "column": entry.column,
+                    "boundaries": entry.boundaries,
+                    "rows": entry.rows,
+                    "imbalance": round(self.imbalance(table), 4)
+                }
+                for table, entry in self.entries.items()
+            }
+            workers = self.worker_rows()
+        mean = sum(workers.values()) / len(workers) if workers else 0
+        return {
+            "tables": tables,
+            "worker_rows": workers,
+            "imbalance": round(max(workers.values()) / mean, 4) if mean else 1.0
+        }
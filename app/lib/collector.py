@@ -0,0 +1,141 @@
+from .result import *
+import threading
+import queue
+import json
+import time
+
+class PendingQuery:
+    def __init__(self, query_id: str, expected: list[str], merge=None) -> None:
+        self.query_id = query_id
+        self.expected = list(expected)
+        self.merge = merge if merge is not None else ResultSet.concat
+        self.results = {}
+        self.errors = {}
+        self.created = time.time()
+        self.completed = None
+        self.condition = threading.Condition()
+
+    def __repr__(self) -> str:
+        return (f"PendingQuery(query_id={self.query_id!r}, "
+                f"expected={self.expected}, "
+                f"received={list(self.results)}, "
+                f"errors={list(self.errors)})")
+
+    @property
+    def done(self) -> bool:
+        return all(worker_id in self.results or worker_id in self.errors for worker_id in self.expected)
+
+    @property
+    def missing(self) -> list[str]:
+        return [worker_id for worker_id in self.expected if worker_id not in self.results]
+
+    def deliver(self, worker_id: str, result: ResultSet) -> None:
+        with self.condition:
+            self.results[worker_id] = result
+            self.errors.pop(worker_id, None)
+            self.notify_if_done()
+
+    # A worker that can no longer report (its request failed) stops counting towards completion
+    def fail(self, worker_id: str, error: str) -> None:
+        with self.condition:
+            if worker_id not in self.results:
+                self.errors[worker_id] = error
+                self.notify_if_done()
+
+    def notify_if_done(self) -> None:
+        if self.done and self.completed is None:
+            self.completed = time.time()
+            self.condition.notify_all()
+
+    # Blocks until every expected worker reported (or failed); False means the timeout hit first
+    def wait(self, timeout: float = None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: self.done, timeout)
+
+    # Runs the merge hook over whatever arrived, in the expected worker order
+    def result(self) -> ResultSet:
+        with self.condition:
+            results = [self.results[worker_id] for worker_id in self.expected if worker_id in self.results]
+        return self.merge(results)
+
+"""
+Registry of in-flight queries keyed by query_id
+------------------------------------------------------------------------------------------
+/send_task registers the workers it expects before fanning out, /receive_result delivers
+into the registry and the waiting request wakes up as soon as the last worker reports.
+Results for unknown (finished, timed out) queries are dropped.
+------------------------------------------------------------------------------------------
+"""
+class ResultCollector:
+    def __init__(self, timeout: float = 300.0) -> None:
+        self.timeout = timeout
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"ResultCollector(timeout={self.timeout}, pending={list(self.pending)})"
+
+    def register(self, query_id: str, expected: list[str], merge=None) -> PendingQuery:
+        with self.lock:
+            if query_id in self.pending:
+                raise ValueError(f"Query {query_id} is already in flight")
+            pending = self.pending[query_id] = PendingQuery(query_id, expected, merge)
+        return pending
+
+    def deliver(self, query_id: str, worker_id: str, result: ResultSet) -> bool:
+        with self.lock:
+            pending = self.pending.get(query_id)
+        if pending is None:
+            return False
+        pending.deliver(worker_id, result)
+        return True
+
+    def fail(self, query_id: str, worker_id: str, error: str) -> None:
+        with self.lock:
+            pending = self.pending.get(query_id)
+        if pending is not None:
+            pending.fail(worker_id, error)
+
+    def wait(self, query_id: str, timeout: float = None) -> PendingQuery:
+        with self.lock:
+            pending = self.pending[query_id]
+        pending.wait(self.timeout if timeout is None else timeout)
+        return pending
+
+    def discard(self, query_id: str) -> None:
+        with self.lock:
+            self.pending.pop(query_id, None)
+
+# Writes query-results files on a background thread so persistence stays off the request path
+class ResultSink:
+    def __init__(self, enabled: bool = True, max_queued: int = 64) -> None:
+        self.enabled = enabled
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.thread = None
+        if enabled:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def __repr__(self) -> str:
+        return f"ResultSink(enabled={self.enabled}, queued={self.queue.qsize()})"
+
+    # Payloads are serialized on the writer thread, so callers must not mutate them afterwards
+    def write(self, path: str, payload) -> None:
+        if self.enabled:
+            self.queue.put((path, payload))
+
+    def run(self) -> None:
+        while True:
+            path, payload = self.queue.get()
+            try:
+                with open(path, "w") as f:
+                    f.write(json.dumps(payload.to_json() if isinstance(payload, ResultSet) else payload))
+            except Exception as e:
+                print(f"Error persisting {path}: {e}")
+            finally:
+                self.queue.task_done()
+
+    # Blocks until everything queued so far is on disk
+    def flush(self) -> None:
+        if self.enabled:
+            self.queue.join()
@@ -0,0 +1,119 @@
+import gzip
+import zlib
+import time
+
+# Optional codecs are only offered when their packages are installed on the node
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+IDENTITY = "identity"
+ADAPTIVE = "adaptive"
+
+# HTTP content-coding name -> (compress, decompress)
+CODECS = {
+    "gzip": (lambda body: gzip.compress(body, compresslevel=6), gzip.decompress),
+    "deflate": (lambda body: zlib.compress(body, 6), zlib.decompress),
+}
+if lz4 is not None:
+    CODECS["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+if zstandard is not None:
+    CODECS["zstd"] = (zstandard.ZstdCompressor(level=3).compress, lambda body: zstandard.ZstdDecompressor().decompress(body))
+
+# Adaptive mode prefers the cheapest codec that still compresses well
+ADAPTIVE_PREFERENCE = ["zstd", "lz4", "gzip", "deflate"]
+# Always safe to send to a peer that has not advertised anything (standard library only)
+BASELINE_ENCODINGS = ["gzip", "deflate", IDENTITY]
+
+UNCOMPRESSED_LENGTH_HEADER = "X-Uncompressed-Length"
+COMPRESS_TIME_HEADER = "X-Compress-Time"
+
+def available_encodings() -> list[str]:
+    return [encoding for encoding in ADAPTIVE_PREFERENCE if encoding in CODECS] + [IDENTITY]
+
+class CompressionPolicy:
+    def __init__(self, codec: str = ADAPTIVE, min_size: int = 1024) -> None:
+        if codec not in CODECS and codec not in (IDENTITY, ADAPTIVE):
+            raise ValueError(f"Unsupported compression codec: {codec}")
+
+        self.codec = codec
+        self.min_size = min_size
+
+    def __repr__(self) -> str:
+        return f"CompressionPolicy(codec={self.codec}, min_size={self.min_size})"
+
+    # Picks an encoding the receiver advertised (accept=None means nothing was advertised)
+    def choose(self, size: int, accept: list[str] = None) -> str:
+        accept = accept if accept is not None else BASELINE_ENCODINGS
+        if self.codec == IDENTITY:
+            return IDENTITY
+
+        if self.codec == ADAPTIVE:
+            # Tiny payloads cost more CPU to compress than they save on the wire
+            if size < self.min_size:
+                return IDENTITY
+            for encoding in ADAPTIVE_PREFERENCE:
+                if encoding in CODECS and encoding in accept:
+                    return encoding
+            return IDENTITY
+
+        return self.codec if self.codec in accept else IDENTITY
+
+    # Returns the body to send, the headers describing it and the transfer stats
+    def encode(self, body: bytes, content_type: str, accept: list[str] = None) -> tuple[bytes, dict, dict]:
+        encoding = self.choose(len(body), accept)
+        start_time = time.thread_time()
+        payload = body if encoding == IDENTITY else CODECS[encoding][0](body)
+        compress_time = time.thread_time() - start_time
+
+        headers = {
+            "Content-Type": content_type,
+            UNCOMPRESSED_LENGTH_HEADER: str(len(body)),
+            COMPRESS_TIME_HEADER: f"{compress_time:.9f}"
+        }
+        if encoding != IDENTITY:
+            headers["Content-Encoding"] = encoding
+
+        return payload, headers, transfer_stats(encoding, len(body), len(payload), compress_time)
+
+# Decompresses a request/response body using its headers; returns the raw body and transfer stats
+def decode_body(body: bytes, headers) -> tuple[bytes, dict]:
+    encoding = headers.get("Content-Encoding", IDENTITY) or IDENTITY
+    if encoding != IDENTITY and encoding not in CODECS:
+        raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+
+    start_time = time.thread_time()
+    raw = body if encoding == IDENTITY else CODECS[encoding][1](body)
+    decompress_time = time.thread_time() - start_time
+
+    stats = transfer_stats(encoding, len(raw), len(body), float(headers.get(COMPRESS_TIME_HEADER, 0.0)))
+    stats["decompress_cpu_time"] = decompress_time
+    return raw, stats
+
+def transfer_stats(encoding: str, raw_bytes: int, wire_bytes: int, compress_time: float) -> dict:
+    return {
+        "encoding": encoding,
+        "raw_bytes": raw_bytes,
+        "wire_bytes": wire_bytes,
+        "ratio": raw_bytes / wire_bytes if wire_bytes else 1.0,
+        "compress_cpu_time": compress_time
+    }
+
+# Rolls per-transfer stats up into the totals written to *_network_latency.json
+def summarize_transfers(transfers: list[dict]) -> dict:
+    raw_bytes = sum(transfer["raw_bytes"] for transfer in transfers)
+    wire_bytes = sum(transfer["wire_bytes"] for transfer in transfers)
+    return {
+        "transfers": len(transfers),
+        "raw_bytes": raw_bytes,
+        "wire_bytes": wire_bytes,
+        "ratio": raw_bytes / wire_bytes if wire_bytes else 1.0,
+        "compress_cpu_time": sum(transfer["compress_cpu_time"] for transfer in transfers),
+        "decompress_cpu_time": sum(transfer.get("decompress_cpu_time", 0.0) for transfer in transfers)
+    }
@@ -0,0 +1,118 @@
+from .planner import *
+import collections
+import sqlparse
+import re
+
+JoinEdge = collections.namedtuple("JoinEdge", ["left_table", "left_column", "right_table", "right_column"])
+# method: "hash" places rows by key % nodes, "follow" sends rows wherever parent rows with the same key
+# went and "split" (no column) splits the table evenly by lines
+PartitionStep = collections.namedtuple("PartitionStep", ["table", "column", "method", "parent", "parent_column"])
+
+EQUI_JOIN = re.compile(r'^\s*(?:\w+\.)?(\w+)\s*=\s*(?:\w+\.)?(\w+)\s*$')
+INTEGER_TYPES = {"integer", "int", "bigint", "smallint"}
+
+class CoPartitionPlan:
+    def __init__(self, steps: list[PartitionStep] = None, replicated: list[str] = None, edges: list[JoinEdge] = None, reason: str = None) -> None:
+        self.steps = steps if steps is not None else []
+        self.replicated = replicated if replicated is not None else []
+        self.edges = edges if edges is not None else []
+        self.reason = reason
+
+    def __repr__(self) -> str:
+        return (f"CoPartitionPlan(steps={self.steps}, "
+                f"replicated={self.replicated}, "
+                f"reason={self.reason!r})")
+
+    @property
+    def tables(self) -> list[str]:
+        return [step.table for step in self.steps]
+
+    # Tables routed by key (split tables go through setup_partitions)
+    @property
+    def routed(self) -> list[PartitionStep]:
+        return [step for step in self.steps if step.method != "split"]
+
+    # Columns of a table that tables placed after it follow
+    def exports(self, table: str) -> list[str]:
+        return sorted({step.parent_column for step in self.steps if step.parent == table and step.method == "follow"})
+
+# Equi-join predicates (col = col across two tables) among the top-level WHERE conjuncts
+def join_edges(statement: sqlparse.sql.Statement, schema: dict[str, list[tuple[str, str]]]) -> list[JoinEdge]:
+    where = main_where(statement)
+    if where is None:
+        return []
+
+    owners = column_owners(schema)
+    types = {column: kind.lower() for columns in schema.values() for column, kind in columns}
+    edges = []
+    for conjunct in top_level_conjuncts(where):
+        match = EQUI_JOIN.match(''.join(str(token) for token in conjunct))
+        if match is None:
+            continue
+        left, right = match.group(1).lower(), match.group(2).lower()
+        if left in owners and right in owners and owners[left] != owners[right] and types[left] in INTEGER_TYPES and types[right] in INTEGER_TYPES:
+            edges.append(JoinEdge(owners[left], left, owners[right], right))
+    return edges
+
+"""
+Works out how to co-partition the tables of a sample query
+------------------------------------------------------------------------------------------
+The largest joinable table is the root and is hashed on the join key shared with its
+largest neighbour. Walking the equi-join graph outwards, a table joined on its parent's
+partition key is hashed on the same key (co-located), any other table follows its parent:
+each row goes to every node holding a parent row with the same key (e.g. customer follows
+orders on o_custkey when orders/lineitem are placed by orderkey). Every join result is then
+produced exactly once, on the node of its root row.
+
+Everything else the query reads is replicated. Without usable equi-joins (derived tables,
+OR'd join predicates, explicit LEFT JOINs) only the root is split evenly: the largest table
+read exactly once, or the preserved (first) table of an explicit JOIN.
+------------------------------------------------------------------------------------------
+"""
+def plan_copartition(query: str, schema: dict[str, list[tuple[str, str]]], sizes: dict[str, int]) -> CoPartitionPlan:
+    statement = sqlparse.parse(query)[0]
+    tables = [t for t in extract_tables(statement) if t['table'].lower() in schema]
+    main = [t['table'].lower() for t in tables if not t['subquery']]
+    read = list(dict.fromkeys(t['table'].lower() for t in tables))
+
+    # Only tables read exactly once can be split without starving another reference to them
+    occurrences = collections.Counter(t['table'].lower() for t in tables)
+    candidates = [table for table in read if occurrences[table] == 1]
+    if not candidates:
+        return CoPartitionPlan(reason="Every table is read more than once")
+
+    if re.search(r'\bjoin\b', query, re.I):
+        if re.search(r'\b(right|full)\s+(outer\s+)?join\b', query, re.I):
+            return CoPartitionPlan(reason="RIGHT/FULL joins are not co-partitioned")
+        root = candidates[0]
+        return CoPartitionPlan([PartitionStep(root, None, "split", None, None)], [table for table in read if table != root], reason="Explicit JOIN, splitting the preserved table")
+
+    joinable = {table for table in candidates if table in main}
+    edges = [edge for edge in join_edges(statement, schema) if edge.left_table in joinable and edge.right_table in joinable]
+    if not edges:
+        root = max(candidates, key=lambda table: (table in main, sizes.get(table, 0), table))
+        return CoPartitionPlan([PartitionStep(root, None, "split", None, None)], [table for table in read if table != root], reason="No equi-join between co-partitionable tables")
+
+    neighbours = collections.defaultdict(list)
+    for edge in edges:
+        neighbours[edge.left_table].append((edge.left_column, edge.right_table, edge.right_column))
+        neighbours[edge.right_table].append((edge.right_column, edge.left_table, edge.left_column))
+
+    root = max(neighbours, key=lambda table: (sizes.get(table, 0), table))
+    column = max(neighbours[root], key=lambda neighbour: (sizes.get(neighbour[1], 0), neighbour[1]))[0]
+    steps = [PartitionStep(root, column, "hash", None, None)]
+    placed = {root: steps[0]}
+
+    # Breadth-first so every parent is routed (and its keys exported) before its children
+    pending = collections.deque([root])
+    while pending:
+        parent = placed[pending.popleft()]
+        for parent_column, table, table_column in sorted(neighbours[parent.table], key=lambda neighbour: -sizes.get(neighbour[1], 0)):
+            if table in placed:
+                continue
+            method = "hash" if parent.method == "hash" and parent_column == parent.column else "follow"
+            placed[table] = PartitionStep(table, table_column, method, parent.table, parent_column)
+            steps.append(placed[table])
+            pending.append(table)
+
+    return CoPartitionPlan(steps, [table for table in read if table not in placed], edges)
@@ -1,12 +1,188 @@
 from psycopg2.errors import DuplicateDatabase
-from psycopg2 import sql
+from psycopg2 import sql, extensions
+from contextlib import contextmanager
 from .globals import *
+from .result import *
+from .partition import *
+from .indexing import *
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
+import io
+import threading
 import psycopg2
+import uuid
 import time
 
+# Bytes handed to COPY per read while bulk loading .tbl files
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# File-like view of a [start, end) byte range, so one newline-aligned chunk streams per connection
+class FileRange(io.RawIOBase):
+    def __init__(self, path: str, start: int, end: int) -> None:
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+        super().close()
+
+# Keyword arguments for Database.prepare_workload from an [INDEXING] config section
+def indexing_options(section) -> dict:
+    return {
+        "parallelism": int(section["parallelism"]),
+        "measure": section.getboolean("measure")
+    }
+
+# Keyword arguments for Database.load_tables from a [LOADING] config section
+def loading_options(section) -> dict:
+    return {
+        "parallelism": int(section["parallelism"]),
+        "chunk_size": int(section["chunk_size"]),
+        "unlogged": section.getboolean("unlogged"),
+        "primary_keys": TPCH_PRIMARY_KEYS if section.getboolean("primary_keys") else None
+    }
+
+class ConnectionPool:
+    def __init__(
+            self,
+            min_size: int,
+            max_size: int,
+            health_check_interval: float = 30.0,
+            **connect_kwargs
+    ) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool sizes: min={min_size}, max={max_size}")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.connect_kwargs = connect_kwargs
+
+        # Idle connections are stored with the time they were returned to the pool
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.connections_opened = 0
+        self.checkouts = 0
+
+        for _ in range(min_size):
+            self.idle.append((self.__open(), time.monotonic()))
+
+    def __repr__(self) -> str:
+        return (f"ConnectionPool(min_size={self.min_size}, max_size={self.max_size}, "
+                f"idle={len(self.idle)}, connections_opened={self.connections_opened}, "
+                f"checkouts={self.checkouts})")
+
+    def __open(self) -> extensions.connection:
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self.lock:
+            self.connections_opened += 1
+        return conn
+
+    def __discard(self, conn: extensions.connection) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def __healthy(self, conn: extensions.connection, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+
+        # Only ping connections that sat idle long enough for the server to drop them
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self) -> extensions.connection:
+        # Blocks while max_size connections are checked out
+        self.slots.acquire()
+        try:
+            while True:
+                with self.lock:
+                    entry = self.idle.pop() if self.idle else None
+
+                if entry is None:
+                    conn = self.__open()
+                    break
+
+                conn, idle_since = entry
+                if self.__healthy(conn, idle_since):
+                    break
+                self.__discard(conn)
+        except Exception:
+            self.slots.release()
+            raise
+
+        with self.lock:
+            self.checkouts += 1
+        return conn
+
+    def putconn(self, conn: extensions.connection) -> None:
+        try:
+            if not conn.closed:
+                # Never hand out a connection with an open or aborted transaction
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+
+            if conn.closed:
+                return
+
+            with self.lock:
+                if len(self.idle) < self.max_size:
+                    self.idle.append((conn, time.monotonic()))
+                    return
+            self.__discard(conn)
+        except psycopg2.Error:
+            self.__discard(conn)
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            self.__discard(conn)
+
 class Database:
-    def __init__(self, host: str, port: str, name: str, user: str, password: str, schema: str) -> None:
+    def __init__(
+            self,
+            host: str,
+            port: str,
+            name: str,
+            user: str,
+            password: str,
+            schema: str,
+            min_connections: int = 1,
+            max_connections: int = 10,
+            health_check_interval: float = 30.0
+    ) -> None:
         self.host = host
         self.port = port
         self.name = name
@@ -17,6 +193,18 @@ class Database:
         self.__postgres_db_setup()
         self.__load_schema()
 
+        # Connections are shared across Flask request threads
+        self.pool = ConnectionPool(
+            min_connections,
+            max_connections,
+            health_check_interval,
+            dbname=self.name,
+            user=self.user,
+            password=self.password,
+            host=self.host,
+            port=self.port
+        )
+
     def __repr__(self) -> str:
         return f"Database(host={self.host},port={self.port},name={self.name},user={self.user}, password={self.password})"
     
@@ -61,25 +249,43 @@ class Database:
             print(f"Error setting up database: {e}")
 
     def insert_rows(self, table: Table):
-        # Open cursor for insertion
-        conn = psycopg2.connect(
-            dbname=self.name,
-            user=self.user,
-            password=self.password,
-            host=self.host,
-            port=self.port
-        )
-        cur = conn.cursor()
-        
-        columns = table.rows[0].keys()
-        tup_str = ','.join(['%s' for _ in columns])
-        args_str = ','.join(cur.mogrify("(%s)" % tup_str, tuple(row.values())).decode('utf-8') for row in table.rows)
-        cur.execute(f"INSERT INTO {table.name} VALUES " + args_str) 
+        # Borrow a pooled connection for insertion
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+
+            tup_str = ','.join(['%s' for _ in table.rows.columns])
+            args_str = ','.join(cur.mogrify("(%s)" % tup_str, row).decode('utf-8') for row in table.rows.rows())
+            cur.execute(f"INSERT INTO {table.name} VALUES " + args_str) 
+
+            conn.commit()
+            cur.close()
+
+    def copy_rows(self, table: Table, schema: str = None) -> int:
+        # Stream rows with COPY FROM STDIN instead of building an INSERT statement
+        if not len(table.rows):
+            return 0
 
-        conn.commit()
+        # Format column by column, then stitch the rows together
+        columns = [
+            [COPY_NULL if value is None else str(value).translate(COPY_ESCAPES) for value in as_list(column)]
+            for column in table.rows.data
+        ]
+        buffer = io.StringIO()
+        buffer.writelines('\t'.join(row) + '\n' for row in zip(*columns))
+        buffer.seek(0)
 
-        cur.close()
-        conn.close()
+        target = sql.Identifier(schema, table.name) if schema else sql.Identifier(table.name)
+        query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+            target,
+            sql.SQL(', ').join(map(sql.Identifier, table.rows.columns))
+        )
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            cur.copy_expert(query, buffer)
+            conn.commit()
+            cur.close()
+
+        return len(table.rows)
 
     def __load_schema(self) -> None:
         # Load schema
@@ -89,93 +295,321 @@ class Database:
         subprocess.run(['psql', '-U', self.user, '-d', self.name, '-c', '\\dt'], check=True)
         
     
-    def fetch_all(self, table_name: str, batch_size: int = 30000):
+    def fetch_all(self, table_name: str, batch_size: int = 30000, columns: list[str] = None, predicates: list[str] = None):
         try:
-            conn = psycopg2.connect(
-                dbname=self.name,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port
-            )
-            cursor = conn.cursor()
-            
-            # Fetch all rows
-            query = sql.SQL("SELECT * FROM {}").format(sql.Identifier(table_name))
-            cursor.execute(query)
-            # rows = cursor.fetchall()
-            
-            while True:
-                rows = cursor.fetchmany(batch_size)
-                if not rows:
-                    break
-
-                # Get column names
-                if 'colnames' not in locals():
-                    colnames = [desc[0] for desc in cursor.description]
+            with self.pool.connection() as conn:
+                # Named cursors stay on the server, so only batch_size rows are held in memory at once
+                cursor = conn.cursor(name=f"fetch_{table_name}_{uuid.uuid4().hex}")
+                cursor.itersize = batch_size
+                
+                # Fetch the projected columns of every row passing the pushed-down predicates
+                projection = sql.SQL(', ').join(map(sql.Identifier, columns)) if columns else sql.SQL('*')
+                query = sql.SQL("SELECT {} FROM {}").format(projection, sql.Identifier(table_name))
+                if predicates:
+                    query += sql.SQL(" WHERE ") + sql.SQL(" AND ").join(sql.SQL(f"({predicate})") for predicate in predicates)
+                cursor.execute(query)
+                
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
 
-                # Yield rows as dictionaries
-                yield [dict(zip(colnames, map(str, list(row)))) for row in rows]
-            
-            # Get column names
-            # colnames = [desc[0] for desc in cursor.description]
-            
-            # # Convert to list of dictionaries
-            # result = [dict(zip(colnames, map(str, list(row)))) for row in rows]
-            
-            cursor.close()
-            conn.close()
+                    # Yield typed column batches (the description is only known after the first fetch)
+                    yield ResultSet.from_rows(cursor.description, rows)
+                
+                cursor.close()
             
+        # Re-raised so the caller fails the upload instead of shipping a partial table
         except Exception as e:
             print(f"Error fetching data from {table_name}: {e}")
-            return []
+            raise
 
-    def execute_query(self, query: str) -> dict:
+    def execute_query(self, query: str, search_path: list[str] = None) -> ResultSet:
         try:
-            conn = psycopg2.connect(
-                dbname=self.name,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port
-            )
-            cursor = conn.cursor()
-            
-            # Execute query
-            cursor.execute(query)
-            
-            rows = cursor.fetchall()
-            colnames = [desc[0] for desc in cursor.description]
-            result = [dict(zip(colnames, map(str, list(row)))) for row in rows]
-            
-            cursor.close()
-            conn.close()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+
+                # Resolve table names against e.g. staging tables first (reset when the transaction ends)
+                if search_path:
+                    cursor.execute(sql.SQL("SET LOCAL search_path TO {}").format(
+                        sql.SQL(', ').join(map(sql.Identifier, search_path))
+                    ))
+                
+                # Execute query
+                cursor.execute(query)
+                
+                rows = cursor.fetchall()
+                result = ResultSet.from_rows(cursor.description, rows)
+                
+                cursor.close()
             
             return result
             
+        # Re-raised so a failed query is never mistaken for an empty answer
         except Exception as e:
             print(f"Error executing query: {e}")
-            return {}
+            raise
         
     def delete_rows(self, table_name: str) -> None:
         try:
-            conn = psycopg2.connect(
-                dbname=self.name,
-                user=self.user,
-                password=self.password,
-                host=self.host,
-                port=self.port
-            )
-            cursor = conn.cursor()
-            
-            # Delete all rows
-            query = sql.SQL("TRUNCATE TABLE {}").format(sql.Identifier(table_name))
-            cursor.execute(query)
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                # Delete all rows
+                query = sql.SQL("TRUNCATE TABLE {}").format(sql.Identifier(table_name))
+                cursor.execute(query)
+                
+                conn.commit()
+                cursor.close()
             
+        except Exception as e:
+            print(f"Error deleting rows from {table_name}: {e}")
+            return {}
+
+    # Files loaded into this database ({table: crc32}); the record lives next to the data, so it
+    # disappears with it when the container is recreated
+    def loaded_files(self) -> dict[str, str]:
+        target = sql.Identifier(LOAD_MANIFEST_TABLE)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} (table_name TEXT PRIMARY KEY, path TEXT, checksum TEXT)").format(target))
+            cursor.execute(sql.SQL("SELECT table_name, checksum FROM {}").format(target))
+            loaded = dict(cursor.fetchall())
             conn.commit()
             cursor.close()
-            conn.close()
-            
+        return loaded
+
+    # Records (or with checksum None forgets) which file a table holds
+    def record_loaded(self, table_name: str, path: str, checksum: str = None) -> None:
+        target = sql.Identifier(LOAD_MANIFEST_TABLE)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql.SQL("DELETE FROM {} WHERE table_name = %s").format(target), (table_name,))
+            if checksum is not None:
+                cursor.execute(sql.SQL("INSERT INTO {} VALUES (%s, %s, %s)").format(target), (table_name, path, checksum))
+            conn.commit()
+            cursor.close()
+
+    # Loads {table: path or [paths]} .tbl files, truncating each table first so re-initializing never
+    # duplicates rows. Tables whose manifest checksum matches what they already hold are skipped (no
+    # checksum means always reload); exclusive also empties loaded tables missing from files
+    def load_files(self, files: dict, checksums: dict[str, str] = None, exclusive: bool = False, **options) -> dict[str, dict]:
+        checksums = checksums if checksums is not None else {}
+        loaded = self.loaded_files()
+        pending = {table: path for table, path in files.items() if checksums.get(table) is None or loaded.get(table) != checksums[table]}
+        stale = [table for table in loaded if table not in files] if exclusive else []
+        for table in list(pending) + stale:
+            self.record_loaded(table, None)
+        for table in stale:
+            self.delete_rows(table)
+
+        stats = self.load_tables(pending, **options) if pending else {}
+        for table, path in pending.items():
+            if checksums.get(table) is not None:
+                self.record_loaded(table, path if isinstance(path, str) else ",".join(path), checksums[table])
+        return stats
+
+    # Empties a table before a bulk load, dropping its workload indexes (and its primary key, when the load
+    # adds it back) so rows stream in without index upkeep
+    def prepare_load(self, table_name: str, unlogged: bool = False, drop_primary_key: bool = False) -> None:
+        indexes = self.workload_indexes([table_name])
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if drop_primary_key:
+                cursor.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}").format(sql.Identifier(table_name), sql.Identifier(f"{table_name}_pkey")))
+            for index in indexes:
+                cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(index)))
+            cursor.execute(sql.SQL("TRUNCATE TABLE {}").format(sql.Identifier(table_name)))
+            conn.commit()
+            cursor.close()
+        # The .tbl files can always be reloaded, so the table can skip the WAL (and goes back to logged
+        # once unlogged loading is turned off)
+        self.set_unlogged(table_name, unlogged)
+
+    # Switches a table between UNLOGGED and LOGGED, only when its persistence differs (both rewrite the table)
+    def set_unlogged(self, table_name: str, unlogged: bool) -> None:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT relpersistence FROM pg_class WHERE oid = %s::regclass", (table_name,))
+            if (cursor.fetchone()[0] == 'u') != unlogged:
+                cursor.execute(sql.SQL("ALTER TABLE {} SET {}").format(sql.Identifier(table_name), sql.SQL("UNLOGGED" if unlogged else "LOGGED")))
+            conn.commit()
+            cursor.close()
+
+    # COPYs one chunk of a .tbl file on its own pooled connection; returns (rows, start, end)
+    def copy_chunk(self, table_name: str, path: str, start: int, end: int) -> tuple[int, float, float]:
+        started = time.time()
+        query = sql.SQL("COPY {} FROM STDIN WITH (FORMAT csv, DELIMITER '|')").format(sql.Identifier(table_name))
+        with self.pool.connection() as conn, FileRange(path, start, end) as chunk:
+            cursor = conn.cursor()
+            cursor.copy_expert(query, chunk, size=COPY_BUFFER_SIZE)
+            rows = cursor.rowcount
+            conn.commit()
+            cursor.close()
+        return rows, started, time.time()
+
+    def add_primary_key(self, table_name: str, columns: list[str]) -> float:
+        started = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql.SQL("ALTER TABLE {} ADD PRIMARY KEY ({})").format(
+                sql.Identifier(table_name), sql.SQL(', ').join(map(sql.Identifier, columns))))
+            conn.commit()
+            cursor.close()
+        return time.time() - started
+
+    # Bulk loads {table: path or [paths]} .tbl files with COPY over pooled connections, parallelism
+    # newline-aligned chunks at a time (across tables and within large ones). Tables are emptied (and
+    # optionally made UNLOGGED) first and primary_keys ({table: columns}) are only added once every row
+    # is in. Returns per-table rows, seconds and rows/s
+    def load_tables(self, files: dict, parallelism: int = 4, chunk_size: int = 64 * 1024 * 1024, unlogged: bool = False, primary_keys: dict[str, list[str]] = None) -> dict[str, dict]:
+        files = {table: [paths] if isinstance(paths, str) else list(paths) for table, paths in files.items()}
+        primary_keys = {table: columns for table, columns in (primary_keys or {}).items() if table in files}
+        for table in files:
+            self.prepare_load(table, unlogged, table in primary_keys)
+
+        # Largest chunks first so the big tables never trail behind on a single connection
+        chunks = [(table, path, start, end) for table, paths in files.items() for path in paths for start, end in chunk_ranges(path, chunk_size)]
+        chunks.sort(key=lambda chunk: chunk[2] - chunk[3])
+        with ThreadPoolExecutor(max_workers=max(parallelism, 1)) as executor:
+            copies = [(chunk[0], executor.submit(self.copy_chunk, *chunk)) for chunk in chunks]
+            results = collections.defaultdict(list)
+            for table, future in copies:
+                results[table].append(future.result())
+            keys = {table: executor.submit(self.add_primary_key, table, columns) for table, columns in primary_keys.items()}
+
+        stats = {}
+        for table in files:
+            rows = sum(result[0] for result in results[table])
+            seconds = max(result[2] for result in results[table]) - min(result[1] for result in results[table]) if results[table] else 0.0
+            stats[table] = {"rows": rows, "seconds": round(seconds, 4), "rows_per_second": round(rows / seconds) if seconds else None, "chunks": len(results[table])}
+            if table in keys:
+                stats[table]["primary_key_seconds"] = round(keys[table].result(), 4)
+            print(f"Loaded {table}: {rows} rows in {seconds:.2f}s ({stats[table]['rows_per_second']} rows/s)")
+        return stats
+
+    # Workload indexes in this database ({index name: table}), optionally only those on tables
+    def workload_indexes(self, tables: list[str] = None) -> dict[str, str]:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT indexname, tablename FROM pg_indexes WHERE schemaname = current_schema() AND right(indexname, %s) = %s", (len(INDEX_SUFFIX), INDEX_SUFFIX))
+            indexes = {index: table for index, table in cursor.fetchall() if tables is None or table in tables}
+            conn.commit()
+            cursor.close()
+        return indexes
+
+    def analyze_table(self, table_name: str) -> float:
+        started = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table_name)))
+            conn.commit()
+            cursor.close()
+        return time.time() - started
+
+    def create_index(self, table_name: str, column: str) -> float:
+        started = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} ({})").format(
+                sql.Identifier(index_name(column)), sql.Identifier(table_name), sql.Identifier(column)))
+            conn.commit()
+            cursor.close()
+        return time.time() - started
+
+    def drop_index(self, index: str) -> None:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(index)))
+            conn.commit()
+            cursor.close()
+
+    # Server-side execution time of a query in milliseconds (EXPLAIN ANALYZE runs it without shipping rows)
+    def execution_time(self, query: str) -> float:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query.strip().rstrip(';')}")
+            plan = cursor.fetchone()[0]
+            conn.commit()
+            cursor.close()
+        return plan[0]["Execution Time"]
+
+    def time_queries(self, queries: dict[str, str]) -> dict[str, float]:
+        timings = {}
+        for name, query in queries.items():
+            try:
+                timings[name] = round(self.execution_time(query), 3)
+            except Exception as e:
+                print(f"Error timing {name}: {e}")
+        return timings
+
+    # Post-load stage: ANALYZEs the freshly loaded tables and makes the workload indexes on tables
+    # match indexes ({table, column, ...} from plan_indexes): stale ones are dropped and missing ones
+    # built parallelism at a time, each CREATE INDEX on its own pooled connection (existing ones are
+    # kept). With measure, the queries are timed before and after the build. Returns the cost of
+    # every step and the per-query speedup
+    def prepare_workload(self, analyze: list[str], tables: list[str], indexes: list[dict], queries: dict[str, str] = None, parallelism: int = 4, measure: bool = True) -> dict:
+        wanted = {index_name(index["column"]): index for index in indexes if index["table"] in tables}
+        existing = self.workload_indexes(tables)
+        for index in existing:
+            if index not in wanted:
+                self.drop_index(index)
+        missing = {name: index for name, index in wanted.items() if name not in existing}
+
+        with ThreadPoolExecutor(max_workers=max(parallelism, 1)) as executor:
+            analyzed = {table: executor.submit(self.analyze_table, table) for table in analyze}
+            analyzed = {table: round(future.result(), 4) for table, future in analyzed.items()}
+
+            # Baseline runs after ANALYZE so both timings plan with the same statistics
+            timed = queries if measure and missing and queries else {}
+            before = self.time_queries(timed)
+
+            # Largest tables first so their builds never trail behind on a single connection
+            started = time.time()
+            order = sorted(missing, key=lambda name: -self.table_size(missing[name]["table"]))
+            builds = {name: executor.submit(self.create_index, missing[name]["table"], missing[name]["column"]) for name in order}
+            built = {name: {"table": missing[name]["table"], "column": missing[name]["column"], "seconds": round(future.result(), 4)} for name, future in builds.items()}
+            build_seconds = time.time() - started
+        after = self.time_queries(timed)
+
+        speedups = {
+            name: {"before_ms": before[name], "after_ms": after[name], "speedup": round(before[name] / after[name], 3) if after[name] else None}
+            for name in before if name in after
+        }
+        print(f"Analyzed {list(analyzed)}, built {len(built)} indexes ({len(wanted) - len(missing)} kept) in {build_seconds:.2f}s")
+        return {"analyze": analyzed, "indexes": built, "kept": sorted(set(wanted) - set(missing)), "build_seconds": round(build_seconds, 4), "queries": speedups}
+
+    def table_size(self, table_name: str) -> int:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_relation_size(%s)", (table_name,))
+            size = cursor.fetchone()[0]
+            conn.commit()
+            cursor.close()
+        return size
+
+    def create_staging_table(self, schema: str, table_name: str, columns: list[tuple[str, str]]) -> None:
+        # Unlogged, constraint-free copy of just the columns a query reads
+        definitions = sql.SQL(', ').join(
+            sql.SQL("{} {}").format(sql.Identifier(column), sql.SQL(column_type)) for column, column_type in columns
+        )
+        target = sql.Identifier(schema, table_name)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(schema)))
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(target))
+            cursor.execute(sql.SQL("CREATE UNLOGGED TABLE {} ({})").format(target, definitions))
+            conn.commit()
+            cursor.close()
+
+    # Drops a query's staging schema with every table staged in it
+    def drop_staging_schema(self, schema: str) -> None:
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema)))
+                conn.commit()
+                cursor.close()
+
         except Exception as e:
-            print(f"Error deleting rows from {table_name}: {e}")
-            return {}
\ No newline at end of file
+            print(f"Error dropping staging schema {schema}: {e}")
\ No newline at end of file
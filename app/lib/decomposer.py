@@ -0,0 +1,562 @@
+from decimal import Decimal
+from enum import Enum
+from .planner import split_top_level
+from .result import *
+import collections
+import datetime
+import operator
+import sqlparse
+import ast
+import re
+
+# How the aggregator combines what every worker sends back for a query
+class MergeStrategy(Enum):
+    AGGREGATE = 0   # Workers return partial aggregates that are re-aggregated by group key
+    ROWS = 1        # Workers return plain rows that are concatenated, re-sorted and re-limited
+    CONCAT = 2      # Not decomposable, worker results are only concatenated
+
+class DecompositionError(ValueError):
+    pass
+
+Aggregate = collections.namedtuple("Aggregate", ["function", "argument", "distinct"])
+OrderKey = collections.namedtuple("OrderKey", ["column", "descending", "nulls_first"])
+
+AGGREGATE_CALL = re.compile(r'\b(sum|count|avg|min|max)\s*\(', re.I)
+ALIAS = re.compile(r'^(.*?)\s+as\s+"?(\w+)"?\s*$', re.S | re.I)
+ORDER_ITEM = re.compile(r'^(.*?)(?:\s+(asc|desc))?(?:\s+nulls\s+(first|last))?\s*$', re.S | re.I)
+COLUMN_REFERENCE = re.compile(r'^(?:\w+\.)?(\w+)$')
+FUNCTION_CALL = re.compile(r'^(\w+)\s*\(')
+# Top-level keywords this module knows how to place (anything else makes the query opaque)
+CLAUSES = {"SELECT", "DISTINCT", "FROM", "GROUP BY", "HAVING", "ORDER BY", "LIMIT"}
+UNSUPPORTED = {"UNION", "UNION ALL", "INTERSECT", "EXCEPT", "OFFSET", "FETCH", "WINDOW", "WITH"}
+
+# Token grammar for the scalar SQL left once aggregates are replaced by placeholders
+EXPRESSION_TOKEN = re.compile(r"\s+|'(?:[^']|'')*'|\d+\.\d*|\.\d+|\d+|[A-Za-z_][\w.]*|<>|!=|<=|>=|[-+*/()<>=]")
+SQL_OPERATORS = {"=": "==", "<>": "!=", "!=": "!=", "<=": "<=", ">=": ">=", "<": "<", ">": ">", "+": "+", "-": "-", "*": "*", "/": "/", "(": "(", ")": ")"}
+
+def normalize(text: str) -> str:
+    return ' '.join(text.split()).lower()
+
+def sql_divide(left, right):
+    # Postgres integer division truncates towards zero
+    if isinstance(left, int) and isinstance(right, int):
+        quotient = abs(left) // abs(right)
+        return quotient if (left < 0) == (right < 0) else -quotient
+    return left / right
+
+def coerce(left, right) -> tuple:
+    # Decimal and float don't mix in Python; Postgres would promote to double precision
+    if isinstance(left, float) and isinstance(right, Decimal) or isinstance(left, Decimal) and isinstance(right, float):
+        return float(left), float(right)
+    return left, right
+
+def null_safe(function) -> np.ufunc:
+    return np.frompyfunc(lambda left, right: None if left is None or right is None else function(*coerce(left, right)), 2, 1)
+
+def sql_and(left, right):
+    if left is False or right is False:
+        return False
+    return None if left is None or right is None else True
+
+def sql_or(left, right):
+    if left is True or right is True:
+        return True
+    return None if left is None or right is None else False
+
+# Element-wise (NumPy object array) versions of the operators allowed in a merged expression
+BINARY_OPERATORS = {
+    ast.Add: null_safe(operator.add), ast.Sub: null_safe(operator.sub),
+    ast.Mult: null_safe(operator.mul), ast.Div: null_safe(sql_divide)
+}
+COMPARISONS = {
+    ast.Eq: null_safe(operator.eq), ast.NotEq: null_safe(operator.ne),
+    ast.Lt: null_safe(operator.lt), ast.LtE: null_safe(operator.le),
+    ast.Gt: null_safe(operator.gt), ast.GtE: null_safe(operator.ge)
+}
+BOOLEAN_OPERATORS = {ast.And: np.frompyfunc(sql_and, 2, 1), ast.Or: np.frompyfunc(sql_or, 2, 1)}
+UNARY_OPERATORS = {
+    ast.USub: np.frompyfunc(lambda value: None if value is None else -value, 1, 1),
+    ast.UAdd: np.frompyfunc(lambda value: value, 1, 1),
+    ast.Not: np.frompyfunc(lambda value: None if value is None else not value, 1, 1)
+}
+REDUCERS = {"sum": np.add, "min": np.minimum, "max": np.maximum}
+
+def object_array(values) -> np.ndarray:
+    array = np.empty(len(values), dtype=object)
+    array[:] = list(values)
+    return array
+
+# Picks the ResultSet kind for a computed column from its first non-null value
+def infer_kind(values, fallback: str) -> str:
+    value = next((value for value in values if value is not None), None)
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, Decimal):
+        return "decimal"
+    if isinstance(value, datetime.date):
+        return "date"
+    if isinstance(value, str):
+        return "text"
+    return fallback
+
+# Combines one partial column by group code with a NumPy ufunc; groups that only saw nulls stay None
+def reduce_groups(reducer: np.ufunc, codes: np.ndarray, column, groups: int) -> np.ndarray:
+    values = column if isinstance(column, np.ndarray) else object_array(column)
+    if values.dtype == object:
+        present = np.fromiter((value is not None for value in values), dtype=np.bool_, count=len(values))
+        codes, values = codes[present], values[present]
+
+    # Seed each group with its first value, then fold in the rest
+    seen, firsts = np.unique(codes, return_index=True)
+    reduced = np.empty(groups, dtype=values.dtype)
+    reduced[seen] = values[firsts]
+    rest = np.ones(len(codes), dtype=np.bool_)
+    rest[firsts] = False
+    reducer.at(reduced, codes[rest], values[rest])
+
+    result = reduced.astype(object)
+    missing = np.ones(groups, dtype=np.bool_)
+    missing[seen] = False
+    result[missing] = None
+    return result
+
+# Stable multi-key sort matching Postgres defaults (NULLS LAST ascending, NULLS FIRST descending)
+def order_positions(result: ResultSet, order_by: list[OrderKey]) -> list[int]:
+    positions = list(range(len(result)))
+    for key in reversed(order_by):
+        column = as_list(result.data[key.column])
+        nulls_low = key.nulls_first != key.descending
+        positions.sort(key=lambda pos: ((column[pos] is None) != nulls_low, column[pos]), reverse=key.descending)
+    return positions
+
+# Locates the aggregate calls in a select/having expression as (start, end, Aggregate)
+def find_aggregates(text: str) -> list[tuple[int, int, Aggregate]]:
+    calls, pos = [], 0
+    while (match := AGGREGATE_CALL.search(text, pos)) is not None:
+        depth, end = 0, match.end() - 1
+        for end in range(match.end() - 1, len(text)):
+            depth += (text[end] == '(') - (text[end] == ')')
+            if depth == 0:
+                break
+        if depth != 0:
+            raise DecompositionError(f"Unbalanced parentheses in {text!r}")
+
+        argument = text[match.end():end].strip()
+        if AGGREGATE_CALL.search(argument) or re.search(r'\bselect\b', argument, re.I):
+            raise DecompositionError(f"Nested aggregate or subquery in {text!r}")
+
+        distinct = re.match(r'distinct\s+(.*)$', argument, re.S | re.I)
+        argument = distinct.group(1).strip() if distinct else argument
+        calls.append((match.start(), end + 1, Aggregate(match.group(1).lower(), argument, distinct is not None)))
+        pos = end + 1
+    return calls
+
+# Outermost parenthesised SELECTs in text (derived tables and IN/EXISTS/scalar subqueries)
+def find_subqueries(text: str) -> list[str]:
+    spans, opened = [], []
+    for pos, char in enumerate(text):
+        if char == '(':
+            opened.append(pos)
+        elif char == ')' and opened:
+            start = opened.pop()
+            if re.match(r'\s*select\b', text[start + 1:pos], re.I):
+                spans = [span for span in spans if span[0] < start] + [(start + 1, pos)]
+    return [text[start:end] for start, end in spans]
+
+# The tables whose names appear in text
+def referenced_tables(text: str, tables) -> list[str]:
+    return [table for table in tables if re.search(rf'\b{re.escape(table)}\b', text, re.I)]
+
+def output_name(expression: str, alias: str) -> str:
+    if alias:
+        return alias.lower()
+    if (match := COLUMN_REFERENCE.match(expression.strip())) is not None:
+        return match.group(1).lower()
+    if (match := FUNCTION_CALL.match(expression.strip())) is not None:
+        return match.group(1).lower()
+    return "?column?"
+
+def split_alias(item: str) -> tuple[str, str]:
+    match = ALIAS.match(item.strip())
+    if match and match.group(1).count('(') == match.group(1).count(')'):
+        return match.group(1).strip(), match.group(2)
+    return item.strip(), None
+
+def evaluate(node: ast.AST, env: dict, groups: int):
+    if isinstance(node, ast.Expression):
+        value = evaluate(node.body, env, groups)
+        return value if isinstance(value, np.ndarray) else object_array([value] * groups)
+    if isinstance(node, ast.Name):
+        return env[node.id]
+    if isinstance(node, ast.BinOp):
+        return BINARY_OPERATORS[type(node.op)](evaluate(node.left, env, groups), evaluate(node.right, env, groups))
+    if isinstance(node, ast.UnaryOp):
+        return UNARY_OPERATORS[type(node.op)](evaluate(node.operand, env, groups))
+    if isinstance(node, ast.Compare):
+        return COMPARISONS[type(node.ops[0])](evaluate(node.left, env, groups), evaluate(node.comparators[0], env, groups))
+    if isinstance(node, ast.BoolOp):
+        value = evaluate(node.values[0], env, groups)
+        for operand in node.values[1:]:
+            value = BOOLEAN_OPERATORS[type(node.op)](value, evaluate(operand, env, groups))
+        return value
+    raise DecompositionError(f"Unsupported expression node {type(node).__name__}")
+
+def validate(node: ast.AST) -> None:
+    allowed = (ast.Expression, ast.Name, ast.Load, ast.BinOp, ast.UnaryOp, ast.Compare, ast.BoolOp) + \
+              tuple(BINARY_OPERATORS) + tuple(COMPARISONS) + tuple(BOOLEAN_OPERATORS) + tuple(UNARY_OPERATORS)
+    for child in ast.walk(node):
+        if not isinstance(child, allowed) or isinstance(child, ast.Compare) and len(child.ops) != 1:
+            raise DecompositionError(f"Unsupported expression node {type(child).__name__}")
+
+class DecomposedQuery:
+    def __init__(self, query: str, worker_query: str = None, strategy: MergeStrategy = MergeStrategy.CONCAT, reason: str = None) -> None:
+        self.query = query
+        self.worker_query = worker_query if worker_query is not None else query
+        self.strategy = strategy
+        self.reason = reason
+        self.output_names = []
+        self.outputs = []           # (kind, value): ("group", index) | ("expression", ast.Expression)
+        self.group_keys = []        # worker-side group expressions, shipped as g0..gN
+        self.aggregates = []        # distinct Aggregate calls, each with its placeholder
+        self.distinct_key = None    # the COUNT(DISTINCT ...) argument, shipped as d0
+        self.having = None
+        self.order_by = []
+        self.limit = None
+        self.distinct = False
+        self.constants = {}
+
+    def __repr__(self) -> str:
+        return (f"DecomposedQuery(strategy={self.strategy}, "
+                f"group_keys={self.group_keys}, "
+                f"aggregates={self.aggregates}, "
+                f"distinct_key={self.distinct_key!r}, "
+                f"order_by={self.order_by}, "
+                f"limit={self.limit}, "
+                f"reason={self.reason!r})")
+
+    def merge(self, results: list[ResultSet]) -> ResultSet:
+        if self.strategy == MergeStrategy.AGGREGATE:
+            return self.merge_aggregates(results)
+
+        merged = ResultSet.concat(results)
+        if self.strategy == MergeStrategy.CONCAT:
+            return merged
+
+        if self.distinct:
+            firsts = {}
+            for pos, row in enumerate(merged.rows()):
+                firsts.setdefault(row, pos)
+            merged = merged.take(sorted(firsts.values()))
+
+        order_by = [key._replace(column=key.column if isinstance(key.column, int) else merged.columns.index(key.column)) for key in self.order_by]
+        positions = order_positions(merged, order_by) if order_by else list(range(len(merged)))
+        return merged.take(positions[:self.limit])
+
+    # Folds partial results into one partial with the same columns (what a leader of an aggregation
+    # tree sends up); the final merge (AVG, HAVING, ORDER BY, LIMIT) still runs on the aggregator
+    def combine(self, results: list[ResultSet]) -> ResultSet:
+        if self.strategy != MergeStrategy.AGGREGATE:
+            return self.merge(results)
+
+        partial = ResultSet.concat(results)
+        if not len(partial):
+            return partial
+
+        # Group (and distinct) keys identify a partial row; every other column is an aggregate partial
+        keys = [as_list(column) for name, column in zip(partial.columns, partial.data) if name[0] == "g" or name == "d0"]
+        if keys:
+            index = {}
+            codes = np.fromiter((index.setdefault(key, len(index)) for key in zip(*keys)), dtype=np.int64, count=len(partial))
+            groups = len(index)
+        else:
+            codes, groups = np.zeros(len(partial), dtype=np.int64), 1
+        firsts = np.unique(codes, return_index=True)[1]
+
+        data = []
+        for name, kind, column in zip(partial.columns, partial.types, partial.data):
+            if name[0] == "g" or name == "d0":
+                values = object_array(as_list(column))[firsts]
+            else:
+                function = self.aggregates[int(re.match(r'a(\d+)', name).group(1))].function
+                values = reduce_groups(REDUCERS.get(function, np.add), codes, column, groups)
+            data.append(pack_column(kind, values.tolist()))
+        return ResultSet(list(partial.columns), list(partial.types), data)
+
+    def merge_aggregates(self, results: list[ResultSet]) -> ResultSet:
+        partial = ResultSet.concat(results)
+        if not partial.columns:
+            return ResultSet(list(self.output_names), ["other"] * len(self.output_names), [[] for _ in self.output_names])
+
+        # Factorize the group key columns into dense codes (in first-seen order)
+        keys = [as_list(partial.column(f"g{pos}")) for pos in range(len(self.group_keys))]
+        if keys:
+            index = {}
+            codes = np.fromiter((index.setdefault(key, len(index)) for key in zip(*keys)), dtype=np.int64, count=len(partial))
+            groups = len(index)
+        else:
+            # A global aggregate always produces exactly one row
+            codes, groups = np.zeros(len(partial), dtype=np.int64), 1
+
+        env = dict(self.constants)
+        firsts = np.unique(codes, return_index=True)[1]
+        for pos, column in enumerate(keys):
+            env[f"__g{pos}"] = object_array(column)[firsts]
+
+        for pos, aggregate in enumerate(self.aggregates):
+            env[f"__a{pos}"] = self.final_aggregate(pos, aggregate, partial, codes, groups)
+
+        keep = np.ones(groups, dtype=np.bool_)
+        if self.having is not None:
+            keep = np.array([value is True for value in evaluate(self.having, env, groups)], dtype=np.bool_)
+
+        types, data = [], []
+        for kind, value in self.outputs:
+            if kind == "group":
+                values = env[f"__g{value}"][keep].tolist()
+                types.append(partial.types[partial.columns.index(f"g{value}")])
+            else:
+                values = evaluate(value, env, groups)[keep].tolist()
+                types.append(infer_kind(values, "decimal"))
+            data.append(pack_column(types[-1], values))
+
+        merged = ResultSet(list(self.output_names), types, data)
+        positions = order_positions(merged, self.order_by) if self.order_by else list(range(len(merged)))
+        return merged.take(positions[:self.limit])
+
+    def final_aggregate(self, pos: int, aggregate: Aggregate, partial: ResultSet, codes: np.ndarray, groups: int) -> np.ndarray:
+        if aggregate.distinct:
+            pairs = {(code, value) for code, value in zip(codes.tolist(), as_list(partial.column("d0"))) if value is not None}
+            counted = np.fromiter((code for code, _ in pairs), dtype=np.int64, count=len(pairs))
+            return object_array(np.bincount(counted, minlength=groups).tolist())
+
+        if aggregate.function == "avg":
+            total = reduce_groups(np.add, codes, partial.column(f"a{pos}_sum"), groups)
+            count = reduce_groups(np.add, codes, partial.column(f"a{pos}_count"), groups)
+            return object_array([None if not rows or value is None else sql_divide(Decimal(value) if isinstance(value, int) else value, rows)
+                                 for value, rows in zip(total.tolist(), count.tolist())])
+
+        reduced = reduce_groups(REDUCERS["sum" if aggregate.function == "count" else aggregate.function], codes, partial.column(f"a{pos}"), groups)
+        if aggregate.function == "count":
+            reduced[np.equal(reduced, None)] = 0
+        return reduced
+
+    def compile_expression(self, text: str, group_names: dict[str, str]) -> ast.Expression:
+        # Swap every aggregate call for its placeholder, registering the partials it needs
+        residual, pos = [], 0
+        for start, end, aggregate in find_aggregates(text):
+            if aggregate.distinct:
+                if aggregate.function != "count":
+                    raise DecompositionError(f"{aggregate.function.upper()}(DISTINCT ...) is not decomposed")
+                if self.distinct_key is not None and normalize(self.distinct_key) != normalize(aggregate.argument):
+                    raise DecompositionError("Only one COUNT(DISTINCT ...) argument is decomposed")
+                self.distinct_key = aggregate.argument
+
+            key = Aggregate(aggregate.function, normalize(aggregate.argument), aggregate.distinct)
+            known = [Aggregate(a.function, normalize(a.argument), a.distinct) for a in self.aggregates]
+            if key not in known:
+                self.aggregates.append(aggregate)
+                known.append(key)
+            residual.append(text[pos:start])
+            residual.append(f" __a{known.index(key)} ")
+            pos = end
+        residual.append(text[pos:])
+
+        # Translate the remaining SQL scalar expression into a (validated) Python expression
+        python, source, pos = [], ''.join(residual), 0
+        while pos < len(source):
+            match = EXPRESSION_TOKEN.match(source, pos)
+            if match is None:
+                raise DecompositionError(f"Unsupported syntax in {text!r}")
+            token, pos = match.group(0), match.end()
+            lowered = token.lower()
+
+            if token.isspace():
+                python.append(' ')
+            elif token[0] == "'" or token[0].isdigit() or token[0] == '.':
+                name = f"__c{len(self.constants)}"
+                self.constants[name] = token[1:-1].replace("''", "'") if token[0] == "'" else Decimal(token) if '.' in token else int(token)
+                python.append(name)
+            elif lowered in ("and", "or", "not"):
+                python.append(f" {lowered} ")
+            elif re.match(r'__a\d+$', token):
+                python.append(token)
+            elif token[0].isalpha() or token[0] == '_':
+                name = group_names.get(lowered) or group_names.get(lowered.split('.')[-1])
+                if name is None:
+                    raise DecompositionError(f"{token!r} is neither a group key nor an aggregate")
+                python.append(name)
+            else:
+                python.append(SQL_OPERATORS[token])
+
+        try:
+            tree = ast.parse(''.join(python).strip(), mode='eval')
+        except SyntaxError:
+            raise DecompositionError(f"Unsupported syntax in {text!r}")
+        validate(tree)
+        return tree
+
+    # Worker-side select list: group keys (and the distinct key) first, then each aggregate's partials
+    def partial_columns(self) -> list[str]:
+        columns = [f"{expression} as g{pos}" for pos, expression in enumerate(self.group_keys)]
+        if self.distinct_key is not None:
+            columns.append(f"{self.distinct_key} as d0")
+        for pos, aggregate in enumerate(self.aggregates):
+            if aggregate.distinct:
+                continue
+            if aggregate.function == "avg":
+                columns.append(f"sum({aggregate.argument}) as a{pos}_sum")
+                columns.append(f"count({aggregate.argument}) as a{pos}_count")
+            else:
+                columns.append(f"{aggregate.function}({aggregate.argument}) as a{pos}")
+        return columns
+
+"""
+Splits a query into what every worker runs and how the aggregator merges the answers
+------------------------------------------------------------------------------------------
+AGGREGATE: SUM/COUNT/MIN/MAX ship as partials, AVG ships as SUM + COUNT, and one
+           COUNT(DISTINCT x) argument is added to the worker's GROUP BY so the merge can
+           count distinct (group, x) keys. HAVING, ORDER BY and LIMIT run after the merge.
+ROWS:      non-aggregate queries run unchanged (including per-worker ORDER BY/LIMIT),
+           the aggregator re-sorts and re-limits the union.
+CONCAT:    anything else (set operations, window functions, OFFSET, CTEs, views, derived
+           tables that aggregate, subqueries over a partitioned table...)
+@partitioned: tables split across the workers, which no subquery may read (one worker only
+holds part of what the subquery would compute over)
+------------------------------------------------------------------------------------------
+"""
+def decompose_query(query: str, partitioned: list[str] = None) -> DecomposedQuery:
+    try:
+        return build_decomposition(query, partitioned)
+    except DecompositionError as e:
+        return DecomposedQuery(query, reason=str(e))
+
+def build_decomposition(query: str, partitioned: list[str] = None) -> DecomposedQuery:
+    statements = [statement for statement in sqlparse.parse(query) if str(statement).strip()]
+    if len(statements) != 1 or statements[0].get_type() != "SELECT":
+        raise DecompositionError("Only single SELECT statements are decomposed")
+
+    clauses, current = collections.defaultdict(list), None
+    for token in statements[0].tokens:
+        if token.is_whitespace or token.ttype in sqlparse.tokens.Comment or isinstance(token, sqlparse.sql.Comment):
+            if current is not None:
+                clauses[current].append(token)
+            continue
+        if token.ttype in sqlparse.tokens.Punctuation and token.value == ';':
+            continue
+        if token.is_keyword and token.normalized in UNSUPPORTED or token.ttype in sqlparse.tokens.CTE:
+            raise DecompositionError(f"Unsupported clause {token.normalized}")
+        if isinstance(token, sqlparse.sql.Where):
+            clauses["FROM"].append(token)
+            continue
+        if token.is_keyword and token.normalized in CLAUSES and not (token.normalized == "DISTINCT" and current != "SELECT"):
+            if token.normalized == "DISTINCT":
+                clauses["DISTINCT"].append(token)
+                continue
+            current = token.normalized
+            clauses[current].append(token)
+            continue
+        if current is None:
+            raise DecompositionError(f"Unexpected token {token.value!r}")
+        clauses[current].append(token)
+
+    text = {clause: ''.join(str(token) for token in tokens[1:]) for clause, tokens in clauses.items()}
+    if re.search(r'\bover\s*\(', text.get("SELECT", ""), re.I):
+        raise DecompositionError("Window functions are not decomposed")
+
+    # Per-worker groups or aggregates of a derived table are not the groups of the whole table (a plain
+    # derived table splits like the join it stands for)
+    from_list = ''.join(str(token) for token in clauses["FROM"][1:] if not isinstance(token, sqlparse.sql.Where))
+    derived = find_subqueries(from_list)
+    for subquery in derived:
+        if AGGREGATE_CALL.search(subquery) or re.search(r'\b(group\s+by|having|distinct)\b', subquery, re.I):
+            raise DecompositionError("Derived tables that aggregate are not decomposed")
+    # Any other subquery would only see the worker's part of a partitioned table
+    nested = [subquery for subquery in find_subqueries(str(statements[0])) if subquery not in derived]
+    for subquery in nested + [inner for subquery in derived for inner in find_subqueries(subquery)]:
+        if read := referenced_tables(subquery, partitioned or []):
+            raise DecompositionError(f"Subqueries over partitioned tables ({', '.join(read)}) are not decomposed")
+
+    plan = DecomposedQuery(query)
+    plan.distinct = "DISTINCT" in clauses
+    items = [split_alias(item) for item in split_top_level(text["SELECT"], ',')]
+    plan.output_names = [output_name(expression, alias) for expression, alias in items]
+
+    if "LIMIT" in clauses:
+        limit = text["LIMIT"].strip()
+        if not limit.isdigit() and limit.lower() != "all":
+            raise DecompositionError(f"Unsupported LIMIT {limit!r}")
+        plan.limit = int(limit) if limit.isdigit() else None
+
+    aggregated = "GROUP BY" in clauses or "HAVING" in clauses or any(find_aggregates(expression) for expression, _ in items)
+    if not aggregated:
+        # Every worker can already sort and cut its own rows
+        plan.strategy = MergeStrategy.ROWS
+        plan.order_by = order_keys(text.get("ORDER BY", ""), items, plan.output_names, allow_names=True)
+        return plan
+
+    if plan.distinct:
+        raise DecompositionError("SELECT DISTINCT with aggregates is not decomposed")
+    if any(re.search(r'\bselect\b', expression, re.I) for expression, _ in items) or re.search(r'\bselect\b', text.get("HAVING", ""), re.I):
+        raise DecompositionError("Subqueries in the select list or HAVING are not decomposed")
+
+    # Group keys are referenced by their expression or (Postgres extension) by an output alias
+    aliases = {alias.lower(): expression for expression, alias in items if alias}
+    group_names = {}
+    for pos, group in enumerate(split_top_level(text.get("GROUP BY", ""), ',')):
+        group = group.strip()
+        if group.isdigit():
+            group = items[int(group) - 1][0]
+        expression = aliases.get(group.lower(), group)
+        plan.group_keys.append(expression)
+        for name in {normalize(group), normalize(expression)}:
+            group_names[name] = f"__g{pos}"
+            if (match := COLUMN_REFERENCE.match(name)) is not None:
+                group_names.setdefault(match.group(1), f"__g{pos}")
+
+    for expression, alias in items:
+        group = group_names.get(normalize(expression)) or (group_names.get(alias.lower()) if alias else None)
+        if group is not None:
+            plan.outputs.append(("group", int(group[3:])))
+        else:
+            plan.outputs.append(("expression", plan.compile_expression(expression, group_names)))
+
+    if "HAVING" in clauses:
+        plan.having = plan.compile_expression(text["HAVING"], group_names)
+
+    plan.order_by = order_keys(text.get("ORDER BY", ""), items, plan.output_names, allow_names=False)
+    plan.strategy = MergeStrategy.AGGREGATE
+
+    from_clause = ''.join(str(token) for token in clauses["FROM"])
+    worker_query = f"select\n\t" + ",\n\t".join(plan.partial_columns()) + f"\n{from_clause.strip().rstrip(';').rstrip()}"
+    positions = len(plan.group_keys) + (plan.distinct_key is not None)
+    if positions:
+        worker_query += "\ngroup by\n\t" + ", ".join(str(pos) for pos in range(1, positions + 1))
+    plan.worker_query = worker_query + ";"
+    return plan
+
+def order_keys(text: str, items: list[tuple[str, str]], names: list[str], allow_names: bool) -> list[OrderKey]:
+    keys = []
+    expressions = [normalize(expression) for expression, _ in items]
+    for item in split_top_level(text, ','):
+        match = ORDER_ITEM.match(item.strip())
+        expression, direction, nulls = match.group(1).strip(), (match.group(2) or "asc").lower(), match.group(3)
+        descending = direction == "desc"
+        nulls_first = descending if nulls is None else nulls.lower() == "first"
+
+        if expression.isdigit():
+            column = int(expression) - 1
+        elif expression.lower() in names:
+            column = names.index(expression.lower())
+        elif normalize(expression) in expressions:
+            column = expressions.index(normalize(expression))
+        elif allow_names and COLUMN_REFERENCE.match(expression):
+            # Resolved against the worker result columns at merge time (e.g. SELECT *)
+            column = COLUMN_REFERENCE.match(expression).group(1).lower()
+        else:
+            raise DecompositionError(f"ORDER BY {expression!r} is not an output column")
+        keys.append(OrderKey(column, descending, nulls_first))
+    return keys
@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import collections
+import shutil
+import subprocess
+import tempfile
+import time
+import os
+
+DBGEN_DIRECTORY = "TPC-H/dbgen"
+
+# One dbgen run: the -T flag it generates and its -S step (None when run whole)
+GenerationJob = collections.namedtuple("GenerationJob", ["group", "step"])
+
+# dbgen -T flag of every table
+TABLE_FLAGS = {"customer": "c", "lineitem": "L", "nation": "n", "orders": "O", "part": "P", "partsupp": "S", "region": "r", "supplier": "s"}
+# Flags that generate two tables in one pass (orders/lineitem and part/partsupp share their generators)
+PAIRED_FLAGS = {"o": ["orders", "lineitem"], "p": ["part", "partsupp"], "l": ["nation", "region"]}
+# nation and region do not scale, so they are generated once, whole (and never per worker)
+FIXED_FLAGS = ("l", "n", "r")
+FIXED_TABLES = ("nation", "region")
+
+def job_name(job: GenerationJob) -> str:
+    return job.group if job.step is None else f"{job.group}.{job.step}"
+
+def generation_parallelism(value: int) -> int:
+    return value if value > 0 else (os.cpu_count() or 1)
+
+# make -q exits 0 when every target is up to date, so an unchanged dbgen is not rebuilt
+def dbgen_up_to_date(directory: str) -> bool:
+    if not os.path.exists(f"{directory}/dbgen"):
+        return False
+    return subprocess.run([f"cd {directory} && make -q"], shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+# Returns whether dbgen had to be compiled
+def build_dbgen(directory: str) -> bool:
+    if dbgen_up_to_date(directory):
+        return False
+    subprocess.run([f"cd {directory} && make"], check=True, shell=True)
+    return True
+
+# Fewest dbgen flags that generate exactly tables
+def table_flags(tables: list[str]) -> list[str]:
+    remaining, flags = set(tables), []
+    for flag, pair in PAIRED_FLAGS.items():
+        if set(pair) <= remaining:
+            flags.append(flag)
+            remaining -= set(pair)
+    return flags + [TABLE_FLAGS[table] for table in sorted(remaining)]
+
+def generation_jobs(chunks: int, tables: list[str] = TABLE_FLAGS) -> list[GenerationJob]:
+    jobs = []
+    for flag in table_flags(tables):
+        if flag in FIXED_FLAGS or chunks == 1:
+            jobs.append(GenerationJob(flag, None))
+        else:
+            jobs.extend(GenerationJob(flag, step) for step in range(1, chunks + 1))
+    return jobs
+
+def run_dbgen(directory: str, output: str, scale_factor: float, chunks: int, job: GenerationJob) -> None:
+    chunking = f" -C {chunks} -S {job.step}" if job.step is not None else ""
+    subprocess.run([f"cd {directory} && DSS_PATH={output} ./dbgen -f -q -s {scale_factor}{chunking} -T {job.group}"],
+                   check=True, shell=True, stdout=subprocess.DEVNULL)
+
+# Chunks concatenated in step order are byte-identical to a single dbgen run
+def assemble_table(output: str, table: str, chunks: int, destination: str) -> None:
+    if chunks == 1:
+        os.replace(f"{output}/{table}.tbl", destination)
+        return
+    with open(destination, 'wb') as target:
+        for step in range(1, chunks + 1):
+            path = f"{output}/{table}.tbl.{step}"
+            # Tiny scale factors can leave a chunk without rows
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as chunk:
+                shutil.copyfileobj(chunk, target)
+            os.remove(path)
+
+"""
+Generates every TPC-H table with dbgen, chunked across processes
+------------------------------------------------------------------------------------------
+@directory: compiled dbgen (and its dists.dss)
+@destination: where the <table>.tbl files end up (the shared volume)
+@scale_factor: dbgen -s
+@parallelism: dbgen processes at once, also the number of -C chunks per scaling table
+@progress: optional InitProgress, told about every dbgen run by name (c.1, o.2, ..., l)
+@tables: the tables to generate (every TPC-H table by default)
+Chunks are written next to destination and concatenated in order, so the files match a
+single ./dbgen -s <scale_factor> run byte for byte. Returns the seconds and files written.
+------------------------------------------------------------------------------------------
+"""
+def generate_tables(directory: str, destination: str, scale_factor: float, parallelism: int, progress=None, tables: list[str] = TABLE_FLAGS) -> dict:
+    chunks = max(parallelism, 1)
+    jobs = generation_jobs(chunks, tables)
+    output = tempfile.mkdtemp(prefix=".dbgen-", dir=destination)
+    start_time = time.time()
+
+    # Runs one dbgen job, reporting it to progress
+    def generate(job):
+        if progress is not None:
+            progress.update(job_name(job), "generating")
+        run_dbgen(directory, output, scale_factor, chunks, job)
+        if progress is not None:
+            progress.update(job_name(job), "ready")
+
+    try:
+        with ThreadPoolExecutor(max_workers=chunks) as executor:
+            futures = {executor.submit(generate, job): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    if progress is not None:
+                        progress.update(job_name(futures[future]), "failed", error=str(e))
+                    raise
+
+        files = {}
+        for table in tables:
+            fixed = TABLE_FLAGS[table] in FIXED_FLAGS
+            assemble_table(output, table, 1 if fixed else chunks, f"{destination}/{table}.tbl")
+            files[table] = f"{destination}/{table}.tbl"
+    finally:
+        shutil.rmtree(output, ignore_errors=True)
+
+    return {"scale_factor": scale_factor, "chunks": chunks, "jobs": len(jobs), "seconds": round(time.time() - start_time, 4), "files": files}
+
+def chunk_path(destination: str, table: str, chunks: int, step: int) -> str:
+    return f"{destination}/{table}.tbl" + (f".{step}" if chunks > 1 else "")
+
+# Identifies the rows of one dbgen chunk (dbgen has no seed option, so the settings fix its output)
+def chunk_version(scale_factor: float, chunks: int, step: int) -> str:
+    return f"dbgen:{scale_factor}:{chunks}:{step}"
+
+"""
+Generates one worker's chunk of tables, for workers that generate their own partitions
+------------------------------------------------------------------------------------------
+@destination: a directory on the worker (not the shared volume)
+@chunks, @step: dbgen -C/-S, the worker's chunk of every table (step counts from 1)
+Returns {table: path}; each file is the step-th of chunks contiguous runs of rows dbgen
+splits the full table into, so the chunks of every step together are the whole table.
+------------------------------------------------------------------------------------------
+"""
+def generate_chunk(directory: str, destination: str, scale_factor: float, chunks: int, step: int, tables: list[str]) -> dict[str, str]:
+    os.makedirs(destination, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(len(tables), 1)) as executor:
+        list(executor.map(lambda flag: run_dbgen(directory, destination, scale_factor, chunks, GenerationJob(flag, step if chunks > 1 else None)), table_flags(tables)))
+    return {table: chunk_path(destination, table, chunks, step) for table in tables}
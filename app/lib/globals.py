@@ -7,9 +7,26 @@ Table = collections.namedtuple("Table", ["name", "rows"])
 
 POSTGRESQL_CONFIG_FILE = "/etc/postgresql/15/main/pg_hba.conf"
 DEFAULT_WORKER_NAME = "http://worker_node_"
+QUERY_ID_HEADER = "X-Query-Id"
+LOAD_MANIFEST_TABLE = "load_manifest"
+MANIFEST_FILE = "manifest.json"
+# Added after bulk loads when [LOADING] primary_keys is on (schema.sql itself has no constraints)
+TPCH_PRIMARY_KEYS = {
+    "customer": ["c_custkey"],
+    "lineitem": ["l_orderkey", "l_linenumber"],
+    "nation": ["n_nationkey"],
+    "orders": ["o_orderkey"],
+    "part": ["p_partkey"],
+    "partsupp": ["ps_partkey", "ps_suppkey"],
+    "region": ["r_regionkey"],
+    "supplier": ["s_suppkey"]
+}
 DEFAULT_SMART_PARTITION = ["lineitem"]
 DEFAULT_SMART_NON_PARTITION = ["customer", "nation", "orders", "part", "partsupp", "region", "supplier"]
 DEFAULT_ALL_TABLES = ["customer", "lineitem", "nation", "orders", "part", "partsupp", "region", "supplier"]
+# COPY text format escapes (https://www.postgresql.org/docs/15/sql-copy.html)
+COPY_NULL = "\\N"
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
 LINEITEM_SCHEMA = [
     "L_ORDERKEY", "L_PARTKEY", "L_SUPPKEY", "L_LINENUMBER",
     "L_QUANTITY", "L_EXTENDEDPRICE", "L_DISCOUNT", "L_TAX",
@@ -44,18 +61,26 @@ class InitializationMessage:
             worker_type: int,
             insertion_tables: list[str] = None,
             leader_address: str = None,
-            follower_addresses: list[str] = None
+            follower_addresses: list[str] = None,
+            leader_addresses: list[str] = None,
+            generated_tables: dict[str, int] = None
     ) -> None:
         self.worker_type = worker_type
         self.insertion_tables = insertion_tables if insertion_tables is not None else []
         self.leader_address = leader_address if leader_address is not None else ""
         self.follower_addresses = follower_addresses if follower_addresses is not None else []
+        # Child leaders (aggregation tree) whose merged results this leader merges in
+        self.leader_addresses = leader_addresses if leader_addresses is not None else []
+        # Tables the worker generates itself: {table: its dbgen -S step}
+        self.generated_tables = generated_tables if generated_tables is not None else {}
     
     def __repr__(self):
         return (f"InitializationMessage(insertion_tables={self.insertion_tables}, "
                 f"leader_address='{self.leader_address}', "
                 f"worker_type={self.worker_type}, "
-                f"follower_addresses={self.follower_addresses})")
+                f"follower_addresses={self.follower_addresses}, "
+                f"leader_addresses={self.leader_addresses}, "
+                f"generated_tables={self.generated_tables})")
 
 class Aggregator:
     def __init__(
@@ -71,7 +96,8 @@ class Aggregator:
             leader_ids: list[str] = None,
             leaders: list[str] = None,
             follower_ids: list[str] = None,
-            followers: list[str] = None
+            followers: list[str] = None,
+            table_schemas: dict[str, list[tuple[str, str]]] = None
     ) -> None:
         self.mount_point = mount_point
         self.workers = workers
@@ -85,6 +111,9 @@ class Aggregator:
         self.leaders = leaders if leaders is not None else []
         self.follower_ids = follower_ids if follower_ids is not None else []
         self.followers = followers if followers is not None else []
+        self.table_schemas = table_schemas if table_schemas is not None else {}
+        # Per-query compression stats for transfers received while the query runs
+        self.transfer_stats = collections.defaultdict(list)
 
     def __repr__(self):
         return (
@@ -100,7 +129,8 @@ class Aggregator:
             f"  leader_ids={self.leader_ids!r},\n"
             f"  leaders={self.leaders!r},\n"
             f"  follower_ids={self.follower_ids!r},\n"
-            f"  followers={self.followers!r}\n"
+            f"  followers={self.followers!r},\n"
+            f"  table_schemas={list(self.table_schemas)!r}\n"
             f")"
         )
     
@@ -111,13 +141,15 @@ class Worker:
             worker_type: WorkerType = WorkerType.NOT_SET,
             leader_address: str = None,
             follower_addresses: list[str] = None,
-            partition_tables: list[str] = None
+            partition_tables: list[str] = None,
+            leader_addresses: list[str] = None
     ) -> None:
         self.mount_point = mount_point if mount_point is not None else ""
         self.worker_type = worker_type
         self.leader_address = leader_address if leader_address is not None else ""
         self.follower_addresses = follower_addresses if follower_addresses is not None else []
         self.partition_tables = partition_tables if partition_tables is not None else []
+        self.leader_addresses = leader_addresses if leader_addresses is not None else []
     
 
     def __repr__(self):
@@ -125,7 +157,8 @@ class Worker:
                 f"worker_type={self.worker_type}, "
                 f"leader_address='{self.leader_address}'"
                 f"follower_addresses={self.follower_addresses}"
-                f"partition_tables={self.partition_tables}")
+                f"partition_tables={self.partition_tables}"
+                f"leader_addresses={self.leader_addresses}")
 
 # Dynamically extracts the tables using sqlparse
 def extract_tables(tokenized_sql: sqlparse.sql.Statement, inside_subquery = False) -> list:
@@ -0,0 +1,104 @@
+from .planner import *
+import collections
+import sqlparse
+
+# An index built on column of table for the workload: kinds is the roles the column plays
+# (join, filter, group) and queries the workload queries that reference it that way
+IndexSpec = collections.namedtuple("IndexSpec", ["table", "column", "kinds", "queries"])
+
+INDEX_KINDS = ("join", "filter", "group")
+INDEX_SUFFIX = "_workload_idx"
+
+def index_name(column: str) -> str:
+    return f"{column}{INDEX_SUFFIX}"
+
+def comparisons(token) -> list[sqlparse.sql.Comparison]:
+    found = []
+    for child in getattr(token, 'tokens', []):
+        if isinstance(child, sqlparse.sql.Comparison):
+            found.append(child)
+        found.extend(comparisons(child))
+    return found
+
+def where_clauses(token) -> list[sqlparse.sql.Where]:
+    found = []
+    for child in getattr(token, 'tokens', []):
+        if isinstance(child, sqlparse.sql.Where):
+            found.append(child)
+        found.extend(where_clauses(child))
+    return found
+
+# Names listed right after every GROUP BY keyword, subqueries included
+def group_names(token) -> set[str]:
+    names, children = set(), [child for child in getattr(token, 'tokens', []) if not child.is_whitespace]
+    for position, child in enumerate(children):
+        if child.ttype in sqlparse.tokens.Keyword and child.normalized == 'GROUP BY' and position + 1 < len(children):
+            names |= referenced_names(children[position + 1])
+        names |= group_names(child)
+    return names
+
+"""
+Columns of a query worth indexing, by the role they play
+------------------------------------------------------------------------------------------
+join: both sides of a col = col comparison between two tables (correlated subqueries too)
+filter: every other schema column read by a WHERE clause (ranges, LIKE, IN, BETWEEN, ...)
+group: the GROUP BY keys
+------------------------------------------------------------------------------------------
+"""
+def workload_columns(query: str, schema: dict[str, list[tuple[str, str]]]) -> dict[str, set[str]]:
+    statement = sqlparse.parse(sqlparse.format(query, strip_comments=True))[0]
+    owners = column_owners(schema)
+    roles = collections.defaultdict(set)
+
+    for where in where_clauses(statement):
+        joined = set()
+        for comparison in comparisons(where):
+            left, right = referenced_names(comparison.left), referenced_names(comparison.right)
+            if len(left) == 1 and len(right) == 1 and left <= owners.keys() and right <= owners.keys():
+                (left,), (right,) = left, right
+                if owners[left] != owners[right]:
+                    joined |= {left, right}
+        for column in joined:
+            roles[column].add("join")
+        for column in referenced_names(where) - joined:
+            if column in owners:
+                roles[column].add("filter")
+
+    for column in group_names(statement):
+        if column in owners:
+            roles[column].add("group")
+    return dict(roles)
+
+"""
+Plans single-column indexes for a workload of queries
+------------------------------------------------------------------------------------------
+@workload: {query name: SQL}
+@kinds: roles that earn a column an index (any of join, filter, group)
+@primary_keys: {table: columns}, the leading primary key column is already indexed
+@min_queries: how many workload queries must use a column before it is indexed
+Returns the indexes ordered by table, most used first.
+------------------------------------------------------------------------------------------
+"""
+def plan_indexes(workload: dict[str, str], schema: dict[str, list[tuple[str, str]]], kinds: list[str] = INDEX_KINDS, primary_keys: dict[str, list[str]] = None, min_queries: int = 1) -> list[IndexSpec]:
+    owners = column_owners(schema)
+    covered = {columns[0] for columns in (primary_keys or {}).values() if columns}
+    roles, queries = collections.defaultdict(set), collections.defaultdict(list)
+    for name, query in workload.items():
+        for column, column_roles in workload_columns(query, schema).items():
+            column_roles &= set(kinds)
+            if column_roles and column not in covered:
+                roles[column] |= column_roles
+                queries[column].append(name)
+
+    specs = [IndexSpec(owners[column], column, sorted(roles[column]), sorted(queries[column]))
+             for column in roles if len(queries[column]) >= min_queries]
+    return sorted(specs, key=lambda spec: (spec.table, -len(spec.queries), spec.column))
+
+# Workload queries whose tables are all in tables (the ones a node can time on its own)
+def runnable_queries(workload: dict[str, str], tables: list[str]) -> dict[str, str]:
+    runnable = {}
+    for name, query in workload.items():
+        read = {t['table'].lower() for t in extract_tables(sqlparse.parse(query)[0])}
+        if read and read <= set(tables):
+            runnable[name] = query
+    return runnable
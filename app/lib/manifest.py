@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+import zlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+CHECKSUM_BLOCK_SIZE = 4 * 1024 * 1024
+
+# crc32 of a whole file, read a block at a time (zlib releases the GIL, so files hash in parallel)
+def file_checksum(path: str) -> str:
+    crc = 0
+    with open(path, 'rb') as file:
+        while block := file.read(CHECKSUM_BLOCK_SIZE):
+            crc = zlib.crc32(block, crc)
+    return f"{crc:08x}"
+
+def describe_files(paths: list[str], threads: int = 4) -> dict[str, dict]:
+    paths = sorted(set(paths))
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+        checksums = list(executor.map(file_checksum, paths))
+    return {path: {"size": os.path.getsize(path), "crc32": checksum} for path, checksum in zip(paths, checksums)}
+
+# Whether every recorded file is still on disk unchanged (verify=size skips re-hashing)
+def files_intact(files: dict[str, dict], verify: str = "checksum", threads: int = 4) -> bool:
+    for path, description in files.items():
+        if not os.path.exists(path) or os.path.getsize(path) != description["size"]:
+            return False
+    if verify != "checksum":
+        return True
+    current = describe_files(list(files), threads)
+    return all(current[path]["crc32"] == description["crc32"] for path, description in files.items())
+
+# Short, stable identifier of a set of described files
+def files_version(files: dict[str, dict]) -> str:
+    return f"{zlib.crc32(json.dumps(files, sort_keys=True).encode('utf-8')):08x}"
+
+"""
+Manifest of generated and partitioned data on the shared volume
+------------------------------------------------------------------------------------------
+generation: the settings dbgen ran with (scale factor, dbgen version and seed) and the size
+and crc32 of every .tbl file it produced.
+partitions: one entry per partitioning (keyed by its settings: endpoint, arch, mode, workers,
+tables or sample query, scheme, and the generation version) holding the worker files it wrote
+with their checksums plus the layout needed to rebuild the init messages without splitting.
+Regenerating the data drops every partition entry.
+------------------------------------------------------------------------------------------
+"""
+class Manifest:
+    def __init__(self, path: str, generation: dict = None, partitions: dict = None) -> None:
+        self.path = path
+        self.generation = generation if generation is not None else {}
+        self.partitions = partitions if partitions is not None else {}
+
+    def __repr__(self) -> str:
+        return (f"Manifest(path={self.path!r}, "
+                f"generation={self.generation.get('settings')}, "
+                f"partitions={len(self.partitions)})")
+
+    # A missing, unreadable or older manifest is treated as empty
+    @classmethod
+    def load(cls, path: str) -> "Manifest":
+        try:
+            with open(path, 'r') as file:
+                payload = json.load(file)
+        except (OSError, ValueError):
+            return cls(path)
+        if payload.get("version") != MANIFEST_VERSION:
+            return cls(path)
+        return cls(path, payload.get("generation"), payload.get("partitions"))
+
+    # Written to a temporary file and renamed, so a crash never leaves a half-written manifest
+    def save(self) -> None:
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump({"version": MANIFEST_VERSION, "generation": self.generation, "partitions": self.partitions}, file, indent=2)
+        os.replace(temporary, self.path)
+
+    @property
+    def data_version(self) -> str:
+        return self.generation.get("version", "")
+
+    def generation_matches(self, settings: dict, verify: str = "checksum") -> bool:
+        return bool(self.generation) and self.generation.get("settings") == settings and files_intact(self.generation["files"], verify)
+
+    def record_generation(self, settings: dict, paths: list[str]) -> None:
+        files = describe_files(paths)
+        self.generation = {"settings": settings, "files": files, "version": files_version(files)}
+        self.partitions = {}
+
+    # Adds files generated later under the same settings (the dbgen output, and so the version, is unchanged)
+    def add_generated(self, paths: list[str]) -> None:
+        self.generation.setdefault("files", {}).update(describe_files(paths))
+
+    @staticmethod
+    def partition_key(settings: dict) -> str:
+        return json.dumps(settings, sort_keys=True)
+
+    # The stored layout of a partitioning with these settings whose files are all intact
+    def find_partition(self, settings: dict, verify: str = "checksum"):
+        entry = self.partitions.get(self.partition_key(settings))
+        if entry is None or not files_intact(entry["files"], verify):
+            return None
+        return entry["layout"]
+
+    # Partitionings reuse worker file names, so entries whose files were just overwritten are dropped
+    def record_partition(self, settings: dict, paths: list[str], layout: dict) -> None:
+        files = describe_files(paths)
+        self.partitions = {
+            key: entry for key, entry in self.partitions.items()
+            if all(files.get(path, description) == description for path, description in entry["files"].items())
+        }
+        self.partitions[self.partition_key(settings)] = {"files": files, "layout": layout}
+
+    # crc32 of one recorded file, so loaders can tell whether they already hold its contents
+    def checksum(self, path: str) -> str:
+        for files in [self.generation.get("files", {})] + [entry["files"] for entry in self.partitions.values()]:
+            if path in files:
+                return files[path]["crc32"]
+        return None
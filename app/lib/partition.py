@@ -0,0 +1,369 @@
+from concurrent.futures import Executor, Future
+import numpy as np
+import mmap
+import os
+
+# Newlines are counted a block at a time (C speed) and only walked line by line in the last block
+BLOCK_SIZE = 4 * 1024 * 1024
+
+def count_lines(mm) -> int:
+    lines = 0
+    for start in range(0, len(mm), BLOCK_SIZE):
+        lines += mm[start:start + BLOCK_SIZE].count(b'\n')
+    # A final line without a trailing newline still counts
+    if len(mm) and mm[len(mm) - 1:] != b'\n':
+        lines += 1
+    return lines
+
+# Byte offsets just past the n-th line (counted from start) for each ascending line number in targets
+def line_offsets(mm, targets: list[int], start: int = 0) -> list[int]:
+    offsets, seen, pos = [], 0, start
+    for target in targets:
+        while seen < target and pos < len(mm):
+            block = mm[pos:pos + BLOCK_SIZE]
+            count = block.count(b'\n')
+            if seen + count < target:
+                seen += count
+                pos += len(block)
+                continue
+            while seen < target:
+                pos = mm.find(b'\n', pos) + 1
+                seen += 1
+        offsets.append(min(pos, len(mm)) if seen >= target else len(mm))
+    return offsets
+
+# Line-exact [start, end) byte ranges: lines // parts lines each, the remainder going to the last part
+def split_ranges(path: str, parts: int) -> list[tuple[int, int]]:
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return [(0, 0) for _ in range(parts)]
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            total_lines = count_lines(mm)
+            lines_per_part = total_lines // parts
+            boundaries = line_offsets(mm, [lines_per_part * part for part in range(1, parts)])
+            size = len(mm)
+
+    starts = [0] + boundaries
+    return list(zip(starts, boundaries + [size]))
+
+# Copies a byte range between files in the kernel when possible (copy_file_range, then sendfile)
+def copy_range(source_fd: int, destination_fd: int, offset: int, length: int, destination_offset: int = None) -> None:
+    # Both kernel copies write at (and advance) the destination's file position
+    if destination_offset is not None:
+        os.lseek(destination_fd, destination_offset, os.SEEK_SET)
+    remaining = length
+    if hasattr(os, "copy_file_range"):
+        try:
+            while remaining:
+                copied = os.copy_file_range(source_fd, destination_fd, remaining, offset_src=offset)
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+        except OSError:
+            pass
+
+    if remaining and hasattr(os, "sendfile"):
+        try:
+            while remaining:
+                sent = os.sendfile(destination_fd, source_fd, offset, remaining)
+                if sent == 0:
+                    break
+                offset += sent
+                remaining -= sent
+        except OSError:
+            pass
+
+    # Plain buffered copy as a last resort
+    while remaining:
+        chunk = os.pread(source_fd, min(remaining, BLOCK_SIZE), offset)
+        if not chunk:
+            raise IOError(f"Unexpected end of file copying {length} bytes")
+        os.write(destination_fd, chunk)
+        offset += len(chunk)
+        remaining -= len(chunk)
+
+def copy_file_range_to(source: str, destination: str, start: int, end: int) -> None:
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        copy_range(src.fileno(), dst.fileno(), start, end - start)
+
+"""
+Splits a .tbl file into one file per node without decoding it
+------------------------------------------------------------------------------------------
+@path: source .tbl file
+@destinations: one output path per node, in partition order
+------------------------------------------------------------------------------------------
+"""
+def split_file(path: str, destinations: list[str]) -> list[tuple[int, int]]:
+    ranges = split_ranges(path, len(destinations))
+    for destination, (start, end) in zip(destinations, ranges):
+        copy_file_range_to(path, destination, start, end)
+    return ranges
+
+# Everything below runs in ProcessPoolExecutor workers, so it only takes picklable arguments
+
+# Newline-aligned [start, end) chunks of roughly chunk_size bytes
+def chunk_ranges(path: str, chunk_size: int) -> list[tuple[int, int]]:
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+
+    starts = [0]
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        while starts[-1] + chunk_size < size:
+            pos = mm.find(b'\n', starts[-1] + chunk_size)
+            if pos == -1 or pos + 1 >= size:
+                break
+            starts.append(pos + 1)
+    return list(zip(starts, starts[1:] + [size]))
+
+def count_range(path: str, start: int, end: int) -> int:
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return sum(mm[pos:min(pos + BLOCK_SIZE, end)].count(b'\n') for pos in range(start, end, BLOCK_SIZE))
+
+def find_line(path: str, start: int, lines: int) -> int:
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return line_offsets(mm, [lines], start)[0]
+
+def copy_piece(source: str, destination: str, start: int, length: int, destination_offset: int) -> None:
+    with open(source, 'rb') as src, open(destination, 'r+b') as dst:
+        copy_range(src.fileno(), dst.fileno(), start, length, destination_offset)
+
+"""
+Parallel equivalent of split_file for many tables at once
+------------------------------------------------------------------------------------------
+@jobs: {source .tbl path: [one output path per node]}
+Newlines are counted per chunk across the pool, the line-exact node boundaries are located
+inside the chunks that hold them, then every node range is copied in chunk-sized pieces.
+Produces byte-identical files to split_file.
+------------------------------------------------------------------------------------------
+"""
+def split_files(jobs: dict[str, list[str]], executor: Executor, chunk_size: int) -> dict[str, list[tuple[int, int]]]:
+    chunks = {path: chunk_ranges(path, chunk_size) for path in jobs}
+    counts = {path: [executor.submit(count_range, path, start, end) for start, end in chunks[path]] for path in jobs}
+
+    boundaries = {}
+    for path, destinations in jobs.items():
+        if not chunks[path]:
+            boundaries[path] = []
+            continue
+        newlines = [future.result() for future in counts[path]]
+        size = chunks[path][-1][1]
+        total_lines = sum(newlines)
+        if size:
+            with open(path, 'rb') as file:
+                file.seek(size - 1)
+                total_lines += file.read(1) != b'\n'
+
+        # Locate the chunk holding each boundary line and find it within that chunk
+        lines_per_part = total_lines // len(destinations)
+        cumulative = np.cumsum([0] + newlines)
+        boundaries[path] = []
+        for target in (lines_per_part * part for part in range(1, len(destinations))):
+            chunk = min(max(int(np.searchsorted(cumulative, target, side='left')) - 1, 0), len(chunks[path]) - 1)
+            boundaries[path].append(executor.submit(find_line, path, chunks[path][chunk][0], target - int(cumulative[chunk])))
+
+    ranges, copies = {}, []
+    for path, destinations in jobs.items():
+        size = chunks[path][-1][1] if chunks[path] else 0
+        offsets = [future.result() for future in boundaries[path]] if chunks[path] else [0] * (len(destinations) - 1)
+        ranges[path] = list(zip([0] + offsets, offsets + [size]))
+        for destination, (start, end) in zip(destinations, ranges[path]):
+            open(destination, 'wb').close()
+            for piece in range(start, end, chunk_size):
+                copies.append(executor.submit(copy_piece, path, destination, piece, min(chunk_size, end - piece), piece - start))
+
+    for future in copies:
+        future.result()
+    return ranges
+
+# Node for every key: ("modulo", nodes) | ("divide", width, nodes) | ("range", boundaries) | ("lookup", array)
+def route_keys(keys: np.ndarray, route: tuple) -> np.ndarray:
+    kind = route[0]
+    if kind == "modulo":
+        return keys % route[1]
+    if kind == "divide":
+        return (keys // route[1]) % route[2]
+    if kind == "range":
+        return np.searchsorted(route[1], keys, side='right')
+    if kind == "lookup":
+        return route[1][keys]
+    raise ValueError(f"Unknown route {kind}")
+
+# Node bitmask for every key; ("follow", values, masks, nodes) sends a key to every node its
+# (sorted) value was sent to by another table, and unknown keys to key % nodes
+def route_masks(keys: np.ndarray, route: tuple) -> np.ndarray:
+    if route[0] != "follow":
+        return np.left_shift(np.uint64(1), route_keys(keys, route).astype(np.uint64))
+
+    _, values, masks, nodes = route
+    fallback = np.left_shift(np.uint64(1), (keys % nodes).astype(np.uint64))
+    if len(values) == 0:
+        return fallback
+    positions = np.minimum(np.searchsorted(values, keys), len(values) - 1)
+    return np.where(values[positions] == keys, masks[positions], fallback)
+
+# Keeps only the lowest node of each group in every mask, so a consumer that unions a group's
+# partitions (a leader its followers, the aggregator every worker in LOCAL mode) gets each row once
+def dedupe_masks(masks: np.ndarray, groups: list[list[int]]) -> np.ndarray:
+    result = np.zeros_like(masks)
+    for group in groups:
+        selected = masks & np.uint64(sum(1 << node for node in group))
+        result |= selected & (~selected + np.uint64(1))
+    return result
+
+# ORs the node masks of every distinct value (per-chunk and cross-chunk export reduction)
+def combine_masks(values: np.ndarray, masks: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    unique, inverse = np.unique(values, return_inverse=True)
+    combined = np.zeros(len(unique), dtype=np.uint64)
+    np.bitwise_or.at(combined, inverse, masks)
+    return unique, combined
+
+NEWLINE, DELIMITER, ZERO = ord('\n'), ord('|'), ord('0')
+
+# [start, end) offsets of every line in a chunk (the last line may lack its newline)
+def line_bounds(buffer: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    ends = np.flatnonzero(buffer == NEWLINE) + 1
+    if len(buffer) and (len(ends) == 0 or ends[-1] != len(buffer)):
+        ends = np.append(ends, len(buffer))
+    starts = np.zeros(len(ends), dtype=np.int64)
+    starts[1:] = ends[:-1]
+    return starts, ends
+
+# Parses a non-negative integer column straight from the chunk bytes; None when the chunk is not
+# uniform (ragged delimiters, signs, very long numbers) and needs the per-line fallback
+def parse_integers(buffer: np.ndarray, delimiters: np.ndarray, starts: np.ndarray, pos: int):
+    if delimiters is None or pos >= delimiters.shape[1]:
+        return None
+    begins = starts if pos == 0 else delimiters[:, pos - 1] + 1
+    ends = delimiters[:, pos]
+    lengths = ends - begins
+    longest = int(lengths.max()) if len(lengths) else 0
+    if longest == 0 or longest > 18 or lengths.min() == 0:
+        return None
+
+    # Right-align every field in a (lines x longest) digit matrix, zero-padded on the left
+    columns = np.arange(longest)
+    offsets = ends[:, None] - longest + columns
+    digits = buffer[np.maximum(offsets, 0)].astype(np.int64) - ZERO
+    digits[columns < (longest - lengths)[:, None]] = 0
+    if digits.min() < 0 or digits.max() > 9:
+        return None
+    return digits @ (10 ** np.arange(longest - 1, -1, -1, dtype=np.int64))
+
+# Line-by-line parse for chunks parse_integers cannot handle
+def split_integers(data: bytes, starts: np.ndarray, ends: np.ndarray, pos: int) -> np.ndarray:
+    return np.fromiter((int(data[start:end].split(b'|', pos + 1)[pos]) for start, end in zip(starts.tolist(), ends.tolist())), dtype=np.int64, count=len(starts))
+
+"""
+Routes the lines of one chunk to per-node part files
+------------------------------------------------------------------------------------------
+The chunk is only ever held as its raw bytes plus a few NumPy arrays per line (offsets, keys,
+node masks): keys are parsed from the delimiter positions and each node's lines are gathered
+with a byte mask, so memory is bounded by chunk_size rather than by the table.
+Returns {export column: (distinct values, node masks)}.
+------------------------------------------------------------------------------------------
+"""
+def route_chunk(path: str, start: int, end: int, key_pos: int, route: tuple, destinations: list[str], chunk: int, export_positions: list[int]) -> dict:
+    with open(path, 'rb') as file:
+        data = os.pread(file.fileno(), end - start, start)
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    starts, ends = line_bounds(buffer)
+
+    # Every line of a .tbl file has the same number of delimiters, so they reshape into a matrix
+    delimiters = np.flatnonzero(buffer == DELIMITER)
+    if len(starts) == 0 or len(delimiters) % len(starts) or \
+            np.any(np.searchsorted(delimiters, ends) - np.searchsorted(delimiters, starts) != len(delimiters) // len(starts)):
+        delimiters = None
+    else:
+        delimiters = delimiters.reshape(len(starts), -1)
+
+    def column(pos: int) -> np.ndarray:
+        values = parse_integers(buffer, delimiters, starts, pos)
+        return values if values is not None else split_integers(data, starts, ends, pos)
+
+    keys = column(key_pos)
+    masks = route_masks(keys, route)
+    lengths = ends - starts
+    for node, destination in enumerate(destinations):
+        selected = (masks & np.uint64(1 << node)) != 0
+        with open(f"{destination}.{chunk}", 'wb') as part:
+            part.write(buffer[np.repeat(selected, lengths)])
+
+    exports = {}
+    for pos in export_positions:
+        exports[pos] = combine_masks(column(pos), masks)
+    return exports
+
+def concat_parts(destination: str, parts: list[str]) -> None:
+    with open(destination, 'wb') as dst:
+        for part in parts:
+            with open(part, 'rb') as src:
+                copy_range(src.fileno(), dst.fileno(), 0, os.fstat(src.fileno()).st_size)
+            os.remove(part)
+
+# Runs on the pool when there is one, inline otherwise
+def run(executor: Executor, function, *args) -> Future:
+    if executor is not None:
+        return executor.submit(function, *args)
+    future = Future()
+    future.set_result(function(*args))
+    return future
+
+"""
+Routes every line of a .tbl file to one or more nodes by the integer key in column key_pos
+------------------------------------------------------------------------------------------
+Chunks are routed (in parallel with an executor) into per-chunk part files that are then
+concatenated in chunk order, so each node file keeps the source line order. Returns, for
+every column in export_positions, its distinct values with the mask of nodes they went to
+(what a table joined on that column needs to follow).
+------------------------------------------------------------------------------------------
+"""
+def route_file(path: str, key_pos: int, route: tuple, destinations: list[str], executor: Executor, chunk_size: int, export_positions: list[int] = ()) -> dict:
+    if len(destinations) > 64:
+        raise ValueError("Routing supports at most 64 nodes")
+
+    chunks = chunk_ranges(path, chunk_size)
+    futures = [run(executor, route_chunk, path, start, end, key_pos, route, destinations, chunk, list(export_positions)) for chunk, (start, end) in enumerate(chunks)]
+    results = [future.result() for future in futures]
+
+    concats = [run(executor, concat_parts, destination, [f"{destination}.{chunk}" for chunk in range(len(chunks))]) for destination in destinations]
+    for future in concats:
+        future.result()
+
+    exports = {}
+    for pos in export_positions:
+        if not results:
+            exports[pos] = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64))
+            continue
+        exports[pos] = combine_masks(np.concatenate([result[pos][0] for result in results]), np.concatenate([result[pos][1] for result in results]))
+    return exports
+
+# Keys of the lines under sample_size random byte offsets (longer lines are slightly favoured)
+def sample_keys(path: str, key_pos: int, sample_size: int, seed: int = 0) -> np.ndarray:
+    size = os.path.getsize(path)
+    if size == 0 or sample_size <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    offsets = np.sort(np.random.default_rng(seed).integers(0, size, sample_size))
+    keys = np.empty(sample_size, dtype=np.int64)
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for sample, offset in enumerate(offsets.tolist()):
+            start = mm.rfind(b'\n', 0, offset) + 1
+            end = mm.find(b'\n', start)
+            keys[sample] = int(mm[start:end if end != -1 else size].split(b'|', key_pos + 1)[key_pos])
+    return keys
+
+# Equi-depth boundaries for ("range", boundaries): node i gets keys in [boundaries[i - 1], boundaries[i])
+def equi_depth_boundaries(sample: np.ndarray, parts: int) -> np.ndarray:
+    if len(sample) == 0:
+        return np.zeros(parts - 1, dtype=np.int64)
+    ordered = np.sort(sample)
+    return ordered[[len(ordered) * part // parts for part in range(1, parts)]]
+
+def count_file_lines(path: str) -> int:
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return count_lines(mm)
@@ -0,0 +1,130 @@
+from .globals import *
+import sqlparse
+import hashlib
+import re
+
+STAGING_SCHEMA = "staging"
+
+# Each query stages its shipped rows in its own schema, so concurrent queries over the same table never
+# share (or drop) each other's staging tables
+def staging_schema(query_id: str) -> str:
+    return f"{STAGING_SCHEMA}_{hashlib.md5(str(query_id).encode('utf-8')).hexdigest()[:16]}"
+
+# Reads (column, type) pairs for every CREATE TABLE in schema.sql, keyed by lowercase table name
+def load_schema(path: str) -> dict[str, list[tuple[str, str]]]:
+    with open(path, 'r') as file:
+        text = file.read()
+
+    schema = {}
+    for table, body in re.findall(r'CREATE TABLE\s+(\w+)\s*\((.*?)\)\s*;', text, re.S | re.I):
+        columns = []
+        for definition in split_top_level(body, ','):
+            match = re.match(r'\s*(\w+)\s+(.+?)(?:\s+NOT\s+NULL)?\s*$', definition, re.S | re.I)
+            if match:
+                columns.append((match.group(1).lower(), match.group(2).strip()))
+        schema[table.lower()] = columns
+    return schema
+
+# Canonical text of a query (comments dropped, keywords and identifiers lowercased, whitespace collapsed)
+def normalize_sql(query: str) -> str:
+    formatted = sqlparse.format(query, strip_comments=True, keyword_case='lower', identifier_case='lower')
+    parts = []
+    for token in sqlparse.parse(formatted)[0].flatten() if formatted.strip() else []:
+        # Whitespace runs become one space; string literals are kept verbatim
+        if token.is_whitespace:
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+        else:
+            parts.append(token.value)
+    return ''.join(parts).strip().rstrip(';').strip()
+
+# Maps every column to the table that owns it (TPC-H column prefixes make this unambiguous)
+def column_owners(schema: dict[str, list[tuple[str, str]]]) -> dict[str, str]:
+    return {column: table for table, columns in schema.items() for column, _ in columns}
+
+def split_top_level(text: str, separator: str) -> list[str]:
+    parts, depth, current = [], 0, []
+    for char in text:
+        depth += (char == '(') - (char == ')')
+        if char == separator and depth == 0:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append(''.join(current))
+    return [part for part in parts if part.strip()]
+
+# Lowercase identifiers referenced anywhere in a token tree (builtins such as date/interval excluded)
+def referenced_names(token) -> set[str]:
+    return {t.value.lower() for t in token.flatten() if t.ttype in sqlparse.tokens.Name and t.ttype not in sqlparse.tokens.Name.Builtin}
+
+def has_subquery(token) -> bool:
+    return any(t.ttype in sqlparse.tokens.DML and t.value.lower() == 'select' for t in token.flatten())
+
+def has_qualifier(token) -> bool:
+    return any(t.ttype in sqlparse.tokens.Punctuation and t.value == '.' for t in token.flatten())
+
+def main_where(statement: sqlparse.sql.Statement):
+    return next((token for token in statement.tokens if isinstance(token, sqlparse.sql.Where)), None)
+
+# Splits a WHERE clause into its top-level AND conjuncts (the AND of a BETWEEN stays inside its conjunct)
+def top_level_conjuncts(where: sqlparse.sql.Where) -> list[list]:
+    conjuncts, current, in_between = [], [], False
+    for token in where.tokens[1:]:
+        if token.ttype in sqlparse.tokens.Keyword and token.value.lower() == 'between':
+            in_between = True
+        elif token.ttype in sqlparse.tokens.Keyword and token.value.lower() == 'and':
+            if in_between:
+                in_between = False
+            else:
+                conjuncts.append(current)
+                current = []
+                continue
+        elif token.ttype in sqlparse.tokens.Punctuation and token.value == ';':
+            continue
+        current.append(token)
+    conjuncts.append(current)
+    return [conjunct for conjunct in conjuncts if ''.join(str(token) for token in conjunct).strip()]
+
+"""
+Works out what each shipped table must contribute to a query
+------------------------------------------------------------------------------------------
+@columns: every schema column of the table referenced anywhere in the query
+@predicates: top-level WHERE conjuncts that only read that table, for tables that appear
+             exactly once and never inside a subquery (so filtering can't starve another
+             reference to the same table)
+------------------------------------------------------------------------------------------
+"""
+def plan_pushdown(query: str, tables: list[str], schema: dict[str, list[tuple[str, str]]]) -> dict[str, dict]:
+    statement = sqlparse.parse(query)[0]
+    owners = column_owners(schema)
+    names = referenced_names(statement)
+    select_all = any(token.ttype in sqlparse.tokens.Wildcard for token in statement.tokens)
+
+    occurrences = collections.Counter(t['table'].lower() for t in extract_tables(statement))
+    in_subquery = {t['table'].lower() for t in extract_tables(statement) if t['subquery']}
+
+    plan = {}
+    for table in tables:
+        columns = [column for column, _ in schema[table] if select_all or column in names]
+        # Keep one column so row counts (e.g. count(*)) survive the projection
+        plan[table] = {"columns": columns if columns else [schema[table][0][0]], "predicates": []}
+
+    where = main_where(statement)
+    if where is None:
+        return plan
+
+    for conjunct in top_level_conjuncts(where):
+        group = sqlparse.sql.TokenList(conjunct)
+        if has_subquery(group) or has_qualifier(group):
+            continue
+
+        owning_tables = {owners[name] for name in referenced_names(group) if name in owners}
+        if len(owning_tables) != 1:
+            continue
+
+        table = owning_tables.pop()
+        if table in plan and occurrences[table] == 1 and table not in in_subquery:
+            plan[table]["predicates"].append(str(group).strip())
+
+    return plan
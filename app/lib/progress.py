@@ -0,0 +1,77 @@
+import threading
+import time
+
+# States that start a worker's (or dbgen run's) timer
+ACTIVE_STATES = ("loading", "generating")
+
+"""
+Progress of a long-running initialization, polled through a status endpoint
+------------------------------------------------------------------------------------------
+state: idle -> initializing -> ready | failed
+phase: what the aggregator is doing right now (partitioning, loading, ...)
+workers: per-worker state (pending -> loading -> ready | failed) with its timings and details,
+or per dbgen run (pending -> generating -> ready | failed) while data is generated
+------------------------------------------------------------------------------------------
+"""
+class InitProgress:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.state = "idle"
+        self.phase = None
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.report = None
+        self.workers = {}
+
+    def __repr__(self) -> str:
+        return f"InitProgress(state={self.state!r}, phase={self.phase!r}, workers={len(self.workers)})"
+
+    @property
+    def running(self) -> bool:
+        return self.state == "initializing"
+
+    # Returns False when an initialization is already running
+    def begin(self, worker_ids: list[str]) -> bool:
+        with self.lock:
+            if self.state == "initializing":
+                return False
+            self.state, self.phase, self.error, self.report = "initializing", "starting", None, None
+            self.started, self.finished = time.time(), None
+            self.workers = {worker_id: {"state": "pending"} for worker_id in worker_ids}
+            return True
+
+    def set_phase(self, phase: str) -> None:
+        with self.lock:
+            self.phase = phase
+
+    def update(self, worker_id: str, state: str, **details) -> None:
+        with self.lock:
+            worker = self.workers.setdefault(worker_id, {})
+            now = time.time()
+            if state in ACTIVE_STATES:
+                worker["started"] = now
+            elif "started" in worker:
+                worker["seconds"] = round(now - worker["started"], 4)
+            worker["state"] = state
+            worker.update(details)
+
+    def finish(self, report: dict = None) -> None:
+        with self.lock:
+            self.state, self.phase, self.report, self.finished = "ready", None, report, time.time()
+
+    def fail(self, error: str) -> None:
+        with self.lock:
+            self.state, self.error, self.finished = "failed", error, time.time()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            end = self.finished if self.finished is not None else time.time()
+            return {
+                "state": self.state,
+                "phase": self.phase,
+                "elapsed": round(end - self.started, 4) if self.started is not None else None,
+                "error": self.error,
+                "workers": {worker_id: dict(worker) for worker_id, worker in self.workers.items()},
+                "report": self.report
+            }
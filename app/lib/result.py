@@ -0,0 +1,112 @@
+from decimal import Decimal
+import datetime
+import numpy as np
+
+# Postgres type OIDs (pg_type.oid) mapped to the column kinds a ResultSet stores natively
+TYPE_OIDS = {
+    16: "bool",
+    20: "int", 21: "int", 23: "int",
+    700: "float", 701: "float",
+    1700: "decimal",
+    1082: "date",
+    18: "text", 25: "text", 1042: "text", 1043: "text"
+}
+NUMPY_TYPES = {"int": np.int64, "float": np.float64, "bool": np.bool_}
+
+class ResultSet:
+    def __init__(self, columns: list[str] = None, types: list[str] = None, data: list = None, query_time: float = None) -> None:
+        self.columns = columns if columns is not None else []
+        self.types = types if types is not None else ["other" for _ in self.columns]
+        self.data = data if data is not None else [[] for _ in self.columns]
+        self.query_time = query_time
+
+    def __repr__(self) -> str:
+        return (f"ResultSet(columns={self.columns}, "
+                f"types={self.types}, "
+                f"rows={len(self)}, "
+                f"query_time={self.query_time})")
+
+    def __len__(self) -> int:
+        return len(self.data[0]) if self.data else 0
+
+    # Builds a ResultSet from DB-API rows, using the cursor description for column kinds
+    @classmethod
+    def from_rows(cls, description, rows: list[tuple]) -> "ResultSet":
+        columns = [desc[0] for desc in description]
+        types = [TYPE_OIDS.get(desc[1], "other") for desc in description]
+        values = list(zip(*rows)) if rows else [() for _ in columns]
+        data = [pack_column(kind, column) for kind, column in zip(types, values)]
+        return cls(columns, types, data)
+
+    # Concatenates result sets that share the same columns (batches, per-worker results)
+    @classmethod
+    def concat(cls, results: list["ResultSet"]) -> "ResultSet":
+        results = [result for result in results if result.columns]
+        if not results:
+            return cls()
+
+        first = results[0]
+        data = []
+        for pos, kind in enumerate(first.types):
+            column = []
+            for result in results:
+                column.extend(as_list(result.data[pos]))
+            data.append(pack_column(kind, column))
+        return cls(list(first.columns), list(first.types), data)
+
+    def slice(self, start: int, stop: int) -> "ResultSet":
+        return ResultSet(list(self.columns), list(self.types), [column[start:stop] for column in self.data], self.query_time)
+
+    # Reorders/filters rows by position, keeping NumPy columns as arrays
+    def take(self, positions) -> "ResultSet":
+        positions = np.asarray(positions, dtype=np.int64)
+        data = [column[positions] if isinstance(column, np.ndarray) else [column[pos] for pos in positions.tolist()] for column in self.data]
+        return ResultSet(list(self.columns), list(self.types), data, self.query_time)
+
+    def column(self, name: str):
+        return self.data[self.columns.index(name)]
+
+    def rows(self):
+        return zip(*(as_list(column) for column in self.data))
+
+    def to_records(self) -> list[dict]:
+        return [dict(zip(self.columns, row)) for row in self.rows()]
+
+    # JSON is only produced at the API edge; values keep full precision as strings where needed
+    def to_json(self) -> dict:
+        payload = {
+            "columns": self.columns,
+            "types": self.types,
+            "data": [encode_column(kind, column) for kind, column in zip(self.types, self.data)]
+        }
+        if self.query_time is not None:
+            payload["query_time"] = self.query_time
+        return payload
+
+    @classmethod
+    def from_json(cls, payload: dict) -> "ResultSet":
+        types = payload["types"]
+        data = [pack_column(kind, decode_column(kind, column)) for kind, column in zip(types, payload["data"])]
+        return cls(payload["columns"], types, data, payload.get("query_time"))
+
+# Stores numeric columns as NumPy arrays and everything else as native Python lists
+def pack_column(kind: str, values):
+    if kind in NUMPY_TYPES and None not in values:
+        return np.asarray(values, dtype=NUMPY_TYPES[kind])
+    return list(values)
+
+def as_list(column) -> list:
+    return column.tolist() if isinstance(column, np.ndarray) else column
+
+def encode_column(kind: str, column) -> list:
+    values = as_list(column)
+    if kind in ("decimal", "date", "other"):
+        return [None if value is None else str(value) for value in values]
+    return values
+
+def decode_column(kind: str, values: list) -> list:
+    if kind == "decimal":
+        return [None if value is None else Decimal(value) for value in values]
+    if kind == "date":
+        return [None if value is None else datetime.date.fromisoformat(value) for value in values]
+    return values
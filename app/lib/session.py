@@ -0,0 +1,35 @@
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+import threading
+import requests
+
+class PeerSessions:
+    def __init__(self, pool_maxsize: int = 10) -> None:
+        self.pool_maxsize = pool_maxsize
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"PeerSessions(peers={list(self.sessions)}, pool_maxsize={self.pool_maxsize})"
+
+    # One keep-alive session per peer; urllib3 pools its connections across request threads
+    def get(self, url: str) -> requests.Session:
+        parts = urlsplit(url)
+        peer = f"{parts.scheme}://{parts.netloc}"
+        with self.lock:
+            session = self.sessions.get(peer)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount(peer, adapter)
+                self.sessions[peer] = session
+        return session
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.get(url).post(url, **kwargs)
+
+    def close(self) -> None:
+        with self.lock:
+            sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            session.close()
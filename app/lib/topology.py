@@ -0,0 +1,117 @@
+import math
+
+"""
+k-ary aggregation tree over the workers (FOLLOWER architecture)
+------------------------------------------------------------------------------------------
+roots: leaders the aggregator talks to (at most fanout of them)
+children: {leader id: child ids}, a leader's children are followers (leaves, which hold the
+partitions) and/or leaders of smaller subtrees
+parents: {id: parent id}, None for the roots
+A leader loads the partitions of its followers, runs the query on them and merges what its
+child leaders send up, so every node (the aggregator included) merges at most fanout
+inbound results.
+------------------------------------------------------------------------------------------
+"""
+class AggregationTree:
+    def __init__(self, fanout: int, roots: list[str] = None, children: dict[str, list[str]] = None, parents: dict[str, str] = None) -> None:
+        self.fanout = fanout
+        self.roots = roots if roots is not None else []
+        self.children = children if children is not None else {}
+        self.parents = parents if parents is not None else {}
+
+    def __repr__(self) -> str:
+        return (f"AggregationTree(fanout={self.fanout}, "
+                f"roots={self.roots}, "
+                f"leaders={len(self.leaders)}, "
+                f"followers={len(self.followers)}, "
+                f"depth={self.depth})")
+
+    @property
+    def leaders(self) -> list[str]:
+        return [id for id in self.parents if self.children.get(id)]
+
+    @property
+    def followers(self) -> list[str]:
+        return [id for id in self.parents if not self.children.get(id)]
+
+    # Levels of leaders above the followers
+    @property
+    def depth(self) -> int:
+        def height(id: str) -> int:
+            return 1 + max(height(child) for child in self.children[id]) if self.children.get(id) else 0
+        return max((height(root) for root in self.roots), default=0)
+
+    def leaf_children(self, id: str) -> list[str]:
+        return [child for child in self.children.get(id, []) if not self.children.get(child)]
+
+    def leader_children(self, id: str) -> list[str]:
+        return [child for child in self.children.get(id, []) if self.children.get(child)]
+
+    def report(self) -> dict:
+        return {"fanout": self.fanout, "roots": self.roots, "children": self.children, "depth": self.depth}
+
+    @classmethod
+    def from_report(cls, report: dict) -> "AggregationTree":
+        tree = cls(report["fanout"], report["roots"], report["children"])
+        for root in tree.roots:
+            tree.attach(root, None)
+        return tree
+
+    def attach(self, id: str, parent: str) -> None:
+        self.parents[id] = parent
+        for child in self.children.get(id, []):
+            self.attach(child, id)
+
+# Fewest leaders that give every other node a parent when each leader (and the aggregator, whose
+# children are all leaders) takes at most fanout children
+def leader_count(nodes: int, fanout: int) -> int:
+    return max(math.ceil(nodes / (fanout + 1)), math.ceil((nodes - fanout) / fanout))
+
+# Shape of the tree as nested lists of children (a follower is an empty list), one per root. Leaders
+# take their children level by level: child leaders first, every other slot a follower, so follower
+# slots fill up before another level is added
+def tree_shape(nodes: int, fanout: int) -> list[list]:
+    leaders = leader_count(nodes, fanout)
+    roots = min(fanout, leaders)
+    # One root fewer (a level deeper) rather than leaders with a single child, while everything still fits
+    while roots > 1 and nodes - roots < 2 * leaders and nodes - roots + 1 <= fanout * leaders:
+        roots -= 1
+
+    size, extra = divmod(nodes - roots, leaders)
+    shapes = [[] for _ in range(leaders)]
+    next_leader = roots
+    for pos, children in enumerate(shapes):
+        count = size + (pos < extra)
+        leads = min(count, leaders - next_leader)
+        children.extend(shapes[next_leader:next_leader + leads])
+        children.extend([] for _ in range(count - leads))
+        next_leader += leads
+    return shapes[:roots]
+
+def build_subtree(tree: AggregationTree, shape: list, ids, parent: str) -> str:
+    root = next(ids)
+    tree.parents[root] = parent
+    if shape:
+        tree.children[root] = [build_subtree(tree, child, ids, root) for child in shape]
+    return root
+
+"""
+Builds the aggregation tree for any number of workers
+------------------------------------------------------------------------------------------
+@worker_ids: workers in order, each subtree takes a contiguous run (its first id leads it)
+@fanout: most children per leader and most leaders reporting to the aggregator
+Returns None when there are fewer than two workers (no leader can have a follower).
+Leaders hold no partitions, so the tree uses as few as fanout allows: 3 workers with fanout
+3 give the original triple, 13 give 3 roots with 9 followers under 4 leaders and 50 give 34
+followers under 16 leaders, 3 levels deep.
+------------------------------------------------------------------------------------------
+"""
+def build_aggregation_tree(worker_ids: list[str], fanout: int) -> AggregationTree:
+    if len(worker_ids) < 2 or fanout < 1:
+        return None
+
+    tree = AggregationTree(fanout)
+    ids = iter(worker_ids)
+    for shape in tree_shape(len(worker_ids), fanout):
+        tree.roots.append(build_subtree(tree, shape, ids, None))
+    return tree
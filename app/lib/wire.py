@@ -0,0 +1,224 @@
+from decimal import Decimal
+from .result import *
+import datetime
+import struct
+import numpy as np
+
+# Length-prefixed column-block encoding for shipping ResultSet batches between nodes
+#
+# batch:  MAGIC | u16 name length | name | u32 column count | u64 row count | column blocks
+# column: u16 name length | name | u8 kind | u8 encoding | u8 has nulls | [null bitmap] | payload
+#
+# All integers are little-endian. Null slots hold a zero/empty placeholder in the payload.
+COLUMNAR_CONTENT_TYPE = "application/x-geoqa-columnar"
+JSON_CONTENT_TYPE = "application/json"
+SUPPORTED_CONTENT_TYPES = [COLUMNAR_CONTENT_TYPE, JSON_CONTENT_TYPE]
+MAGIC = b"GQC1"
+
+KIND_CODES = {"int": 0, "float": 1, "bool": 2, "decimal": 3, "date": 4, "text": 5, "other": 6}
+CODE_KINDS = {code: kind for kind, code in KIND_CODES.items()}
+
+# Payload encodings
+FIXED = 0       # NumPy fixed-width array
+SCALED = 1      # Decimals as int64 with a u8 scale prefix
+STRINGS = 2     # u32 offsets (rows + 1) followed by a UTF-8 blob
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+INT64_LIMIT = 2 ** 63 - 1
+
+# Picks the first content type the receiver advertised that this node can produce
+def negotiate_content_type(accept: list[str] = None) -> str:
+    for content_type in accept or []:
+        if content_type in SUPPORTED_CONTENT_TYPES:
+            return content_type
+    return JSON_CONTENT_TYPE
+
+def encode_batch(name: str, result: ResultSet) -> bytes:
+    parts = [MAGIC, pack_string(name), struct.pack("<IQ", len(result.columns), len(result))]
+    for column, kind, values in zip(result.columns, result.types, result.data):
+        parts.append(pack_string(column))
+        parts.extend(encode_column_block(kind, values))
+    return b"".join(parts)
+
+def decode_batch(payload: bytes) -> tuple[str, ResultSet]:
+    view = memoryview(payload)
+    if bytes(view[:4]) != MAGIC:
+        raise ValueError("Payload is not a Geo-QA columnar batch")
+
+    name, pos = unpack_string(view, 4)
+    column_count, row_count = struct.unpack_from("<IQ", view, pos)
+    pos += 12
+
+    columns, types, data = [], [], []
+    for _ in range(column_count):
+        column, pos = unpack_string(view, pos)
+        kind, values, pos = decode_column_block(view, pos, row_count)
+        columns.append(column)
+        types.append(kind)
+        data.append(values)
+
+    return name, ResultSet(columns, types, data)
+
+def pack_string(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return struct.pack("<H", len(encoded)) + encoded
+
+def unpack_string(view: memoryview, pos: int) -> tuple[str, int]:
+    (length,) = struct.unpack_from("<H", view, pos)
+    pos += 2
+    return bytes(view[pos:pos + length]).decode("utf-8"), pos + length
+
+def encode_column_block(kind: str, column) -> list[bytes]:
+    values = column if isinstance(column, np.ndarray) else list(column)
+    nulls = None
+    if not isinstance(values, np.ndarray) and None in values:
+        nulls = np.array([value is None for value in values], dtype=np.bool_)
+
+    if kind in ("int", "float", "bool"):
+        dtype = {"int": "<i8", "float": "<f8", "bool": "u1"}[kind]
+        if nulls is not None:
+            values = [0 if value is None else value for value in values]
+        encoding, payload = FIXED, np.asarray(values, dtype=dtype).tobytes()
+
+    elif kind == "date":
+        days = [0 if value is None else value.toordinal() - EPOCH_ORDINAL for value in values]
+        encoding, payload = FIXED, np.asarray(days, dtype="<i4").tobytes()
+
+    elif kind == "decimal" and (scaled := scaled_decimals(values)) is not None:
+        scale, ints = scaled
+        encoding, payload = SCALED, struct.pack("<B", scale) + np.asarray(ints, dtype="<i8").tobytes()
+
+    else:
+        encoding, payload = STRINGS, encode_strings(values)
+
+    header = struct.pack("<BBB", KIND_CODES.get(kind, KIND_CODES["other"]), encoding, nulls is not None)
+    if nulls is None:
+        return [header, payload]
+    return [header, np.packbits(nulls, bitorder="little").tobytes(), payload]
+
+def decode_column_block(view: memoryview, pos: int, rows: int):
+    kind_code, encoding, has_nulls = struct.unpack_from("<BBB", view, pos)
+    kind = CODE_KINDS[kind_code]
+    pos += 3
+
+    nulls = None
+    if has_nulls:
+        size = (rows + 7) // 8
+        nulls = np.unpackbits(np.frombuffer(view, dtype="u1", count=size, offset=pos), count=rows, bitorder="little").astype(np.bool_)
+        pos += size
+
+    if encoding == FIXED:
+        dtype = {"int": "<i8", "float": "<f8", "bool": "u1", "date": "<i4"}[kind]
+        array = np.frombuffer(view, dtype=dtype, count=rows, offset=pos)
+        pos += array.nbytes
+        if kind == "date":
+            values = map_unique(array, lambda day: datetime.date.fromordinal(day + EPOCH_ORDINAL))
+        else:
+            values = array.astype(NUMPY_TYPES[kind])
+
+    elif encoding == SCALED:
+        (scale,) = struct.unpack_from("<B", view, pos)
+        array = np.frombuffer(view, dtype="<i8", count=rows, offset=pos + 1)
+        pos += 1 + array.nbytes
+        values = map_unique(array, lambda value: Decimal(value).scaleb(-scale))
+
+    else:
+        values, pos = decode_strings(view, pos, rows, kind)
+
+    if nulls is not None:
+        values = [None if null else value for null, value in zip(nulls.tolist(), as_list(values))]
+    return kind, values, pos
+
+# Builds Python objects once per distinct value (dates and prices repeat heavily in TPC-H)
+def map_unique(array: np.ndarray, convert) -> list:
+    unique, inverse = np.unique(array, return_inverse=True)
+    objects = np.empty(len(unique), dtype=object)
+    objects[:] = [convert(value) for value in unique.tolist()]
+    return objects[inverse].tolist()
+
+# Returns (scale, scaled ints) when every decimal fits in an int64 at a shared scale
+def scaled_decimals(values: list):
+    unique = set(values)
+    unique.discard(None)
+
+    scale = 0
+    for value in unique:
+        exponent = value.as_tuple().exponent
+        if not isinstance(exponent, int):
+            return None
+        scale = max(scale, -exponent)
+    if scale > 18:
+        return None
+
+    lookup = {value: int(value.scaleb(scale)) for value in unique}
+    if lookup and max(abs(value) for value in lookup.values()) > INT64_LIMIT:
+        return None
+    lookup[None] = 0
+    return scale, [lookup[value] for value in values]
+
+def encode_strings(values: list) -> bytes:
+    strings = ["" if value is None else str(value) for value in values]
+    offsets = np.zeros(len(strings) + 1, dtype="<u4")
+
+    # Mirror of the decoder: ASCII text is encoded in one pass and offset by character length
+    text = "".join(strings)
+    blob = text.encode("utf-8")
+    if len(blob) == len(text):
+        np.cumsum([len(value) for value in strings], out=offsets[1:])
+    else:
+        encoded = [value.encode("utf-8") for value in strings]
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        blob = b"".join(encoded)
+    return offsets.tobytes() + blob
+
+def decode_strings(view: memoryview, pos: int, rows: int, kind: str):
+    offsets = np.frombuffer(view, dtype="<u4", count=rows + 1, offset=pos).tolist()
+    pos += (rows + 1) * 4
+    blob = bytes(view[pos:pos + offsets[-1]])
+    pos += offsets[-1]
+
+    # ASCII blobs (all of TPC-H) can be decoded once and sliced by the byte offsets
+    text = blob.decode("utf-8")
+    if len(text) == len(blob):
+        values = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+    else:
+        values = [blob[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+    # Empty strings are the placeholders written for null decimals
+    if kind == "decimal":
+        values = [Decimal(value) if value else None for value in values]
+    return values, pos
+
+# Frames for streamed uploads: many (possibly compressed) batches in one chunked request
+#
+# frame: u32 body length | f64 compress cpu seconds | u16 encoding length | encoding | body
+FRAME_HEADER = struct.Struct("<Id")
+
+def encode_frame(body: bytes, encoding: str, compress_time: float) -> bytes:
+    return FRAME_HEADER.pack(len(body), compress_time) + pack_string(encoding) + body
+
+def read_frames(stream):
+    while True:
+        header = read_exactly(stream, FRAME_HEADER.size)
+        if header is None:
+            return
+        length, compress_time = FRAME_HEADER.unpack(header)
+        (encoding_length,) = struct.unpack("<H", read_exactly(stream, 2, required=True))
+        encoding = read_exactly(stream, encoding_length, required=True).decode("utf-8")
+        yield encoding, compress_time, read_exactly(stream, length, required=True)
+
+# Reads n bytes from a stream that may return short reads; None on a clean end of stream
+def read_exactly(stream, size: int, required: bool = False):
+    chunks, remaining = [], size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+
+    if remaining == size and not required:
+        return None
+    if remaining:
+        raise ValueError(f"Stream ended {remaining} bytes into a {size} byte read")
+    return b"".join(chunks)
@@ -2,15 +2,58 @@ from flask import Flask, request, jsonify, make_response, Response
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from lib.globals import *
 from lib.database import *
+from lib.wire import *
+from lib.compression import *
+from lib.session import *
+from lib.manifest import *
+from lib.decomposer import *
+from lib.collector import *
+from lib.generation import *
 import os
+import collections
 import requests
 import configparser
+import json
+import threading
 import time
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
 worker = None
 db = None
+compression = None
+sessions = None
+loading = None
+indexing = None
+follower_lock = threading.Lock()
+collector = None
+table_schemas = None
+generating = None
+
+def request_json() -> dict:
+    """Helper function to parse a (possibly compressed) JSON request body."""
+    body, _ = decode_body(request.get_data(), request.headers)
+    return json.loads(body)
+
+def post_payload(url: str, body: bytes, content_type: str, accept_encoding: list[str] = None, query_id: str = None):
+    """Helper function to POST a body compressed with the encoding negotiated for the receiver."""
+    payload, headers, _ = compression.encode(body, content_type, accept_encoding)
+    if query_id is not None:
+        headers[QUERY_ID_HEADER] = query_id
+    return sessions.post(url, data=payload, headers=headers)
+
+def encode_data_batch(table: str, batch: ResultSet, content_type: str) -> bytes:
+    """Helper function to serialize a data batch in the negotiated content type."""
+    if content_type == COLUMNAR_CONTENT_TYPE:
+        return encode_batch(table, batch)
+    return json.dumps({"name": table, "rows": batch.to_json()}).encode("utf-8")
+
+def decode_data_batch(body: bytes, content_type: str) -> tuple[str, ResultSet]:
+    """Helper function to decode a data batch in whichever content type the follower chose."""
+    if content_type == COLUMNAR_CONTENT_TYPE:
+        return decode_batch(body)
+    data = json.loads(body)
+    return data.get('name'), ResultSet.from_json(data.get('rows'))
 
 @app.route('/process_query', methods=['POST'])
 def process_query() -> Response:
@@ -20,14 +63,18 @@ def process_query() -> Response:
     agg_url = request.json.get('agg_url')
     query_id = request.json.get('query_id')
     worker_id = request.json.get('worker_id')
+    accept_encoding = request.json.get('accept_encoding')
     start_time = time.time()
     try: 
         results = db.execute_query(query)
         end_time = time.time()
-        results.append({"query_time": end_time - start_time})
-        response = requests.post(agg_url, json={"results": results,
-                                                "query_id": query_id,
-                                                "worker_id": worker_id})
+        results.query_time = end_time - start_time
+        body = json.dumps({"results": results.to_json(),
+                           "query_id": query_id,
+                           "worker_id": worker_id}).encode("utf-8")
+        response = post_payload(agg_url, body, JSON_CONTENT_TYPE, accept_encoding, query_id)
+        if response.status_code != 200:
+            return make_response(f"Error sending results to aggregator: {response.text}", response.status_code)
         return make_response("Success", 200)
     
     except Exception as e:
@@ -39,87 +86,176 @@ def process_data() -> Response:
     global db
 
     tables = request.json.get('tables')
-    agg_url = request.json.get('agg_url')
+    # Followers of a reducing leader ship their rows to it instead of the aggregator
+    agg_url = request.json.get('agg_url') or f"{worker.leader_address}/receive_data"
+    content_type = negotiate_content_type(request.json.get('accept'))
+    accept_encoding = request.json.get('accept_encoding')
+    query_id = request.json.get('query_id')
+    stream_url = request.json.get('stream_url')
+    pushdown = request.json.get('pushdown') or {}
     try:
+        # Pipeline every table through one chunked request when the aggregator offers a stream
+        if stream_url:
+            def frames():
+                for table in tables:
+                    for batch in db.fetch_all(table, **pushdown.get(table, {})):
+                        body = encode_data_batch(table, batch, content_type)
+                        payload, _, stats = compression.encode(body, content_type, accept_encoding)
+                        yield encode_frame(payload, stats["encoding"], stats["compress_cpu_time"])
+
+            headers = {"Content-Type": content_type, QUERY_ID_HEADER: query_id}
+            response = sessions.post(stream_url, data=frames(), headers=headers)
+            if response.status_code != 200:
+                return make_response(f"Error streaming data to aggregator: {response.text}", response.status_code)
+            return make_response("Success", 200)
+
         for table in tables:
-            for batch in db.fetch_all(table):
-                response = requests.post(
-                    agg_url, 
-                    json={"name": table, "rows": batch}
-                )
+            for batch in db.fetch_all(table, **pushdown.get(table, {})):
+                body = encode_data_batch(table, batch, content_type)
+                response = post_payload(agg_url, body, content_type, accept_encoding, query_id)
+                # A missing batch would silently drop rows from the answer (the leader or aggregator sees the failure)
                 if response.status_code != 200:
-                    print("Error sending data to aggregator")
-                    
+                    return make_response(f"Error sending {table} data to {agg_url}: {response.text}", response.status_code)
+
         return make_response("Success", 200)
     
     except Exception as e:
         return make_response(str(e), 500)
     
 
+def generate_tables_locally(generate: dict, files: dict[str, str], checksums: dict[str, str]) -> list[str]:
+    """Helper function to run dbgen for this worker's chunk of tables it does not hold yet, adding them to files; returns the new files."""
+    if not generate:
+        return []
+    scale_factor, chunks = generate["scale_factor"], generate["chunks"]
+    current = db.loaded_files()
+    stale = collections.defaultdict(list)
+    for table, step in generate["tables"].items():
+        # The dbgen settings identify the chunk, so an unchanged chunk is neither generated nor reloaded
+        checksums[table] = chunk_version(scale_factor, chunks, step)
+        files[table] = chunk_path(generating["worker_path"], table, chunks, step)
+        if current.get(table) != checksums[table]:
+            stale[step].append(table)
+    if not stale:
+        return []
+
+    build_dbgen(DBGEN_DIRECTORY)
+    start_time = time.time()
+    paths = [path for step, tables in stale.items() for path in generate_chunk(DBGEN_DIRECTORY, generating["worker_path"], scale_factor, chunks, step, tables).values()]
+    print(f"Generated {paths} in {time.time() - start_time:.2f}s")
+    return paths
+
 @app.route('/receive_init', methods=['POST'])
 def receive_init() -> Response:
     global worker, db
 
     # Initialize worker instance
-    worker.worker_type = WorkerType(request.json.get("worker_type"))
-    files = request.json.get("files")
-    worker.leader_address = request.json.get("leader_address")
-    worker.follower_addresses = request.json.get("follower_addresses")
+    payload = request_json()
+    worker.worker_type = WorkerType(payload.get("worker_type"))
+    files = payload.get("files")
+    worker.leader_address = payload.get("leader_address")
+    worker.follower_addresses = payload.get("follower_addresses")
+    worker.leader_addresses = payload.get("leader_addresses", [])
     
     # Get mountpoint
     config = configparser.ConfigParser()
     config.read('config.ini')
     worker.mount_point = config["SHARED"]["mount_point"]
 
-    # Generate a load file for all the tables
-    file = open(f'{worker.mount_point }/load.sql', 'w')
-    for table in files:
-        # Save the tables that are being partitioned (leader-follower)
-        if "worker_" in files[table]:
-            worker.partition_tables.append(files[table])
+    # Save the tables that are being partitioned (leader-follower)
+    worker.partition_tables = [path for path in files.values() if "worker_" in path]
 
-        file.write(f"\copy {table} FROM '{files[table]}' DELIMITER '|' CSV;\n")
-    file.close()
+    # Generate this worker's own dbgen chunk of the tables the aggregator did not split for it
+    checksums = dict(payload.get("checksums") or {})
+    generated = generate_tables_locally(payload.get("generate"), files, checksums)
 
-    # Load tables
-    subprocess.run([f"cd {worker.mount_point} && psql -U {db.user} -d {db.name} -f load.sql"], check=True, shell=True)
+    # Load tables, skipping the ones this database already holds with the same manifest checksum
+    loaded = db.load_files(files, checksums, exclusive=True, **loading_options(loading))
+    print(f"Loaded {list(loaded)}, {len(files) - len(loaded)} tables unchanged")
+    # The generated rows now live in the database, so their files only take up disk
+    for path in generated:
+        os.remove(path)
 
-    return make_response("Success", 200)
+    # ANALYZE what was loaded and build the indexes the registered workload needs
+    indexes = {}
+    if indexing.getboolean("enabled"):
+        indexes = db.prepare_workload(list(loaded), list(files), payload.get("indexes", []), payload.get("workload"), **indexing_options(indexing))
+
+    return make_response(jsonify({"loaded": loaded, "indexes": indexes}), 200)
 
 
 
+"""
+Passes a LOCAL mode data request down this leader's subtree
+------------------------------------------------------------------------------------------
+By default followers ship their (filtered, projected) rows straight to the aggregator. With
+reduce, the followers ship them to this leader instead, which stages them, runs the partial
+query and sends only the combined partial result up the tree (see gather_subtree).
+------------------------------------------------------------------------------------------
+"""
 @app.route('/leader_data', methods=['POST'])
 def leader_data() -> Response:
     global worker
 
+    if request.json.get('reduce'):
+        return gather_subtree(request.json, "leader_data", lambda: reduce_followers(request.json))
+
     tables = request.json.get('tables')
     agg_url = request.json.get('agg_url')
+    accept = request.json.get('accept')
+    accept_encoding = request.json.get('accept_encoding')
+    query_id = request.json.get('query_id')
+    stream_url = request.json.get('stream_url')
+    pushdown = request.json.get('pushdown')
 
     def send_to_follower(follower_url):
         """Helper function to send POST request to a follower."""
-        response = requests.post(
+        response = sessions.post(
             f"{follower_url}/process_data",
-            json={"tables": tables, "agg_url": agg_url}
+            json={
+                "tables": tables,
+                "agg_url": agg_url,
+                "accept": accept,
+                "accept_encoding": accept_encoding,
+                "query_id": query_id,
+                "stream_url": stream_url,
+                "pushdown": pushdown
+            }
         )
         if response.status_code != 200:
             print(f"Issue sending request to follower: {follower_url}")
         return response
 
+    def send_to_leader(leader_url):
+        """Helper function to pass the request down to a child leader (and its subtree)."""
+        response = sessions.post(f"{leader_url}/leader_data", json=request.json)
+        if response.status_code != 200:
+            print(f"Issue sending request to leader: {leader_url}")
+        return response
+
     # Parallelize the requests using ThreadPoolExecutor
     with ThreadPoolExecutor() as executor:
         futures = [
             executor.submit(send_to_follower, follower_url)
             for follower_url in worker.follower_addresses
+        ] + [
+            executor.submit(send_to_leader, leader_url)
+            for leader_url in worker.leader_addresses
         ]
 
-        # Wait for all requests to complete
+        # Wait for all requests to complete, keeping the first failure (a missing upload leaves rows out of the answer)
+        failure = None
         for future in as_completed(futures):
             try:
-                future.result()  # Ensures any exceptions are raised
+                response = future.result()  # Ensures any exceptions are raised
+                if response.status_code != 200 and failure is None:
+                    failure = make_response(response.text, response.status_code)
             except Exception as e:
                 print(f"Error during request: {e}")
-    
-    return make_response("Success", 200)
+                if failure is None:
+                    failure = make_response(str(e), 500)
+
+    return failure if failure is not None else make_response("Success", 200)
 
 
 @app.route('/follower_sync', methods=['POST'])
@@ -127,49 +263,163 @@ def follower_sync() -> Response:
     global worker
 
     files = {path.split('/')[-1].replace('.tbl', '').split('_')[-1]: path for path in worker.partition_tables}
-    return jsonify({"files": files}), 200
+    # Manifest checksums of the partitions this follower holds (None when loaded without one)
+    loaded = db.loaded_files()
+    return jsonify({"files": files, "checksums": {table: loaded.get(table) for table in files}}), 200
 
 
-@app.route('/leader_results', methods=['POST'])
-def leader_results() -> Response:
-    global worker, db
-
-    query = request.json.get('query')
-    agg_url = request.json.get('agg_url')
-    query_id = request.json.get('query_id')
-    worker_id = request.json.get('worker_id')
-    delete_tables = set()
+def query_followers(query: str) -> tuple[ResultSet, set[str]]:
+    """Helper function to run a query over this leader's follower partitions; returns the result and the tables to empty afterwards."""
+    follower_files = collections.defaultdict(list)
+    follower_checksums = collections.defaultdict(dict)
 
     for follower_url in worker.follower_addresses:
-        response = requests.post(f"{follower_url}/follower_sync", json={})
+        response = sessions.post(f"{follower_url}/follower_sync", json={})
         if response.status_code != 200:
-            print("Issue sending request to follower")
+            raise RuntimeError(f"Follower {follower_url} failed to sync: {response.text}")
 
         files = response.json()['files']
-        file = open(f'{worker.mount_point}/load.sql', 'w')
+        checksums = response.json().get('checksums', {})
         for table in files:
-            file.write(f"\copy {table} FROM '{files[table]}' DELIMITER '|' CSV;\n")
-            delete_tables.add(table)
-        file.close()
-        # Load tables
-        subprocess.run([f"cd {worker.mount_point} && psql -U {db.user} -d {db.name} -f load.sql"], check=True, shell=True)
-    
+            follower_files[table].append(files[table])
+            follower_checksums[table][files[table]] = checksums.get(table)
+
+    # Follower partitions stay loaded, tagged with the manifest checksums of the files behind them, so
+    # only changed ones are reloaded (partitions without a checksum are reloaded and emptied every query)
+    versions = {table: files_version(checksums) if None not in checksums.values() else None for table, checksums in follower_checksums.items()}
+    with follower_lock:
+        loaded = db.load_files(follower_files, versions, **loading_options(loading))
+        for table in loaded:
+            db.analyze_table(table)
+    print(f"Loaded follower partitions {list(loaded)}, {len(follower_files) - len(loaded)} cached")
+
     start_time = time.time()
     results = db.execute_query(query)
-    end_time = time.time()
-    results.append({"query_time": end_time - start_time})
-    response = requests.post(agg_url, json={"results": results,
-                                            "query_id": query_id,
-                                            "worker_id": worker_id})
-    # Clean up tables
+    results.query_time = time.time() - start_time
+    return results, {table for table, version in versions.items() if version is None}
+
+def reduce_followers(payload: dict) -> tuple[ResultSet, set[str]]:
+    """Helper function to stage the rows this leader's followers ship and run the partial query over them."""
+    tables, pushdown = payload["tables"], payload.get("pushdown") or {}
+    for table in tables:
+        columns = dict(table_schemas[table])
+        db.create_staging_table(staging_schema(payload["query_id"]), table, [(column, columns[column]) for column in pushdown[table]["columns"]])
+
+    def send_to_follower(follower_url):
+        """Helper function to have a follower ship its rows to this leader."""
+        response = sessions.post(f"{follower_url}/process_data", json={**payload, "agg_url": None, "stream_url": None})
+        if response.status_code != 200:
+            raise RuntimeError(f"Follower {follower_url} failed to ship its data: {response.text}")
+
+    try:
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(send_to_follower, worker.follower_addresses))
+        start_time = time.time()
+        results = db.execute_query(payload["query"], [staging_schema(payload["query_id"]), "public"])
+        results.query_time = time.time() - start_time
+    finally:
+        db.drop_staging_schema(staging_schema(payload["query_id"]))
+    return results, set()
+
+"""
+Combines the partial results of this leader's subtree of the aggregation tree
+------------------------------------------------------------------------------------------
+@payload: the request, with the partial query in query and the client query in merge_query
+@endpoint: what child leaders are asked to run on their own subtrees
+@query_own: runs the partial query over this leader's followers, returning the result and
+            the tables to empty once it has been sent
+The child leaders report to this leader's /receive_result while it queries its own
+followers. The partial results are combined (see DecomposedQuery.combine) and sent to
+agg_url, or to this leader's own leader when the request came from it, so every node merges
+at most fanout inbound results.
+------------------------------------------------------------------------------------------
+"""
+def gather_subtree(payload: dict, endpoint: str, query_own) -> Response:
+    query_id = payload.get('query_id')
+    worker_id = payload.get('worker_id')
+    accept_encoding = payload.get('accept_encoding')
+    merge_query = payload.get('merge_query')
+    # Child leaders report to the leader that asked them
+    agg_url = payload.get('agg_url') or f"{worker.leader_address}/receive_result"
+
+    plan = decompose_query(merge_query) if merge_query else None
+    expected = list(worker.leader_addresses) + ([worker_id] if worker.follower_addresses else [])
+    pending = collector.register(query_id, expected, plan.combine if plan is not None else None)
+
+    def ask_leader(leader_url):
+        """Helper function to run the request on a child leader's subtree (it reports back on its own)."""
+        try:
+            response = sessions.post(f"{leader_url}/{endpoint}", json={**payload, "agg_url": None, "worker_id": leader_url}, timeout=collector.timeout)
+            if response.status_code != 200:
+                collector.fail(query_id, leader_url, response.text)
+        except Exception as e:
+            collector.fail(query_id, leader_url, str(e))
+
+    start_time = time.time()
+    delete_tables = set()
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(worker.leader_addresses), 1)) as executor:
+            for leader_url in worker.leader_addresses:
+                executor.submit(ask_leader, leader_url)
+            if worker.follower_addresses:
+                # A follower that failed to sync or ship its rows leaves this leader's own part missing
+                try:
+                    results, delete_tables = query_own()
+                    collector.deliver(query_id, worker_id, results)
+                except Exception as e:
+                    collector.fail(query_id, worker_id, str(e))
+            pending.wait(collector.timeout)
+    finally:
+        collector.discard(query_id)
+
+    # A subtree that did not report would silently drop its rows from the answer
+    if pending.missing:
+        for table in delete_tables:
+            db.delete_rows(table)
+        return make_response(f"Subtrees {pending.missing} did not report: {pending.errors}", 502)
+
+    results = pending.result()
+    results.query_time = time.time() - start_time
+    body = json.dumps({"results": results.to_json(),
+                       "query_id": query_id,
+                       "worker_id": worker_id}).encode("utf-8")
+    response = post_payload(agg_url, body, JSON_CONTENT_TYPE, accept_encoding, query_id)
+    # Clean up the partitions that could not be cached
     for table in delete_tables:
         db.delete_rows(table)
 
+    if response.status_code != 200:
+        return make_response(f"Error sending results to {agg_url}: {response.text}", response.status_code)
+    return make_response("Success", 200)
+
+# Runs a DISTRIBUTED mode query over this leader's subtree of the aggregation tree
+@app.route('/leader_results', methods=['POST'])
+def leader_results() -> Response:
+    global worker, db
+
+    query = request.json.get('query')
+    return gather_subtree(request.json, "leader_results", lambda: query_followers(query))
+
+# Followers of a reducing leader (LOCAL mode) ship their rows here
+@app.route('/receive_data', methods=['POST'])
+def receive_data() -> Response:
+    body, _ = decode_body(request.get_data(), request.headers)
+    table, rows = decode_data_batch(body, request.content_type)
+    db.copy_rows(Table(table, rows), staging_schema(request.headers.get(QUERY_ID_HEADER)))
+    return make_response("Success", 200)
+
+# Child leaders of the aggregation tree report their combined partial results here
+@app.route('/receive_result', methods=['POST'])
+def receive_result() -> Response:
+    body, _ = decode_body(request.get_data(), request.headers)
+    data = json.loads(body)
+    if not collector.deliver(data["query_id"], data["worker_id"], ResultSet.from_json(data["results"])):
+        print(f"Dropping result from leader {data['worker_id']} for unknown query {data['query_id']}")
     return make_response("Success", 200)
 
 
 def init_worker() -> None:
-    global worker, db
+    global worker, db, compression, sessions, loading, indexing, collector, table_schemas, generating
 
     # Get initial configurations
     host = os.getenv('DB_HOST', 'localhost')
@@ -179,8 +429,22 @@ def init_worker() -> None:
     password = os.getenv('DB_PASSWORD', 'postgres')
     schema = os.getenv('DB_SCHEMA', 'schema.sql')
 
+    # Get connection pool sizing
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    min_connections = int(config["DATABASE"]["min_connections"])
+    max_connections = int(config["DATABASE"]["max_connections"])
+    health_check_interval = float(config["DATABASE"]["health_check_interval"])
+    compression = CompressionPolicy(config["NETWORK"]["compression"], int(config["NETWORK"]["compression_min_size"]))
+    sessions = PeerSessions(int(config["NETWORK"]["session_pool_size"]))
+    loading = config["LOADING"]
+    indexing = config["INDEXING"]
+    generating = config["GENERATION"]
+    collector = ResultCollector(float(config["RESULTS"]["timeout"]))
+    table_schemas = load_schema(schema)
+
     # Initialize Database
-    db = Database(host, port, name, user, password, schema)
+    db = Database(host, port, name, user, password, schema, min_connections, max_connections, health_check_interval)
 
     # Initialize worker with basic init information
     worker = Worker()
@@ -3,6 +3,7 @@ import argparse
 import requests
 import sys
 import os
+import time
 import re
 
 TPC_H_TABLES = {"customer", "lineitem", "nation", "orders", "part", "partsupp", "region", "supplier"}
@@ -10,6 +11,9 @@ API_URL = "http://localhost:5001"
 SMART_INITIALIZATION_ENDPOINT = "/receive_smart_init"
 INITIALIZATION_ENDPOINT = "/receive_init"
 TASK_ENDPOINT = "/send_task"
+INIT_STATUS_ENDPOINT = "/init_status"
+GENERATION_STATUS_ENDPOINT = "/generation_status"
+INIT_POLL_INTERVAL = 2
 
 parser = argparse.ArgumentParser(description="Manager program that controls nodes setup and queries")
 parser.add_argument(
@@ -20,6 +24,10 @@ parser.add_argument(
 )
 parser.add_argument('-a', '--arch', type=int, help='<Required> Nodes architecture (0:DEFAULT|1:FOLLOWER)', required=True)
 parser.add_argument('-m', '--mode', type=int, help='<Required> Nodes mode (0:LOCAL|1:DISTRIBUTED)', required=True)
+parser.add_argument(
+    '-w', '--workload', nargs='+', default=[],
+    help='<Optional> SQL files workers build indexes for after loading (ex): test/test_queries/*.sql'
+)
 parser.add_argument(
     'sample_query', 
     type=str, 
@@ -39,14 +47,44 @@ class AggregatorArchitecture(Enum):
     FOLLOWER = 1
     NOT_SET = 2
 
+# Prints the rows each worker loaded and how unevenly they are spread (1.0 is perfectly even)
+def report_partitions(report: dict) -> None:
+    for table, entry in report["tables"].items():
+        print(f"{table:<10} {entry['method']:<10} rows={entry['rows']} imbalance={entry['imbalance']}")
+    print(f"Rows per worker: {report['worker_rows']} imbalance={report['imbalance']}")
+    indexes = report.get("indexes")
+    if indexes:
+        print(f"Workload indexes: {indexes['planned']} planned, build seconds per worker: {indexes['build_seconds']}")
+        for query, speedup in indexes["speedup"].items():
+            print(f"{query:<10} speedup={speedup}x")
+
+# Polls the aggregator until every worker has loaded its partitions (or one failed)
+def wait_for_initialization() -> None:
+    while True:
+        status = requests.get(API_URL + INIT_STATUS_ENDPOINT).json()
+        workers = ", ".join(f"{worker_id}:{worker['state']}" for worker_id, worker in status["workers"].items())
+        # While dbgen runs, show how many of its chunks are done instead
+        if status["phase"] == "generating":
+            generation = requests.get(API_URL + GENERATION_STATUS_ENDPOINT).json()
+            done = sum(job["state"] == "ready" for job in generation["workers"].values())
+            workers = f"{generation['phase'] or generation['state']} {done}/{len(generation['workers'])} dbgen runs"
+        print(f"[{status['elapsed']}s] {status['state']} {status['phase'] or ''} {workers}")
+        if status["state"] == "ready":
+            report_partitions(status["report"])
+            return
+        if status["state"] == "failed":
+            sys.exit(f"Error with initialization: {status['error']}")
+        time.sleep(INIT_POLL_INTERVAL)
+
 # Processes initialization of the system
-def smart_initialize_system(api_url: str, arch: AggregatorArchitecture, mode: AggregatorMode, sample_query: str, number_query: int) -> None:
+def smart_initialize_system(api_url: str, arch: AggregatorArchitecture, mode: AggregatorMode, sample_query: str, number_query: int, workload: dict[str, str]) -> None:
     # Prepare JSON payload
     payload = {
         "arch": arch.value,
         "mode": mode.value,
         "sample_query": sample_query,
-        "number_query": number_query
+        "number_query": number_query,
+        "workload": workload
     }
 
     # Send POST request
@@ -54,22 +92,26 @@ def smart_initialize_system(api_url: str, arch: AggregatorArchitecture, mode: Ag
     response = requests.post(api_url, json=payload, headers=headers)
     
     # Check for response status
-    if response.status_code != 200:
-        if response.status_code == 201:
-            print("System already initialized")
-        else:
-            sys.exit("Error with initialization")
+    if response.status_code == 201:
+        print("System already initialized")
+    elif response.status_code == 202:
+        wait_for_initialization()
+    elif response.status_code == 200:
+        report_partitions(response.json())
+    else:
+        sys.exit("Error with initialization")
     
     return
 
 # Processes initialization of the system
-def initialize_system(api_url: str, partition: list[str], non_partition: list[str], arch: AggregatorArchitecture, mode: AggregatorMode) -> None:
+def initialize_system(api_url: str, partition: list[str], non_partition: list[str], arch: AggregatorArchitecture, mode: AggregatorMode, workload: dict[str, str]) -> None:
     # Prepare JSON payload
     payload = {
         "partition": partition,
         "non_partition": non_partition,
         "arch": arch.value,
-        "mode": mode.value
+        "mode": mode.value,
+        "workload": workload
     }
 
     # Send POST request
@@ -77,11 +119,14 @@ def initialize_system(api_url: str, partition: list[str], non_partition: list[st
     response = requests.post(api_url, json=payload, headers=headers)
     
     # Check for response status
-    if response.status_code != 200:
-        if response.status_code == 201:
-            print("System already initialized")
-        else:
-            sys.exit("Error with initialization")
+    if response.status_code == 201:
+        print("System already initialized")
+    elif response.status_code == 202:
+        wait_for_initialization()
+    elif response.status_code == 200:
+        report_partitions(response.json())
+    else:
+        sys.exit("Error with initialization")
     
     return
 
@@ -123,6 +168,10 @@ def verify_arguments(args):
     if args.sample_query and not os.path.isfile(args.sample_query):
         sys.exit('Not a valid path to a .sql file')
 
+    for path in args.workload:
+        if not os.path.isfile(path):
+            sys.exit(f'Not a valid path to a .sql file: {path}')
+
 def main() -> None:
     args = parser.parse_args()
     verify_arguments(args)
@@ -132,6 +181,7 @@ def main() -> None:
     mode = AggregatorMode(args.mode)
     sample_query = args.sample_query if args.sample_query else None
     number_query = None
+    workload = {os.path.basename(path): open(path, 'r').read() for path in args.workload}
 
     if sample_query:
         number_query = int(re.findall(r'\d+', sample_query)[0])
@@ -139,9 +189,9 @@ def main() -> None:
 
     # Initialize the system with command line arguments
     if sample_query and number_query:
-        smart_initialize_system(API_URL + SMART_INITIALIZATION_ENDPOINT, arch, mode, sample_query, number_query)
+        smart_initialize_system(API_URL + SMART_INITIALIZATION_ENDPOINT, arch, mode, sample_query, number_query, workload)
     else:
-        initialize_system(API_URL + INITIALIZATION_ENDPOINT, partition, non_partition, arch, mode)
+        initialize_system(API_URL + INITIALIZATION_ENDPOINT, partition, non_partition, arch, mode, workload)
 
     
     # Prompt the user for queries 